@@ -0,0 +1,239 @@
+"""
+Benchmark da conferência: extração, parsers, planilha, conciliação e o endpoint completo.
+
+    python benchmarks/benchmark.py                       # 100, 1.000 e 10.000 transações
+    python benchmarks/benchmark.py --tamanhos 100 1000 --repeticoes 5
+    python benchmarks/benchmark.py --comparar benchmarks/resultados/20261018-120000.json
+
+Cada execução grava benchmarks/resultados/<data>-<hora>.json e compara com a execução
+anterior (ou com o arquivo de --comparar), mostrando a variação da mediana por etapa.
+Os resultados são da máquina em que rodaram e ficam fora do git (.gitignore).
+O cache de arquivos do servidor é desligado para que toda repetição refaça o trabalho.
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, List, Any
+
+PASTA = os.path.dirname(os.path.abspath(__file__))
+RAIZ = os.path.dirname(PASTA)
+PASTA_RESULTADOS = os.path.join(PASTA, "resultados")
+
+# precisa valer antes de importar o servidor
+os.environ["CONFERIR_CACHE_DIR"] = ""
+os.environ["CONFERIR_CACHE_MEMORIA_MB"] = "0"
+os.environ.setdefault("CONFERIR_LOG_NIVEL", "WARNING")
+
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, PASTA)
+
+import servidor  # noqa: E402
+from gerar_dados import cenario  # noqa: E402
+
+
+# ==========================================================
+# ⏱️ Medição
+# ==========================================================
+def cronometrar(func: Callable[[], Any], repeticoes: int) -> Dict[str, float]:
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        func()
+        tempos.append(time.perf_counter() - inicio)
+    return {"mediana": statistics.median(tempos), "minimo": min(tempos), "maximo": max(tempos)}
+
+
+# ==========================================================
+# 🌐 Chamada ao endpoint sem servidor HTTP (direto no app ASGI)
+# ==========================================================
+def corpo_multipart(arquivos: List[tuple], campos: Dict[str, str] = None):
+    """arquivos = [(campo, nome_arquivo, bytes)] → (content-type, corpo)"""
+    fronteira = uuid.uuid4().hex
+    partes = []
+    for campo, valor in (campos or {}).items():
+        partes.append(
+            f'--{fronteira}\r\nContent-Disposition: form-data; name="{campo}"\r\n\r\n{valor}\r\n'.encode("utf-8")
+        )
+    for campo, nome, conteudo in arquivos:
+        partes.append(
+            f'--{fronteira}\r\nContent-Disposition: form-data; name="{campo}"; filename="{nome}"\r\n'
+            f"Content-Type: application/octet-stream\r\n\r\n".encode("utf-8") + conteudo + b"\r\n"
+        )
+    partes.append(f"--{fronteira}--\r\n".encode("utf-8"))
+    return f"multipart/form-data; boundary={fronteira}", b"".join(partes)
+
+
+async def chamar_app(metodo: str, caminho: str, content_type: str = None, corpo: bytes = b""):
+    """Executa uma requisição no `servidor.app` e devolve (status, corpo da resposta)."""
+    cabecalhos = [(b"content-length", str(len(corpo)).encode())]
+    if content_type:
+        cabecalhos.append((b"content-type", content_type.encode()))
+    escopo = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": metodo,
+        "scheme": "http", "path": caminho, "raw_path": caminho.encode(), "query_string": b"",
+        "headers": cabecalhos, "client": ("127.0.0.1", 0), "server": ("benchmark", 80), "root_path": "",
+    }
+    enviado = False
+    resposta = {"status": 0, "corpo": b""}
+
+    async def receber():
+        nonlocal enviado
+        if enviado:
+            await asyncio.sleep(3600)
+            return {"type": "http.disconnect"}
+        enviado = True
+        return {"type": "http.request", "body": corpo, "more_body": False}
+
+    async def enviar(mensagem):
+        if mensagem["type"] == "http.response.start":
+            resposta["status"] = mensagem["status"]
+        elif mensagem["type"] == "http.response.body":
+            resposta["corpo"] += mensagem.get("body", b"")
+
+    await servidor.app(escopo, receber, enviar)
+    return resposta["status"], resposta["corpo"]
+
+
+# ==========================================================
+# 🏁 Cenários
+# ==========================================================
+def medir_tamanho(n: int, repeticoes: int) -> Dict[str, Any]:
+    arquivos = cenario(n)
+    bb, c6, planilha = arquivos["bb.pdf"], arquivos["c6.pdf"], arquivos["agentes.xlsx"]
+
+    extracao_bb = servidor.extrair_paginas(bb)
+    extracao_c6 = servidor.extrair_paginas(c6)
+    dados_pdf = servidor.juntar_transacoes(
+        [servidor.processar_extracao(extracao_bb)["dados"], servidor.processar_extracao(extracao_c6)["dados"]],
+        servidor.CAMPOS_PDF,
+    )
+    dados_excel = servidor.processar_excel(planilha)["tabela"]
+
+    def conciliacao():
+        resultado = servidor.conciliar(dados_pdf, dados_excel)
+        return servidor.expandir_conciliacao(resultado, dados_pdf, dados_excel)
+
+    etapas = {
+        "extracao_bb": lambda: servidor.extrair_paginas(bb),
+        "extracao_c6": lambda: servidor.extrair_paginas(c6),
+        "parser_bb": lambda: servidor.processar_extracao(extracao_bb),
+        "parser_c6": lambda: servidor.processar_extracao(extracao_c6),
+        "excel": lambda: servidor.processar_excel(planilha),
+        "conciliacao": conciliacao,
+    }
+    resultado = {nome: cronometrar(func, repeticoes) for nome, func in etapas.items()}
+
+    content_type, corpo = corpo_multipart([("pdfs", "bb.pdf", bb), ("pdfs", "c6.pdf", c6), ("excels", "agentes.xlsx", planilha)])
+
+    async def endpoint():
+        status, resposta = await chamar_app("POST", "/conferir_caixa", content_type, corpo)
+        if status != 200 or b'"erro"' in resposta[:200]:
+            raise RuntimeError(f"/conferir_caixa respondeu {status}: {resposta[:200]!r}")
+
+    async def medir_endpoint():
+        tempos = []
+        for _ in range(repeticoes):
+            inicio = time.perf_counter()
+            await endpoint()
+            tempos.append(time.perf_counter() - inicio)
+        servidor.encerrar_pool()
+        return {"mediana": statistics.median(tempos), "minimo": min(tempos), "maximo": max(tempos)}
+
+    resultado["endpoint"] = asyncio.run(medir_endpoint())
+
+    conferencia = conciliacao()
+    return {
+        "etapas": resultado,
+        "volumes": {
+            "paginas": extracao_bb["num_paginas"] + extracao_c6["num_paginas"],
+            "pix_pdf": dados_pdf["n"],
+            "linhas_excel": dados_excel["n"],
+            "conferidos": len(conferencia["conferidos"]),
+            "faltando_no_pdf": len(conferencia["faltando_no_pdf"]),
+            "faltando_no_excel": len(conferencia["faltando_no_excel"]),
+        },
+    }
+
+
+# ==========================================================
+# 💾 Resultados
+# ==========================================================
+def commit_atual() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def ultimo_resultado() -> str | None:
+    arquivos = sorted(glob.glob(os.path.join(PASTA_RESULTADOS, "*.json")))
+    return arquivos[-1] if arquivos else None
+
+
+def comparar(atual: Dict[str, Any], anterior: Dict[str, Any]):
+    print(f"\nComparação com {anterior.get('commit') or '?'} ({anterior.get('data', '?')}):")
+    for tamanho, dados in atual["tamanhos"].items():
+        antes = anterior.get("tamanhos", {}).get(tamanho)
+        if not antes:
+            continue
+        for etapa, t in dados["etapas"].items():
+            t_antes = antes["etapas"].get(etapa)
+            if not t_antes or not t_antes["mediana"]:
+                continue
+            variacao = (t["mediana"] / t_antes["mediana"] - 1) * 100
+            alerta = "  ⚠️" if variacao > 10 else ""
+            print(f"  {tamanho:>6} {etapa:<12} {t_antes['mediana']:9.4f}s → {t['mediana']:9.4f}s  ({variacao:+6.1f}%){alerta}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark da conferência de caixa.")
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--comparar", help="arquivo de resultado usado na comparação (padrão: o mais recente)")
+    parser.add_argument("--nao-salvar", action="store_true", help="só mostra, sem gravar em benchmarks/resultados")
+    args = parser.parse_args()
+
+    referencia = args.comparar or ultimo_resultado()
+
+    atual = {
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit_atual(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "workers": servidor.CONFERIR_WORKERS,
+        "repeticoes": args.repeticoes,
+        "tamanhos": {},
+    }
+    for n in args.tamanhos:
+        print(f"\n▶ {n} transações")
+        dados = medir_tamanho(n, args.repeticoes)
+        atual["tamanhos"][str(n)] = dados
+        print("  " + ", ".join(f"{k}={v}" for k, v in dados["volumes"].items()))
+        for etapa, t in dados["etapas"].items():
+            print(f"  {etapa:<12} mediana {t['mediana']:9.4f}s  (mín {t['minimo']:.4f}s, máx {t['maximo']:.4f}s)")
+
+    if referencia:
+        with open(referencia, encoding="utf-8") as f:
+            comparar(atual, json.load(f))
+
+    if not args.nao_salvar:
+        os.makedirs(PASTA_RESULTADOS, exist_ok=True)
+        caminho = os.path.join(PASTA_RESULTADOS, datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+        with open(caminho, "w", encoding="utf-8") as f:
+            json.dump(atual, f, ensure_ascii=False, indent=2)
+        print(f"\nResultado gravado em {caminho}")
+
+
+if __name__ == "__main__":
+    main()
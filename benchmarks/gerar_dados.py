@@ -0,0 +1,226 @@
+"""
+Geração de dados sintéticos para os benchmarks.
+
+Extratos do Banco do Brasil e do C6 Bank no layout que `detalhe_bb` e `extrair_pix_c6`
+esperam e planilhas de agentes no layout 'AGENTE:' lido por `processar_excel`.
+
+Uso avulso (grava os arquivos numa pasta para testar o frontend à mão):
+    python benchmarks/gerar_dados.py 1000 --saida /tmp/conferencia
+"""
+import argparse
+import io
+import os
+import random
+import zlib
+from typing import List, Dict, Any
+
+import openpyxl
+
+PRIMEIROS_NOMES = [
+    "MARIA", "JOSE", "ANA", "CARLOS", "FRANCISCA", "ANTONIO", "JOAO", "LUCIANA", "PEDRO",
+    "FERNANDA", "RAIMUNDO", "SEBASTIAO", "PAULO", "ADRIANA", "MARCOS", "JULIANA", "RAFAEL",
+    "PATRICIA", "LUCAS", "ALINE", "BRUNO", "CAMILA", "DIEGO", "ELAINE", "FABIO", "GABRIELA",
+    "HELIO", "IRACEMA", "JORGE", "KARINA", "LEANDRO", "MONICA", "NATALIA", "OSVALDO",
+]
+SOBRENOMES = [
+    "SILVA", "SANTOS", "OLIVEIRA", "SOUZA", "RODRIGUES", "FERREIRA", "ALVES", "PEREIRA", "LIMA",
+    "GOMES", "COSTA", "RIBEIRO", "MARTINS", "CARVALHO", "ALMEIDA", "LOPES", "SOARES", "FERNANDES",
+    "VIEIRA", "BARBOSA", "ROCHA", "DIAS", "NASCIMENTO", "ANDRADE", "MOREIRA", "NUNES", "MARQUES",
+    "MACHADO", "MENDES", "FREITAS", "CARDOSO", "RAMOS", "ARAUJO", "BATISTA", "TEIXEIRA", "MOURA",
+]
+
+
+# ==========================================================
+# 🧾 PDF mínimo (texto puro, uma linha por lançamento)
+# ==========================================================
+def pdf_de_paginas(paginas: List[List[str]]) -> bytes:
+    """Monta um PDF com uma fonte padrão e uma linha de texto por item de cada página."""
+    objetos: List[bytes] = []
+
+    def novo(conteudo: bytes) -> int:
+        objetos.append(conteudo)
+        return len(objetos)
+
+    fonte = novo(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+    id_paginas = novo(b"")
+    filhas = []
+    for linhas in paginas:
+        ops = ["BT", "/F1 8 Tf", "10 TL", "30 810 Td"]
+        for linha in linhas:
+            texto = linha.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            ops.append(f"({texto}) Tj T*")
+        ops.append("ET")
+        dados = zlib.compress("\n".join(ops).encode("latin-1"))
+        conteudo = novo(b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(dados) + dados + b"\nendstream")
+        filhas.append(novo(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (id_paginas, fonte, conteudo)
+        ))
+    objetos[id_paginas - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % f for f in filhas), len(filhas)
+    )
+    catalogo = novo(b"<< /Type /Catalog /Pages %d 0 R >>" % id_paginas)
+
+    saida = io.BytesIO()
+    saida.write(b"%PDF-1.4\n")
+    posicoes = []
+    for i, obj in enumerate(objetos, 1):
+        posicoes.append(saida.tell())
+        saida.write(b"%d 0 obj\n" % i + obj + b"\nendobj\n")
+    inicio_xref = saida.tell()
+    saida.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objetos) + 1))
+    for pos in posicoes:
+        saida.write(b"%010d 00000 n \n" % pos)
+    saida.write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objetos) + 1, catalogo, inicio_xref))
+    return saida.getvalue()
+
+
+def formatar_valor(v: float) -> str:
+    """1234.5 → '1.234,50'"""
+    return f"{v:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+
+
+# ==========================================================
+# 💸 Transações
+# ==========================================================
+def nomes_distintos(n: int, seed: int = 1) -> List[str]:
+    """`n` nomes diferentes entre si (nome + dois sobrenomes)."""
+    r = random.Random(seed)
+    combinacoes = [(p, s1, s2) for p in PRIMEIROS_NOMES for s1 in SOBRENOMES for s2 in SOBRENOMES if s1 != s2]
+    r.shuffle(combinacoes)
+    if n > len(combinacoes):
+        raise ValueError(f"No máximo {len(combinacoes)} nomes distintos.")
+    return [" ".join(c) for c in combinacoes[:n]]
+
+
+def gerar_transacoes(n: int, seed: int = 1, dia: str = "15/10/2025") -> List[Dict[str, Any]]:
+    """PIX recebidos ao longo do dia, com valores variados e ~5% de pagadores só com CNPJ."""
+    r = random.Random(seed)
+    nomes = nomes_distintos(n, seed)
+    transacoes = []
+    for i in range(n):
+        minutos = 7 * 60 + (i * 14 * 60) // max(n, 1)
+        transacoes.append({
+            "data": dia,
+            "hora": f"{minutos // 60:02d}:{minutos % 60:02d}",
+            "nome": nomes[i],
+            "valor": round(r.choice([10, 20, 25, 50, 80, 100, 150, 200, 350, 1200]) + r.randint(0, 99) / 100, 2),
+            "cnpj": r.random() < 0.05,
+        })
+    return transacoes
+
+
+# ==========================================================
+# 🟡 Extrato Banco do Brasil
+# ==========================================================
+def pdf_bb(transacoes: List[Dict[str, Any]], lancamentos_por_pagina: int = 35) -> bytes:
+    """
+    Uma linha 'Pix - Recebido <valor> (+)' seguida de 'dd/mm hh:mm <documento> <nome>',
+    com PIX enviados intercalados e o cabeçalho repetido em cada página.
+    """
+    cabecalho = [
+        "BANCO DO BRASIL", "Extrato de Conta Corrente", "Cliente EMPRESA EXEMPLO LTDA",
+        "Agência: 1234-5 Conta: 12345-6", "Lançamentos", "Dia Lote Documento Histórico Valor",
+    ]
+    paginas, atual, na_pagina = [], list(cabecalho), 0
+    for i, t in enumerate(transacoes):
+        dia = t["data"]
+        atual.append(f"{dia} 0000 14397 Pix - Recebido {formatar_valor(t['valor'])} (+)")
+        pagador = "12.345.678/0001-%02d" % (i % 100) if t["cnpj"] else t["nome"]
+        atual.append(f"{dia[:5]} {t['hora']} {1000000 + i:09d} {pagador}")
+        if i % 7 == 3:
+            atual.append(f"{dia} 0000 99999 Pix - Enviado {formatar_valor(35.0)} (-)")
+        na_pagina += 1
+        if na_pagina >= lancamentos_por_pagina:
+            paginas.append(atual)
+            atual, na_pagina = list(cabecalho), 0
+    atual.append("Saldo 10.000,00")
+    paginas.append(atual)
+    return pdf_de_paginas(paginas)
+
+
+# ==========================================================
+# 🟢 Extrato C6 Bank
+# ==========================================================
+def pdf_c6(transacoes: List[Dict[str, Any]], lancamentos_por_pagina: int = 70) -> bytes:
+    """Uma linha 'dd/mm Pix recebido de <nome> R$ <valor> às hh:mm' por lançamento."""
+    cabecalho = ["C6 BANK", "Extrato de conta corrente", "Data Descrição Valor"]
+    paginas, atual = [], list(cabecalho)
+    for t in transacoes:
+        atual.append(f"{t['data'][:5]} Pix recebido de {t['nome']} R$ {formatar_valor(t['valor'])} às {t['hora']}")
+        if len(atual) - len(cabecalho) >= lancamentos_por_pagina:
+            paginas.append(atual)
+            atual = list(cabecalho)
+    paginas.append(atual)
+    return pdf_de_paginas(paginas)
+
+
+# ==========================================================
+# 📊 Planilha dos agentes
+# ==========================================================
+def planilha_agentes(
+    transacoes: List[Dict[str, Any]],
+    agentes: int = 5,
+    proporcao_casadas: float = 0.9,
+    seed: int = 2,
+) -> bytes:
+    """
+    Blocos 'AGENTE: <nome> ... <setor>' com as colunas NOME / HORA / VALOR (0 / 1 / 4).
+    `proporcao_casadas` das transações entram como estão no extrato (com variações de
+    formato de hora, valor e caixa do nome); o resto vira linha sem par no PDF
+    (nome e valor alterados). Os PIX que ficaram de fora aparecem como faltando no Excel.
+    """
+    r = random.Random(seed)
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Caixa"
+    estranhos = nomes_distintos(len(transacoes) + 1, seed + 1000)
+
+    for a in range(agentes):
+        ws.append([f"AGENTE: AGENTE {a + 1:02d}", None, None, None, None, "LOJA CENTRO"])
+        ws.append(["NOME", "HORA", None, None, "VALOR"])
+        for i, t in enumerate(transacoes[a::agentes]):
+            if t["cnpj"] or r.random() < 0.03:
+                continue  # PIX sem lançamento na planilha
+            hora, valor, nome = t["hora"], t["valor"], t["nome"]
+            if r.random() >= proporcao_casadas:
+                nome = estranhos[i]
+                valor = round(valor + r.choice([3, 7, 15, 40]), 2)
+            if r.random() < 0.3:
+                hora = hora.replace(":", "h")
+            if r.random() < 0.3:
+                valor = formatar_valor(valor)
+            if r.random() < 0.5:
+                nome = nome.title()
+            ws.append([nome, hora, None, None, valor])
+        ws.append(["TOTAL", None, None, None, None])
+
+    saida = io.BytesIO()
+    wb.save(saida)
+    return saida.getvalue()
+
+
+def cenario(n: int, seed: int = 1) -> Dict[str, bytes]:
+    """Metade das `n` transações no extrato BB, metade no C6, e uma planilha com todas."""
+    transacoes = gerar_transacoes(n, seed)
+    metade = n // 2
+    return {
+        "bb.pdf": pdf_bb(transacoes[:metade]),
+        "c6.pdf": pdf_c6(transacoes[metade:]),
+        "agentes.xlsx": planilha_agentes(transacoes, seed=seed + 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gera extratos e planilha sintéticos.")
+    parser.add_argument("transacoes", type=int, help="número de transações")
+    parser.add_argument("--saida", default="dados_sinteticos", help="pasta de destino")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    os.makedirs(args.saida, exist_ok=True)
+    for nome, conteudo in cenario(args.transacoes, args.seed).items():
+        caminho = os.path.join(args.saida, nome)
+        with open(caminho, "wb") as f:
+            f.write(conteudo)
+        print(f"{caminho}: {len(conteudo) / 1024:.0f} KB")
@@ -0,0 +1,319 @@
+"""
+Conferência em lote, sem servidor: pastas inteiras de extratos (PDF) e planilhas dos agentes.
+
+    python conferir_lote.py extratos/ planilhas/
+    python conferir_lote.py outubro/ --saida resultados/outubro --formato csv xlsx json
+    python conferir_lote.py outubro/ --processos 4 --senha 1234
+
+As pastas são percorridas com subpastas; .pdf são extratos e .xlsx/.xlsm/.xls, planilhas.
+Cada arquivo é de um dia: a data vem do nome do arquivo ou de uma das pastas dele
+(2025-10-15, 15-10-2025, 15.10.2025 ou 20251015). Sem data no caminho, o extrato fica no
+dia da maioria dos seus PIX e a planilha no único dia do lote (se houver mais de um, ela
+é ignorada, com aviso).
+
+Os arquivos são lidos em paralelo (processar_pdf / processar_excel) e depois cada dia é
+conciliado num processo do pool (conciliar + expandir_conciliacao), como no /conferir_caixa.
+Com CONFERIR_HISTORICO_DB, a conciliação usa os apelidos gravados pelo servidor; o lote só
+lê o histórico, não grava nele.
+Na pasta de saída ficam conferidos, faltando_no_pdf e faltando_no_excel (com a coluna
+"dia") em cada formato pedido, e resumo.json com volumes, tempos e vazão.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+from typing import Any, Dict, List
+
+import pandas as pd
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+
+# precisa valer antes de importar o servidor: o pool aqui é o deste script
+os.environ["CONFERIR_WORKERS"] = "0"
+os.environ.setdefault("CONFERIR_LOG_NIVEL", "WARNING")
+
+sys.path.insert(0, RAIZ)
+
+import servidor  # noqa: E402
+
+EXTENSOES = {".pdf": "pdf", ".xlsx": "excel", ".xlsm": "excel", ".xls": "excel"}
+LISTAS = {
+    "conferidos": [
+        "dia", "agente", "nome_excel", "nome_pdf", "valor_excel", "valor_pdf", "hora_excel",
+        "hora_pdf", "data_pdf", "similaridade", "analise", "banco",
+    ],
+    "faltando_no_pdf": ["dia", "agente", "nome", "hora", "valor", "banco", "motivo"],
+    "faltando_no_excel": ["dia", "nome", "hora", "valor", "data", "banco"],
+}
+
+# (regex, ordem dos grupos) — a primeira data válida do nome do arquivo, depois das pastas
+_DATAS_NO_CAMINHO = [
+    (re.compile(r"(?<!\d)(\d{4})[-_.](\d{2})[-_.](\d{2})(?!\d)"), "amd"),
+    (re.compile(r"(?<!\d)(\d{2})[-_.](\d{2})[-_.](\d{4})(?!\d)"), "dma"),
+    (re.compile(r"(?<!\d)(\d{4})(\d{2})(\d{2})(?!\d)"), "amd"),
+]
+
+
+# ==========================================================
+# 📂 Arquivos e dias
+# ==========================================================
+def listar_arquivos(pastas: List[str]) -> List[Dict[str, Any]]:
+    """[{tipo, caminho, pasta}] de todos os PDFs e planilhas, em ordem de caminho."""
+    arquivos = []
+    for pasta in pastas:
+        for raiz, _, nomes in os.walk(pasta):
+            for nome in nomes:
+                tipo = EXTENSOES.get(os.path.splitext(nome)[1].lower())
+                if tipo and not nome.startswith("~$"):  # ~$ = arquivo de trava do Excel
+                    arquivos.append({"tipo": tipo, "caminho": os.path.join(raiz, nome), "pasta": pasta})
+    return sorted(arquivos, key=lambda a: a["caminho"])
+
+
+def dia_do_caminho(caminho: str, pasta: str) -> date | None:
+    partes = os.path.relpath(caminho, pasta).split(os.sep)
+    for parte in reversed(partes):
+        for regex, ordem in _DATAS_NO_CAMINHO:
+            for m in regex.finditer(parte):
+                a, b, c = (int(g) for g in m.groups())
+                try:
+                    return date(a, b, c) if ordem == "amd" else date(c, b, a)
+                except ValueError:
+                    continue
+    return None
+
+
+def lote_do_arquivo(arquivo: Dict[str, Any]) -> Dict[str, Any]:
+    return arquivo["resp"]["dados"] if arquivo["tipo"] == "pdf" else arquivo["resp"]["tabela"]
+
+
+def dia_dos_pix(lote: Dict[str, Any]) -> date | None:
+    """Dia da maioria dos PIX do extrato."""
+    contagem = Counter(d for d in servidor.valores_coluna(lote, "data") if d)
+    return servidor.try_parse_date(contagem.most_common(1)[0][0]) if contagem else None
+
+
+# ==========================================================
+# ⚙️ Trabalho de cada processo do pool
+# ==========================================================
+def ler_arquivo(tipo: str, caminho: str, senha: str = None) -> Dict[str, Any]:
+    try:
+        return servidor.processar_pdf(caminho, senha) if tipo == "pdf" else servidor.processar_excel(caminho)
+    except Exception as e:
+        return {"erro": f"Falha ao processar: {e}"}
+
+
+def conferir_dia(lotes_pdf: List[Dict[str, Any]], lotes_excel: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    A conciliação do /conferir_caixa para os arquivos de um dia, com os apelidos do
+    histórico (se CONFERIR_HISTORICO_DB estiver configurado) e sem gravar nele.
+    """
+    dados_pdf = servidor.juntar_transacoes(lotes_pdf, servidor.CAMPOS_PDF)
+    if not dados_pdf["n"]:
+        return {"erro": "Nenhum PDF válido ou sem PIX encontrado."}
+    dados_excel = servidor.juntar_transacoes(lotes_excel, servidor.CAMPOS_EXCEL)
+    if not dados_excel["n"]:
+        return {"erro": "Nenhum dado válido encontrado nas planilhas enviadas."}
+    apelidos = {}
+    if servidor.CONFERIR_HISTORICO_DB:
+        apelidos = servidor.carregar_apelidos(servidor.valores_coluna(dados_excel, "nome"))
+    indices = servidor.conciliar(dados_pdf, dados_excel, apelidos=apelidos)
+    metricas = indices.pop("_metricas")
+    return {
+        **servidor.expandir_conciliacao(indices, dados_pdf, dados_excel),
+        "pix": dados_pdf["n"],
+        "linhas": dados_excel["n"],
+        "_metricas": metricas,
+    }
+
+
+# ==========================================================
+# 💾 Saída
+# ==========================================================
+def gravar_saida(pasta: str, formatos: List[str], resultados: Dict[date, Dict[str, Any]]) -> List[str]:
+    os.makedirs(pasta, exist_ok=True)
+    tabelas = {
+        lista: [
+            {"dia": dia.strftime("%d/%m/%Y"), **item}
+            for dia, resultado in sorted(resultados.items())
+            for item in resultado[lista]
+        ]
+        for lista in LISTAS
+    }
+    gravados = []
+    if "json" in formatos:
+        caminho = os.path.join(pasta, "conferencia.json")
+        with open(caminho, "w", encoding="utf-8") as f:
+            json.dump(tabelas, f, ensure_ascii=False, indent=2)
+        gravados.append(caminho)
+    if "csv" in formatos:
+        for lista, colunas in LISTAS.items():
+            caminho = os.path.join(pasta, f"{lista}.csv")
+            # ; e vírgula decimal: abre direto no Excel em português
+            pd.DataFrame(tabelas[lista], columns=colunas).to_csv(
+                caminho, sep=";", decimal=",", index=False, encoding="utf-8-sig"
+            )
+            gravados.append(caminho)
+    if "xlsx" in formatos:
+        caminho = os.path.join(pasta, "conferencia.xlsx")
+        with pd.ExcelWriter(caminho, engine="openpyxl") as planilha:
+            for lista, colunas in LISTAS.items():
+                pd.DataFrame(tabelas[lista], columns=colunas).to_excel(planilha, sheet_name=lista, index=False)
+        gravados.append(caminho)
+    return gravados
+
+
+def por_segundo(quantidade: float, segundos: float) -> float:
+    return round(quantidade / segundos, 1) if segundos > 0 else 0.0
+
+
+# ==========================================================
+# ▶️ Lote
+# ==========================================================
+def main():
+    parser = argparse.ArgumentParser(description="Conferência de caixa em lote (pastas de extratos e planilhas).")
+    parser.add_argument("pastas", nargs="+", help="pastas com os PDFs e as planilhas (subpastas incluídas)")
+    parser.add_argument("--saida", default="conferencia_lote", help="pasta dos resultados (padrão: ./conferencia_lote)")
+    parser.add_argument("--formato", nargs="+", choices=["csv", "xlsx", "json"], default=["csv"])
+    parser.add_argument("--processos", type=int, default=os.cpu_count() or 1, help="processos do pool (padrão: nº de CPUs)")
+    parser.add_argument("--senha", help="senha dos PDFs protegidos")
+    args = parser.parse_args()
+
+    pastas, saida = args.pastas, args.saida
+    for pasta in pastas:
+        if not os.path.isdir(pasta):
+            parser.error(f"pasta não encontrada: {pasta}")
+
+    arquivos = listar_arquivos(pastas)
+    if not arquivos:
+        parser.error("nenhum PDF ou planilha nas pastas informadas")
+
+    # os caches de nomes do servidor ficam divididos entre este processo e os do pool
+    processos = max(1, args.processos)
+    servidor.configurar_caches_nomes(processos + 1)
+
+    metricas = servidor.nova_metricas()
+    avisos = []
+    inicio = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=processos, initializer=servidor.configurar_caches_nomes, initargs=(processos + 1,)
+    ) as pool:
+        # 1) leitura de todos os arquivos
+        with servidor.medir(metricas["tempos"], "leitura"):
+            futuros = {pool.submit(ler_arquivo, a["tipo"], a["caminho"], args.senha): a for a in arquivos}
+            for futuro in as_completed(futuros):
+                arquivo = futuros[futuro]
+                try:
+                    resp = futuro.result()
+                except Exception as e:  # ex.: processo do pool morto; o arquivo fica de fora
+                    resp = {"erro": f"Falha ao processar: {e}"}
+                servidor.acumular_metricas(metricas, resp)
+                if "erro" in resp:
+                    avisos.append(f"{arquivo['caminho']}: {resp['erro']}")
+                arquivo["resp"] = resp
+
+        # 2) agrupamento por dia
+        dias: Dict[date, Dict[str, list]] = {}
+        usados, sem_dia = [], []
+        for arquivo in arquivos:
+            resp = arquivo["resp"]
+            if "erro" in resp:
+                continue
+            dia = dia_do_caminho(arquivo["caminho"], arquivo["pasta"])
+            if dia is None and arquivo["tipo"] == "pdf":
+                dia = dia_dos_pix(resp["dados"])
+            if dia is None:
+                sem_dia.append(arquivo)
+                continue
+            dias.setdefault(dia, {"pdf": [], "excel": []})[arquivo["tipo"]].append(lote_do_arquivo(arquivo))
+            usados.append(arquivo)
+        for arquivo in sem_dia:
+            if len(dias) == 1:
+                dias[next(iter(dias))][arquivo["tipo"]].append(lote_do_arquivo(arquivo))
+                usados.append(arquivo)
+            else:
+                avisos.append(f"{arquivo['caminho']}: sem data no nome ou na pasta; ignorado")
+
+        # 3) conciliação, um dia por tarefa
+        resultados: Dict[date, Dict[str, Any]] = {}
+        with servidor.medir(metricas["tempos"], "conciliacao_dias"):
+            futuros = {pool.submit(conferir_dia, grupo["pdf"], grupo["excel"]): dia for dia, grupo in dias.items()}
+            for futuro in as_completed(futuros):
+                dia = futuros[futuro]
+                try:
+                    resultado = futuro.result()
+                except Exception as e:  # um dia com erro não derruba os outros
+                    avisos.append(f"{dia:%d/%m/%Y}: {e}")
+                    continue
+                servidor.acumular_metricas(metricas, resultado)
+                if "erro" in resultado:
+                    avisos.append(f"{dia:%d/%m/%Y}: {resultado['erro']}")
+                    continue
+                resultados[dia] = resultado
+                print(
+                    f"  {dia:%d/%m/%Y}: {resultado['pix']} PIX, {resultado['linhas']} linhas → "
+                    f"{len(resultado['conferidos'])} conferidos, {len(resultado['faltando_no_pdf'])} faltando no PDF, "
+                    f"{len(resultado['faltando_no_excel'])} faltando no Excel"
+                )
+
+    # 4) gravação
+    with servidor.medir(metricas["tempos"], "gravacao"):
+        gravados = gravar_saida(saida, args.formato, resultados)
+    total = time.perf_counter() - inicio
+
+    com_erro = sum("erro" in a["resp"] for a in arquivos)
+    pdfs = [a for a in usados if a["tipo"] == "pdf"]
+    volumes = {
+        "arquivos": len(arquivos),
+        "arquivos_com_erro": com_erro,
+        "arquivos_sem_dia": len(arquivos) - com_erro - len(usados),
+        "pdfs": len(pdfs),
+        "paginas": sum(a["resp"].get("paginas", 0) for a in pdfs),
+        "pix": sum(a["resp"]["dados"]["n"] for a in pdfs),
+        "planilhas": len(usados) - len(pdfs),
+        "linhas": sum(a["resp"]["tabela"]["n"] for a in usados if a["tipo"] == "excel"),
+        "dias": len(resultados),
+        "conferidos": sum(len(r["conferidos"]) for r in resultados.values()),
+        "faltando_no_pdf": sum(len(r["faltando_no_pdf"]) for r in resultados.values()),
+        "faltando_no_excel": sum(len(r["faltando_no_excel"]) for r in resultados.values()),
+    }
+    resumo = {
+        "processos": processos,
+        "volumes": volumes,
+        "segundos": {"total": round(total, 3), **{etapa: round(s, 3) for etapa, s in metricas["tempos"].items()}},
+        "por_segundo": {
+            "arquivos": por_segundo(volumes["arquivos"], total),
+            "paginas": por_segundo(volumes["paginas"], total),
+            "pix": por_segundo(volumes["pix"], total),
+            "linhas": por_segundo(volumes["linhas"], total),
+        },
+        "contadores": dict(metricas["contadores"]),
+        "avisos": avisos,
+    }
+    caminho_resumo = os.path.join(saida, "resumo.json")
+    with open(caminho_resumo, "w", encoding="utf-8") as f:
+        json.dump(resumo, f, ensure_ascii=False, indent=2)
+
+    for aviso in avisos:
+        print(f"  ⚠️ {aviso}")
+    print(
+        f"\n📊 {volumes['dias']} dias • {volumes['pdfs']} PDFs ({volumes['paginas']} páginas, {volumes['pix']} PIX) • "
+        f"{volumes['planilhas']} planilhas ({volumes['linhas']} linhas) • {processos} processos"
+    )
+    print(
+        f"   {volumes['conferidos']} conferidos, {volumes['faltando_no_pdf']} faltando no PDF, "
+        f"{volumes['faltando_no_excel']} faltando no Excel"
+    )
+    print("   " + ", ".join(f"{etapa} {s:.2f}s" for etapa, s in resumo["segundos"].items()))
+    print("   " + ", ".join(f"{v} {nome}/s" for nome, v in resumo["por_segundo"].items()))
+    for caminho in gravados + [caminho_resumo]:
+        print(f"   → {caminho}")
+    return 0 if resultados else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -77,6 +77,85 @@ function getManualBaseFromEntry(btn) {
 let bancoDetectado = '';
 let dataConferenciaAtual = '';
 
+// ============================================================
+// 📨 Conferência como job: envia, acompanha o progresso e busca o resultado
+// ============================================================
+function descreverProgresso(st) {
+  const p = st.progresso || {};
+  const pdfs = p.pdfs || {}, excels = p.excels || {}, conc = p.conciliacao || {};
+  if (st.estado === 'na_fila') return 'Na fila, aguardando processamento...';
+  if (conc.estado === 'processando') return `Conciliando ${pdfs.pix || 0} PIX com ${excels.linhas || 0} linhas...`;
+  if (conc.estado === 'concluida') return 'Finalizando...';
+  return `PDFs: ${pdfs.feitos || 0}/${pdfs.total || 0} (${pdfs.paginas || 0} páginas, ${pdfs.pix || 0} PIX) • ` +
+    `Planilhas: ${excels.feitos || 0}/${excels.total || 0} (${excels.linhas || 0} linhas)`;
+}
+
+function aguardarJob(jobId, aoAtualizar) {
+  const base = `${window.location.origin}/jobs/${jobId}`;
+  const terminou = (st) => st.estado === 'concluido' || st.estado === 'erro';
+
+  // se o SSE cair (proxy, rede), continua consultando o estado a cada segundo
+  const consultar = (resolve) => {
+    fetch(base)
+      .then((r) => r.json())
+      .then((st) => {
+        aoAtualizar(st);
+        if (terminou(st) || st.erro === 'Job não encontrado.') resolve();
+        else setTimeout(() => consultar(resolve), 1000);
+      })
+      .catch(() => setTimeout(() => consultar(resolve), 2000));
+  };
+
+  return new Promise((resolve) => {
+    if (!window.EventSource) return consultar(resolve);
+    const es = new EventSource(`${base}/eventos`);
+    es.onmessage = (ev) => {
+      const st = JSON.parse(ev.data);
+      aoAtualizar(st);
+      if (terminou(st)) {
+        es.close();
+        resolve();
+      }
+    };
+    es.onerror = () => {
+      es.close();
+      consultar(resolve);
+    };
+  });
+}
+
+async function conferirComProgresso(fd) {
+  const texto = document.getElementById('progressTexto');
+  const resp = await fetch(`${window.location.origin}/jobs/conferir_caixa`, {
+    method: 'POST',
+    body: fd
+  });
+  const job = await resp.json();
+  if (job.erro) return job;
+
+  await aguardarJob(job.job_id, (st) => {
+    if (texto) texto.textContent = descreverProgresso(st);
+  });
+  if (texto) texto.textContent = 'Processando arquivos...';
+
+  const final = await fetch(`${window.location.origin}/jobs/${job.job_id}/resultado`);
+  return final.json();
+}
+
+// ============================================================
+// 🏷️ Apelidos: conferências manuais ensinam o servidor (nome da planilha ↔ nome no PDF)
+// ============================================================
+function registrarApelido(nomeExcel, nomePdf, confirmado) {
+  if (!nomeExcel || !nomePdf) return;
+  const fd = new FormData();
+  fd.append('nome_excel', nomeExcel);
+  fd.append('nome_pdf', nomePdf);
+  fetch(`${window.location.origin}/apelidos`, {
+    method: confirmado ? 'POST' : 'DELETE',
+    body: fd
+  }).catch((err) => console.warn('Apelido não registrado:', err));
+}
+
 document.getElementById('btnConferir').addEventListener('click', async () => {
   const pdf = document.getElementById('pdfFile').files[0];
   const excels = document.getElementById('excelFile').files;
@@ -102,12 +181,7 @@ document.getElementById('btnConferir').addEventListener('click', async () => {
   // ❌ NÃO envia mais a data para filtrar no backend
 
   try {
-    const resp = await fetch(`${window.location.origin}/conferir_caixa`, {
-      method: 'POST',
-      body: fd
-    });
-
-    const dados = await resp.json();
+    const dados = await conferirComProgresso(fd);
     document.getElementById('progressArea').style.display = 'none';
 
     if (dados.erro) {
@@ -313,7 +387,7 @@ document.getElementById('btnConferir').addEventListener('click', async () => {
 
               ${d.faltando_excel
                 .map((x, idx) => `
-                  <div class='entry err' id='faltando_excel_${id}_${idx}'>
+                  <div class='entry err' id='faltando_excel_${id}_${idx}' data-nome_pdf="${encodeURIComponent(x.nome || x.nome_pdf || "")}">
                     <div class="d-flex justify-content-between align-items-start">
                       <div style="flex:1; padding-right:10px;">
                         <strong>
@@ -533,7 +607,8 @@ document.getElementById('btnConferir').addEventListener('click', async () => {
       return Number.isFinite(n) ? n : null;
     }
 
-    function removeMatchingFromFaltandoExcel({ nomeToMatch, valorToMatch }) {
+    // `nomesRemovidos` (opcional) recebe o nome do pagador no PDF de cada item removido
+    function removeMatchingFromFaltandoExcel({ nomeToMatch, valorToMatch, nomesRemovidos = [] }) {
       const nomeNorm = normalizeText(nomeToMatch);
       const valorNum = typeof valorToMatch === "number"
         ? valorToMatch
@@ -570,6 +645,7 @@ document.getElementById('btnConferir').addEventListener('click', async () => {
               if (agentId) recalcAndRenderAgent(agentId);
             }, 360);
 
+            nomesRemovidos.push(decodeURIComponent(el.dataset.nome_pdf || ""));
             removidos++;
           }
         } catch (err) {
@@ -632,6 +708,7 @@ document.getElementById('btnConferir').addEventListener('click', async () => {
       // ✅ base manual salva no botão (quando desmarca/volta)
       const baseNomeSaved = decodeURIComponent(btn.dataset.base_nome || "");
       const baseValorSaved = decodeURIComponent(btn.dataset.base_valor || "");
+      const nomePdfSaved = decodeURIComponent(btn.dataset.nome_pdf || "");
 
       const card = btn.closest(`.entry.${origem === "conferido" ? "ok" : "warn"}`);
       let motivoRaw = "";
@@ -678,15 +755,22 @@ document.getElementById('btnConferir').addEventListener('click', async () => {
 
           // REMOVE DO FALTANDO EXCEL (se tiver base manual completa)
           let removidosExcel = 0;
+          const nomesPdf = [];
           if (baseNome && baseValorNumFinal != null) {
             removidosExcel = removeMatchingFromFaltandoExcel({
               nomeToMatch: baseNome,
-              valorToMatch: baseValorNumFinal
+              valorToMatch: baseValorNumFinal,
+              nomesRemovidos: nomesPdf
             });
           }
 
           const baseValorParaSalvar = (manual.baseValorRaw || baseValorSaved || "");
 
+          // apelido só quando a base apontou um único PIX: vai o nome real do pagador,
+          // não o texto digitado (o servidor compara o nome do PIX inteiro)
+          const nomePdf = removidosExcel === 1 ? nomesPdf[0] : "";
+          if (nomePdf) registrarApelido(nome, nomePdf, true);
+
           novo.innerHTML = `
           <div class="d-flex justify-content-between align-items-start">
             <div>
@@ -716,6 +800,7 @@ document.getElementById('btnConferir').addEventListener('click', async () => {
               data-voltarexcel="${removidosExcel > 0 ? "1" : "0"}"
               data-base_nome="${encodeURIComponent(baseNome || "")}"
               data-base_valor="${encodeURIComponent(baseValorParaSalvar)}"
+              data-nome_pdf="${encodeURIComponent(nomePdf)}"
             >
               <i class="bi bi-x-circle"></i>
             </button>
@@ -737,11 +822,14 @@ document.getElementById('btnConferir').addEventListener('click', async () => {
       // DESTINO: VOLTAR (DESMARCAR)
       // ============================================================
 
+      // conferência manual desfeita: o servidor desfaz a confirmação do apelido
+      if (origemReal === "faltando" && nomePdfSaved) registrarApelido(nome, nomePdfSaved, false);
+
       // 1️⃣ VOLTAR PARA FALTANDO EXCEL (se foi removido lá)
       if (voltarExcel) {
 
         // tenta usar base manual salva (pra voltar certinho)
-        const nomeFinal = baseNomeSaved || nome;
+        const nomeFinal = nomePdfSaved || baseNomeSaved || nome;
         const valorFinal = parseBRLInput(baseValorSaved) ?? valor;
 
         const semAgenteCard = Array.from(document.querySelectorAll(".agent-card"))
@@ -755,6 +843,7 @@ document.getElementById('btnConferir').addEventListener('click', async () => {
 
           const novo = document.createElement("div");
           novo.className = "entry err";
+          novo.dataset.nome_pdf = encodeURIComponent(nomeFinal || "");
 
           novo.innerHTML = `
             <div class="d-flex justify-content-between align-items-start">
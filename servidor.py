@@ -2,17 +2,35 @@ from fastapi import FastAPI, File, UploadFile, Form
 from fastapi.middleware.cors import CORSMiddleware
 import pandas as pd
 import io, re, pdfplumber
-from datetime import datetime, date
+from PyPDF2 import PdfReader
+import openpyxl
+from datetime import datetime, date, timedelta
 from difflib import SequenceMatcher
+from bisect import bisect_left, bisect_right
 import unicodedata
-from typing import List, Dict, Any
+import numpy as np
+from typing import List, Dict, Any, Iterator
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse, PlainTextResponse
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager, contextmanager
+import asyncio, os, hashlib, json, threading, time, uuid, logging, random, mmap, shutil, tempfile, sqlite3
+from collections import OrderedDict, Counter
+from functools import lru_cache
 
 # ==========================================================
 # 🚀 Configuração principal
 # ==========================================================
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    iniciar_workers_jobs()
+    yield
+    encerrar_workers_jobs()
+    encerrar_pool()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -24,11 +42,476 @@ app.add_middleware(
 # ==========================================================
 # 🌐 Servir o Frontend (HTML, CSS, JS e ícone)
 # ==========================================================
-app.mount("/static", StaticFiles(directory="frontend"), name="static")
+# relativo a este arquivo: o servidor pode ser importado de qualquer pasta (ex.: conferir_lote.py)
+PASTA_FRONTEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "frontend")
+app.mount("/static", StaticFiles(directory=PASTA_FRONTEND), name="static")
 
 @app.get("/")
 def home():
-    return FileResponse("frontend/leitor-extratos.html")
+    return FileResponse(os.path.join(PASTA_FRONTEND, "leitor-extratos.html"))
+
+
+# ==========================================================
+# 🩺 Diagnóstico: logs por nível e dumps de depuração por pedido
+# ==========================================================
+# CONFERIR_LOG_NIVEL=DEBUG      → detalha cada PIX lido (padrão: INFO, sem nada no caminho quente)
+# CONFERIR_LOG_AMOSTRA=0.1      → no nível DEBUG, detalha só ~10% das transações (padrão: 1 = todas)
+# CONFERIR_DEBUG_DIR            → pasta dos dumps (um subdiretório por pedido/job)
+# CONFERIR_DEBUG_AMOSTRA=0.01   → fração dos pedidos que gravam dump mesmo sem `debug=true` (padrão: 0)
+CONFERIR_LOG_NIVEL = os.getenv("CONFERIR_LOG_NIVEL", "INFO").upper()
+CONFERIR_LOG_AMOSTRA = float(os.getenv("CONFERIR_LOG_AMOSTRA", "1"))
+CONFERIR_DEBUG_DIR = os.getenv("CONFERIR_DEBUG_DIR", "debug_conferencias")
+CONFERIR_DEBUG_AMOSTRA = float(os.getenv("CONFERIR_DEBUG_AMOSTRA", "0"))
+
+logger = logging.getLogger("conferencia")
+if not logger.handlers:
+    _handler_log = logging.StreamHandler()
+    _handler_log.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s"))
+    logger.addHandler(_handler_log)
+    logger.propagate = False
+logger.setLevel(CONFERIR_LOG_NIVEL)
+
+
+def log_transacoes(origem: str, dados: List[Dict[str, Any]]):
+    """Detalha as transações lidas no nível DEBUG, respeitando CONFERIR_LOG_AMOSTRA."""
+    if not logger.isEnabledFor(logging.DEBUG) or CONFERIR_LOG_AMOSTRA <= 0:
+        return
+    passo = max(1, round(1 / CONFERIR_LOG_AMOSTRA))
+    for i in range(0, len(dados), passo):
+        d = dados[i]
+        logger.debug("%s [%03d] %s %s | %s | R$%.2f", origem, i + 1, d.get("data", ""), d.get("hora", ""), d.get("nome"), d.get("valor", 0.0))
+
+
+def novo_debug_id(pedido: bool = False) -> str | None:
+    """Id do dump de depuração: sempre que o cliente pede, ou por amostragem."""
+    if pedido or (CONFERIR_DEBUG_AMOSTRA > 0 and random.random() < CONFERIR_DEBUG_AMOSTRA):
+        return uuid.uuid4().hex
+    return None
+
+
+def caminho_debug(debug_id: str, nome: str) -> str:
+    return os.path.join(CONFERIR_DEBUG_DIR, debug_id, nome)
+
+
+def gravar_debug(caminho: str, conteudo: str):
+    """Grava um arquivo de depuração; roda no pool ou em thread, nunca no event loop."""
+    try:
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        with open(caminho, "w", encoding="utf-8") as f:
+            f.write(conteudo)
+    except OSError as e:
+        logger.warning("Falha ao gravar dump de depuração %s: %s", caminho, e)
+
+
+# ==========================================================
+# ⏱️ Métricas: tempo por etapa e contadores (GET /metrics)
+# ==========================================================
+# As funções que rodam no pool medem as próprias etapas e devolvem os números em
+# resp["_metricas"] = {"tempos": {etapa: segundos}, "contadores": {nome: n}}; quem as
+# chama retira essa chave (antes do cache e da resposta) com `acumular_metricas`.
+_metricas_lock = threading.Lock()
+_metricas_tempos: Dict[str, List[float]] = {}   # etapa → [soma em segundos, quantidade]
+_metricas_contadores: Counter = Counter()
+
+
+def nova_metricas() -> Dict[str, Any]:
+    return {"tempos": {}, "contadores": Counter()}
+
+
+@contextmanager
+def medir(tempos: Dict[str, float], etapa: str):
+    """Soma em `tempos[etapa]` os segundos gastos dentro do bloco."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        tempos[etapa] = tempos.get(etapa, 0.0) + time.perf_counter() - inicio
+
+
+def medir_em_pool(etapa: str, func, *args):
+    """Roda `func(*args)` (no pool) e anexa o tempo gasto em resp["_metricas"]."""
+    tempos = {}
+    with medir(tempos, etapa):
+        resp = func(*args)
+    if isinstance(resp, dict) and "erro" not in resp:
+        resp["_metricas"] = {"tempos": tempos, "contadores": {}}
+    return resp
+
+
+def acumular_metricas(metricas: Dict[str, Any] | None, resp: Any):
+    """Retira resp["_metricas"] e soma em `metricas` (se houver)."""
+    vindas = resp.pop("_metricas", None) if isinstance(resp, dict) else None
+    if not vindas or metricas is None:
+        return
+    for etapa, segundos in vindas.get("tempos", {}).items():
+        metricas["tempos"][etapa] = metricas["tempos"].get(etapa, 0.0) + segundos
+    metricas["contadores"].update(vindas.get("contadores", {}))
+
+
+def registrar_metricas(metricas: Dict[str, Any]):
+    """Soma as métricas de um pedido aos totais do processo (expostos em /metrics)."""
+    with _metricas_lock:
+        for etapa, segundos in metricas["tempos"].items():
+            total = _metricas_tempos.setdefault(etapa, [0.0, 0])
+            total[0] += segundos
+            total[1] += 1
+        _metricas_contadores.update(metricas["contadores"])
+
+
+def resumo_metricas(metricas: Dict[str, Any]) -> Dict[str, Any]:
+    """Bloco `timings` da resposta."""
+    return {
+        "etapas": {etapa: round(segundos, 4) for etapa, segundos in metricas["tempos"].items()},
+        "contadores": dict(metricas["contadores"]),
+    }
+
+
+def metricas_prometheus() -> str:
+    linhas = [
+        "# HELP conferir_etapa_segundos Tempo gasto em cada etapa da conferência.",
+        "# TYPE conferir_etapa_segundos summary",
+    ]
+    with _metricas_lock:
+        tempos = {etapa: list(total) for etapa, total in _metricas_tempos.items()}
+        contadores = dict(_metricas_contadores)
+    for etapa, (soma, quantidade) in sorted(tempos.items()):
+        linhas.append(f'conferir_etapa_segundos_sum{{etapa="{etapa}"}} {soma:.6f}')
+        linhas.append(f'conferir_etapa_segundos_count{{etapa="{etapa}"}} {quantidade}')
+    for nome, valor in sorted(contadores.items()):
+        linhas.append(f"# TYPE conferir_{nome}_total counter")
+        linhas.append(f"conferir_{nome}_total {valor}")
+    cache = cache_estatisticas()
+    for nome in ("hits_memoria", "hits_disco", "misses", "gravacoes", "remocoes"):
+        linhas.append(f"# TYPE conferir_cache_{nome}_total counter")
+        linhas.append(f"conferir_cache_{nome}_total {cache[nome]}")
+    for nome in ("itens_memoria", "bytes_memoria"):
+        linhas.append(f"# TYPE conferir_cache_{nome} gauge")
+        linhas.append(f"conferir_cache_{nome} {cache[nome]}")
+    for nome in ("nomes_cache", "similaridade_cache"):
+        acertos, falhas = contadores.get(f"{nome}_acertos", 0), contadores.get(f"{nome}_falhas", 0)
+        linhas.append(f"# TYPE conferir_{nome}_taxa_acerto gauge")
+        linhas.append(f"conferir_{nome}_taxa_acerto {acertos / (acertos + falhas) if acertos + falhas else 0.0:.4f}")
+    linhas.append("# TYPE conferir_jobs_na_fila gauge")
+    linhas.append(f"conferir_jobs_na_fila {_fila_jobs.qsize() if _fila_jobs is not None else 0}")
+    return "\n".join(linhas) + "\n"
+
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(metricas_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+# ==========================================================
+# 📥 Uploads gravados em disco
+# ==========================================================
+# Os arquivos de cada pedido são copiados, em blocos, para uma pasta temporária e daí em
+# diante circulam como caminho (para o pool, o cache e os parsers), sem ficar inteiros na
+# memória nem ser copiados para cada processo.
+# CONFERIR_UPLOAD_MAX_MB → limite da soma dos arquivos de um pedido (padrão: 200)
+# CONFERIR_UPLOAD_DIR    → onde criar as pastas temporárias (padrão: a do sistema)
+CONFERIR_UPLOAD_MAX_MB = float(os.getenv("CONFERIR_UPLOAD_MAX_MB", "200"))
+CONFERIR_UPLOAD_DIR = os.getenv("CONFERIR_UPLOAD_DIR") or None
+_BLOCO_UPLOAD = 1024 * 1024
+
+
+async def salvar_uploads(pdfs: List[UploadFile], excels: List[UploadFile]) -> Dict[str, Any]:
+    """
+    Grava os uploads em CONFERIR_UPLOAD_DIR/conferencia-XXXX/.
+    Retorna {"pasta": ..., "pdfs": [caminhos], "excels": [caminhos]} ou, se a soma passar
+    de CONFERIR_UPLOAD_MAX_MB, {"erro": ...} (a pasta já é apagada). Quem recebe a pasta
+    apaga com `remover_uploads` ao terminar.
+    """
+    limite = CONFERIR_UPLOAD_MAX_MB * 1024 * 1024
+    erro = {"erro": f"Os arquivos enviados passam do limite de {CONFERIR_UPLOAD_MAX_MB:g} MB por conferência."}
+    # o Starlette já informa o tamanho de cada upload: recusa antes de copiar qualquer byte
+    if sum(getattr(u, "size", None) or 0 for u in [*pdfs, *excels]) > limite:
+        return erro
+
+    pasta = await asyncio.to_thread(tempfile.mkdtemp, prefix="conferencia-", dir=CONFERIR_UPLOAD_DIR)
+    arquivos = {"pasta": pasta, "pdfs": [], "excels": []}
+    total = 0
+    try:
+        for tipo, uploads in (("pdfs", pdfs), ("excels", excels)):
+            for i, upload in enumerate(uploads):
+                caminho = os.path.join(pasta, f"{tipo}_{i + 1}")
+                with open(caminho, "wb") as destino:
+                    while bloco := await upload.read(_BLOCO_UPLOAD):
+                        total += len(bloco)
+                        if total > limite:
+                            await remover_uploads(pasta)
+                            return erro
+                        await asyncio.to_thread(destino.write, bloco)
+                arquivos[tipo].append(caminho)
+    except BaseException:
+        await remover_uploads(pasta)
+        raise
+    return arquivos
+
+
+async def remover_uploads(pasta: str | None):
+    if pasta:
+        await asyncio.to_thread(shutil.rmtree, pasta, True)
+
+
+# ==========================================================
+# ⚙️ Pool de processos para o trabalho pesado (PDF, Excel, conciliação)
+# ==========================================================
+# CONFERIR_WORKERS=N  → N processos (padrão: nº de CPUs)
+# CONFERIR_WORKERS=0  → sem processos extras, roda em thread (útil em dev)
+CONFERIR_WORKERS = int(os.getenv("CONFERIR_WORKERS", os.cpu_count() or 1))
+
+_pool: ProcessPoolExecutor | None = None
+
+
+def obter_pool() -> ProcessPoolExecutor | None:
+    """Cria o pool sob demanda (só no processo principal)."""
+    global _pool
+    if CONFERIR_WORKERS <= 0:
+        return None
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=CONFERIR_WORKERS)
+    return _pool
+
+
+def encerrar_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def executar_em_pool(func, *args):
+    """Executa `func(*args)` fora do event loop e aguarda o resultado."""
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(obter_pool(), func, *args)
+    except BrokenProcessPool:
+        # um worker morreu (ex.: falta de memória): descarta o pool para o próximo pedido recriar
+        encerrar_pool()
+        raise
+
+
+# ==========================================================
+# 📑 Extração em lotes de páginas (PDFs grandes)
+# ==========================================================
+# PDFs com mais de CONFERIR_PAGINAS_POR_LOTE páginas são divididos em intervalos
+# extraídos em paralelo no pool e remontados na ordem original das páginas.
+CONFERIR_PAGINAS_POR_LOTE = int(os.getenv("CONFERIR_PAGINAS_POR_LOTE", "10"))
+
+
+async def processar_pdf_em_pool(fonte, senha: str = None, arquivo_debug: str = None):
+    """
+    Versão assíncrona de `processar_pdf` que divide PDFs grandes em lotes de páginas.
+    Com `fonte` = caminho, cada processo abre o arquivo por conta própria (só o caminho vai pelo pool).
+    """
+    if CONFERIR_WORKERS <= 1:
+        return await executar_em_pool(processar_pdf, fonte, senha, arquivo_debug)
+
+    deteccao = await executar_em_pool(detectar_banco, fonte, senha)
+    if "erro" in deteccao:
+        return deteccao
+
+    num_paginas = deteccao["num_paginas"]
+    if num_paginas <= CONFERIR_PAGINAS_POR_LOTE:
+        return await executar_em_pool(processar_pdf, fonte, senha, arquivo_debug, deteccao)
+
+    tamanho = max(CONFERIR_PAGINAS_POR_LOTE, -(-num_paginas // CONFERIR_WORKERS))
+    lotes = await asyncio.gather(*[
+        executar_em_pool(extrair_paginas, fonte, senha, inicio, inicio + tamanho)
+        for inicio in range(0, num_paginas, tamanho)
+    ])
+    extracao = juntar_lotes(lotes)
+    if "erro" in extracao:
+        return extracao
+    return await executar_em_pool(processar_extracao, extracao, arquivo_debug, deteccao)
+
+
+# ==========================================================
+# 🗄️ Cache de arquivos já processados (memória LRU + disco)
+# ==========================================================
+# A chave é o hash do conteúdo do arquivo + a versão do parser: reenviar o mesmo
+# PDF/planilha não refaz a extração. Mude a versão ao alterar um parser (nos PDFs,
+# VERSAO_PARSER_PDF cobre extração e detecção; cada banco tem a sua no registro de parsers).
+VERSAO_PARSER_PDF = "6"
+VERSAO_PARSER_EXCEL = "2"
+
+CONFERIR_CACHE_DIR = os.getenv("CONFERIR_CACHE_DIR", ".cache_conferencia")  # vazio = sem disco
+CONFERIR_CACHE_MEMORIA_MB = float(os.getenv("CONFERIR_CACHE_MEMORIA_MB", "64"))
+CONFERIR_CACHE_DISCO_MB = float(os.getenv("CONFERIR_CACHE_DISCO_MB", "512"))
+
+_cache_memoria: "OrderedDict[str, bytes]" = OrderedDict()
+_cache_memoria_bytes = 0
+_cache_lock = threading.Lock()
+_cache_contadores = {"hits_memoria": 0, "hits_disco": 0, "misses": 0, "gravacoes": 0, "remocoes": 0}
+
+
+def chave_cache(tipo: str, fonte, senha: str = None) -> str:
+    """`fonte` = bytes ou caminho do arquivo (lido em blocos)."""
+    versao = versao_parsers_pdf() if tipo == "pdf" else VERSAO_PARSER_EXCEL
+    if isinstance(fonte, (bytes, bytearray)):
+        h = hashlib.sha256(fonte)
+    else:
+        h = hashlib.sha256()
+        with open(fonte, "rb") as f:
+            while bloco := f.read(_BLOCO_UPLOAD):
+                h.update(bloco)
+    if senha:
+        h.update(b"\0" + senha.encode("utf-8"))
+    return f"{tipo}-v{versao}-{h.hexdigest()}"
+
+
+def _cache_guardar_memoria(chave: str, blob: bytes):
+    global _cache_memoria_bytes
+    limite = CONFERIR_CACHE_MEMORIA_MB * 1024 * 1024
+    if len(blob) > limite:
+        return
+    antigo = _cache_memoria.pop(chave, None)
+    if antigo is not None:
+        _cache_memoria_bytes -= len(antigo)
+    _cache_memoria[chave] = blob
+    _cache_memoria_bytes += len(blob)
+    while _cache_memoria_bytes > limite:
+        _, removido = _cache_memoria.popitem(last=False)
+        _cache_memoria_bytes -= len(removido)
+        _cache_contadores["remocoes"] += 1
+
+
+def _cache_limpar_disco():
+    """
+    Apaga os arquivos mais antigos (por último acesso) até caber no limite do disco.
+    Roda fora do _cache_lock (é só disco); as remoções entram no contador com ele.
+    """
+    limite = CONFERIR_CACHE_DISCO_MB * 1024 * 1024
+    try:
+        arquivos = [e for e in os.scandir(CONFERIR_CACHE_DIR) if e.name.endswith(".json")]
+    except FileNotFoundError:
+        return
+    arquivos = [(e.stat().st_mtime, e.stat().st_size, e.path) for e in arquivos]
+    total = sum(tam for _, tam, _ in arquivos)
+    removidos = 0
+    for _, tam, caminho in sorted(arquivos):
+        if total <= limite:
+            break
+        try:
+            os.remove(caminho)
+            total -= tam
+            removidos += 1
+        except OSError:
+            pass
+    if removidos:
+        with _cache_lock:
+            _cache_contadores["remocoes"] += removidos
+
+
+def _json_cache_padrao(obj):
+    """Arrays NumPy (colunas dos lotes de transações) → JSON."""
+    if isinstance(obj, np.ndarray):
+        return {"__ndarray__": obj.dtype.str, "valores": obj.tolist()}
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"{type(obj).__name__} não serializável no cache")
+
+
+def _json_cache_objeto(d: dict):
+    if "__ndarray__" in d:
+        return np.array(d["valores"], dtype=d["__ndarray__"])
+    return d
+
+
+def cache_obter(chave: str):
+    """Retorna uma cópia do resultado guardado ou None."""
+    with _cache_lock:
+        blob = _cache_memoria.get(chave)
+        if blob is not None:
+            _cache_memoria.move_to_end(chave)
+            _cache_contadores["hits_memoria"] += 1
+            return json.loads(blob, object_hook=_json_cache_objeto)
+
+    if CONFERIR_CACHE_DIR:
+        caminho = os.path.join(CONFERIR_CACHE_DIR, chave + ".json")
+        try:
+            with open(caminho, "rb") as f:
+                blob = f.read()
+            valor = json.loads(blob, object_hook=_json_cache_objeto)
+            os.utime(caminho)
+        except (OSError, ValueError):
+            pass
+        else:
+            with _cache_lock:
+                _cache_guardar_memoria(chave, blob)
+                _cache_contadores["hits_disco"] += 1
+            return valor
+
+    with _cache_lock:
+        _cache_contadores["misses"] += 1
+    return None
+
+
+def cache_gravar(chave: str, valor: dict):
+    blob = json.dumps(valor, ensure_ascii=False, default=_json_cache_padrao).encode("utf-8")
+    with _cache_lock:
+        _cache_guardar_memoria(chave, blob)
+        _cache_contadores["gravacoes"] += 1
+
+    if CONFERIR_CACHE_DIR:
+        try:
+            os.makedirs(CONFERIR_CACHE_DIR, exist_ok=True)
+            caminho = os.path.join(CONFERIR_CACHE_DIR, chave + ".json")
+            temporario = f"{caminho}.{os.getpid()}.tmp"
+            with open(temporario, "wb") as f:
+                f.write(blob)
+            os.replace(temporario, caminho)
+            _cache_limpar_disco()
+        except OSError:
+            pass
+
+
+def cache_estatisticas() -> dict:
+    with _cache_lock:
+        consultas = _cache_contadores["hits_memoria"] + _cache_contadores["hits_disco"] + _cache_contadores["misses"]
+        return {
+            **_cache_contadores,
+            "itens_memoria": len(_cache_memoria),
+            "bytes_memoria": _cache_memoria_bytes,
+            "taxa_acerto": round((consultas - _cache_contadores["misses"]) / consultas, 4) if consultas else 0.0,
+        }
+
+
+async def processar_pdf_com_cache(fonte, senha: str = None, arquivo_debug: str = None, metricas: dict = None):
+    """
+    Com `arquivo_debug`, ignora o cache na leitura para que o texto extraído seja gravado.
+    Tempos e contadores da extração vão para `metricas` (ver `nova_metricas`).
+    """
+    chave = await asyncio.to_thread(chave_cache, "pdf", fonte, senha)
+    if not arquivo_debug:
+        resp = await asyncio.to_thread(cache_obter, chave)
+        if resp is not None:
+            if metricas is not None:
+                metricas["contadores"]["arquivos_do_cache"] += 1
+            return resp
+    if metricas is not None:
+        metricas["contadores"]["arquivos_processados"] += 1
+    resp = await processar_pdf_em_pool(fonte, senha, arquivo_debug)
+    acumular_metricas(metricas, resp)
+    if "erro" not in resp:
+        await asyncio.to_thread(cache_gravar, chave, resp)
+    return resp
+
+
+async def processar_excel_com_cache(fonte, metricas: dict = None):
+    chave = await asyncio.to_thread(chave_cache, "excel", fonte)
+    resp = await asyncio.to_thread(cache_obter, chave)
+    if resp is not None:
+        if metricas is not None:
+            metricas["contadores"]["arquivos_do_cache"] += 1
+        return resp
+    if metricas is not None:
+        metricas["contadores"]["arquivos_processados"] += 1
+    resp = await executar_em_pool(medir_em_pool, "excel", processar_excel, fonte)
+    acumular_metricas(metricas, resp)
+    if "erro" not in resp:
+        await asyncio.to_thread(cache_gravar, chave, resp)
+    return resp
 
 
 # ==========================================================
@@ -92,123 +575,403 @@ def parse_valor_robusto(v):
 
 
 # ==========================================================
-# 🟡 DETALHE BANCO DO BRASIL (versão final consolidada)
+# 📦 TRANSAÇÕES COMPACTAS (um array por campo em vez de um dict por linha)
 # ==========================================================
-async def detalhe_bb(file_bytes: bytes):
+# Os PIX dos PDFs e as linhas das planilhas circulam (pool ↔ processo principal, cache,
+# conciliação) como um lote {"n", "campos", "tipos", "colunas", "textos"}, com as colunas:
+#   data  → int32 AAAAMMDD (0 = "")        hora → int16 HHMM (-1 = "")
+#   valor → float64                         demais (nome, banco, agente) → int32, índice
+#                                           em lote["textos"] (-1 = None)
+# Cada texto repetido (nome, agente, banco) é guardado uma vez só. Uma coluna com algum valor
+# fora desses formatos é codificada como texto, então `expandir_transacoes` sempre devolve
+# exatamente os registros compactados. Os dicts da resposta só são montados no fim
+# (ver `expandir_conciliacao`).
+CAMPOS_PDF = ("data", "hora", "nome", "valor", "banco")
+CAMPOS_EXCEL = ("agente", "nome", "hora", "valor")
+
+_FORMATO_DATA = re.compile(r"[0-9]{2}/[0-9]{2}/[0-9]{4}")
+_FORMATO_HORA = re.compile(r"[0-9]{2}:[0-9]{2}")
+
+
+def _internar(internados: dict, v) -> int:
+    # o tipo entra na chave para 1, 1.0 e True não virarem o mesmo texto
+    return internados.setdefault((type(v), v), len(internados))
+
+
+def _codificar_coluna(campo: str, valores: list, internados: dict):
+    """(tipo, array) de uma coluna; `internados` ((tipo, valor) → índice) é o do lote."""
+    if campo == "data" and all(v == "" or (type(v) is str and _FORMATO_DATA.fullmatch(v)) for v in valores):
+        return "data", np.array([int(v[6:] + v[3:5] + v[:2]) if v else 0 for v in valores], dtype=np.int32)
+    if campo == "hora" and all(v == "" or (type(v) is str and _FORMATO_HORA.fullmatch(v)) for v in valores):
+        return "hora", np.array([int(v[:2] + v[3:]) if v else -1 for v in valores], dtype=np.int16)
+    if campo == "valor" and all(isinstance(v, float) for v in valores):
+        return "valor", np.array(valores, dtype=np.float64)
+    return "texto", np.array([-1 if v is None else _internar(internados, v) for v in valores], dtype=np.int32)
+
+
+def _textos_internados(internados: dict) -> list:
+    textos = [None] * len(internados)
+    for (_, v), i in internados.items():
+        textos[i] = v
+    return textos
+
+
+def compactar_transacoes(registros: List[Dict[str, Any]], campos: tuple) -> Dict[str, Any]:
+    """Lista de dicts (PIX ou linhas de planilha) → lote compacto só com os `campos`."""
+    internados = {}
+    tipos, colunas = {}, {}
+    for campo in campos:
+        tipos[campo], colunas[campo] = _codificar_coluna(campo, [r.get(campo) for r in registros], internados)
+    return {
+        "n": len(registros),
+        "campos": list(campos),
+        "tipos": tipos,
+        "colunas": colunas,
+        "textos": _textos_internados(internados),
+    }
+
+
+def _formatar_data(v: int) -> str:
+    return f"{v % 100:02d}/{v // 100 % 100:02d}/{v // 10000:04d}" if v else ""
+
+
+def _formatar_hora(v: int) -> str:
+    return f"{v // 100:02d}:{v % 100:02d}" if v >= 0 else ""
+
+
+def valores_coluna(lote: Dict[str, Any], campo: str) -> list:
+    """Valores originais de uma coluna do lote, na ordem das linhas."""
+    tipo, coluna = lote["tipos"][campo], lote["colunas"][campo]
+    if tipo == "valor":
+        return coluna.tolist()
+    if tipo == "texto":
+        textos = lote["textos"]
+        return [None if c < 0 else textos[c] for c in coluna.tolist()]
+    formatar = _formatar_data if tipo == "data" else _formatar_hora
+    distintos = {c: formatar(c) for c in np.unique(coluna).tolist()}
+    return [distintos[c] for c in coluna.tolist()]
+
+
+def expandir_transacoes(lote: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Lote compacto → lista de dicts, como saiu dos parsers."""
+    campos = lote["campos"]
+    colunas = [valores_coluna(lote, campo) for campo in campos]
+    return [dict(zip(campos, linha)) for linha in zip(*colunas)]
+
+
+def juntar_transacoes(lotes: List[Dict[str, Any]], campos: tuple) -> Dict[str, Any]:
+    """Concatena vários lotes (ex.: um por PDF) num só, na ordem dada."""
+    internados = {}
+    mapas = {}  # id do lote → seus índices de texto renumerados, com -1 no fim (índice -1 → -1)
+    tipos, colunas = {}, {}
+    for campo in campos:
+        tipos_lotes = {lote["tipos"][campo] for lote in lotes}
+        if len(tipos_lotes) == 1 and "texto" not in tipos_lotes:
+            tipos[campo] = tipos_lotes.pop()
+            colunas[campo] = np.concatenate([lote["colunas"][campo] for lote in lotes])
+        elif tipos_lotes == {"texto"}:
+            partes = []
+            for lote in lotes:
+                if id(lote) not in mapas:
+                    mapas[id(lote)] = np.array([_internar(internados, v) for v in lote["textos"]] + [-1], dtype=np.int32)
+                partes.append(mapas[id(lote)][lote["colunas"][campo]])
+            tipos[campo], colunas[campo] = "texto", np.concatenate(partes)
+        else:
+            valores = [v for lote in lotes for v in valores_coluna(lote, campo)]
+            tipos[campo], colunas[campo] = _codificar_coluna(campo, valores, internados)
+    return {
+        "n": sum(lote["n"] for lote in lotes),
+        "campos": list(campos),
+        "tipos": tipos,
+        "colunas": colunas,
+        "textos": _textos_internados(internados),
+    }
+
+
+# ==========================================================
+# 📄 EXTRAÇÃO DE TEXTO DO PDF (uma única leitura por arquivo)
+# ==========================================================
+def _erro_abertura_pdf(e: Exception) -> dict:
+    erro_str = str(e).lower()
+    if any(word in erro_str for word in ["password", "encrypt", "decrypt", "permiss"]):
+        return {"erro": "O PDF está protegido. Envie o PDF já desbloqueado."}
+    return {"erro": f"Erro ao processar PDF: {e}"}
+
+
+@contextmanager
+def abrir_fonte(fonte):
     """
-    Parser robusto e filtrado para extratos do Banco do Brasil.
-    ✅ Captura todos os PIX RECEBIDOS (com '(+)')
-    ✅ Corrige PIX quebrados entre páginas
-    ✅ Reconstrói PIX com CNPJ sem nome
-    🚫 Ignora ruídos como '5 Pix - Recebido' ou cabeçalhos incompletos.
+    Objeto de arquivo para o PyPDF2/pdfplumber: BytesIO para bytes; para um caminho, o
+    arquivo mapeado em memória (mmap) — as leituras vêm do cache de páginas do sistema,
+    sem carregar o arquivo inteiro no processo (o PyPDF2, com um caminho, leria tudo).
     """
-    print("\n========== [DEBUG] INÍCIO DA LEITURA PDF BANCO DO BRASIL ==========\n")
+    if isinstance(fonte, (bytes, bytearray)):
+        yield io.BytesIO(fonte)
+        return
+    with open(fonte, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield f  # arquivo vazio não pode ser mapeado
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapa:
+            yield mapa
 
+
+# CONFERIR_EXTRACAO_RAPIDA=0 → sempre usa o pdfplumber (padrão: tenta o PyPDF2 antes)
+CONFERIR_EXTRACAO_RAPIDA = os.getenv("CONFERIR_EXTRACAO_RAPIDA", "1") != "0"
+
+_MARCADOR_PIX_BB = re.compile(r"Pix\s*-\s*Recebido", re.IGNORECASE)
+_LANCAMENTO_PIX_BB = re.compile(r"Pix\s*-\s*Recebido\s+[\d\.,]+\s*\(\+\)", re.IGNORECASE)
+_MARCADOR_PIX_C6 = re.compile(r"Pix\s+recebid[oa]", re.IGNORECASE)
+_LANCAMENTO_PIX_C6 = re.compile(r"Pix\s+recebid[oa][^\n]*?R\$?\s*[\d\.,]+", re.IGNORECASE)
+_DATA_CURTA = re.compile(r"\d{2}/\d{2}")
+_HORA = re.compile(r"\d{2}:\d{2}")
+
+
+def pagina_confiavel(texto: str) -> bool:
+    """
+    Diz se o texto de uma página lido pelo PyPDF2 pode ser usado no lugar do pdfplumber:
+    precisa ter datas e PIX recebidos, e todo marcador de PIX tem que vir com o valor
+    logo em seguida (BB: 'Pix - Recebido 1.234,56 (+)', com horário; C6: 'Pix recebido ... R$ 12,34').
+    Páginas sem nenhum PIX (capa, resumo) também vão para o pdfplumber.
+    """
+    if not texto or not _DATA_CURTA.search(texto):
+        return False
+    marcadores_bb = len(_MARCADOR_PIX_BB.findall(texto))
+    marcadores_c6 = len(_MARCADOR_PIX_C6.findall(texto))
+    if not marcadores_bb and not marcadores_c6:
+        return False
+    if marcadores_bb and (len(_LANCAMENTO_PIX_BB.findall(texto)) != marcadores_bb or not _HORA.search(texto)):
+        return False
+    return len(_LANCAMENTO_PIX_C6.findall(texto)) == marcadores_c6
+
+
+def _extrair_rapido(fonte, senha: str = None, inicio: int = 0, fim: int = None):
+    """
+    Lê o texto das páginas com o PyPDF2 (só o fluxo de texto, sem análise de layout).
+    Retorna ([texto ou None por página], metadados) — None nas páginas que não passaram em
+    `pagina_confiavel` — ou None se o PyPDF2 não conseguir abrir o arquivo.
+    """
     try:
-        texto_total = ""
-        with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
-            for i, page in enumerate(pdf.pages):
-                texto_pagina = page.extract_text() or ""
-                texto_total += "\n" + texto_pagina
+        with abrir_fonte(fonte) as arquivo:
+            leitor = PdfReader(arquivo)
+            if leitor.is_encrypted and not leitor.decrypt(senha or ""):
+                return None
+            textos = []
+            for pagina in leitor.pages[inicio:fim]:
+                texto = pagina.extract_text() or ""
+                textos.append(texto if pagina_confiavel(texto) else None)
+            metadados = {str(k).lstrip("/"): str(v) for k, v in (leitor.metadata or {}).items()}
+    except Exception:
+        return None
+    return textos, metadados
 
-        with open("pdf_debug.txt", "w", encoding="utf-8") as f:
-            f.write(texto_total)
 
-    except Exception as e:
-        print(f"\n⚠️ Erro ao ler PDF: {e}")
-        return {"erro": f"Falha ao processar PDF ({e})"}
-
-    print("\n========== [DEBUG] LIMPEZA E NORMALIZAÇÃO ==========\n")
-
-    texto_total = re.sub(r"\s+", " ", texto_total)
-    texto_limpo = texto_total
-
-    texto_limpo = re.sub(r"Extrato de Conta Corrente.*?Valor", " ", texto_limpo, flags=re.IGNORECASE)
-    texto_limpo = re.sub(r"----- Página \d+ -----", " ", texto_limpo)
-    texto_limpo = re.sub(r"\s+", " ", texto_limpo)
-
-    texto_limpo = re.sub(r"\(\-\)", "", texto_limpo)
-    texto_limpo = re.sub(r"(?i)Pix\s*-\s*Enviado", "", texto_limpo)
-
-    corrigidos = []
-    texto_expandido = texto_limpo
-
-    pix_soltos = list(re.finditer(
-        r"Pix\s*-\s*Recebido\s+([\d\.,]+)\s*\(\+\)(?!\s*[A-ZÀ-ÿ])",
-        texto_expandido,
-        flags=re.IGNORECASE
-    ))
-    for m in pix_soltos:
-        valor_txt = m.group(1)
-        pos_fim = m.end()
-        trecho_proximo = texto_expandido[pos_fim:pos_fim + 800]
-        trecho_proximo = re.sub(
-            r"Extrato de Conta Corrente|Cliente\s+[A-ZÀ-ÿ\s]+|Ag[êe]ncia:\s*\d+-\d+\s*Conta:\s*\d+-\d+|Lançamentos|Dia\s+Lote\s+Documento\s+Histórico\s+Valor",
-            " ",
-            trecho_proximo,
-            flags=re.IGNORECASE
-        )
+def extrair_paginas(fonte, senha: str = None, inicio: int = 0, fim: int = None) -> dict:
+    """
+    Abre o PDF (`fonte` = bytes ou caminho) uma única vez e extrai o texto de cada página.
+    Retorna {"paginas": [texto_pag_1, ...], "metadados": {...}, "num_paginas": n}
+    ou {"erro": ...}. O mesmo resultado é usado pela detecção do banco e pelos parsers.
+    `inicio`/`fim` limitam a extração a um intervalo de páginas (usado pela extração em lotes).
+    Cada página é lida primeiro pelo PyPDF2 e só vai para o pdfplumber (mais lento, com
+    layout) se o texto rápido não passar em `pagina_confiavel`; `paginas_rapidas` e
+    `paginas_pdfplumber` contam o caminho usado. `segundos` é o tempo gasto (métricas).
+    """
+    comeco = time.perf_counter()
+    rapido = _extrair_rapido(fonte, senha, inicio, fim) if CONFERIR_EXTRACAO_RAPIDA else None
+    paginas, metadados = rapido if rapido else (None, {})
+
+    if paginas is None or None in paginas:
+        try:
+            with abrir_fonte(fonte) as arquivo, pdfplumber.open(arquivo, password=senha or None) as pdf:
+                lote = pdf.pages[inicio:fim]
+                if paginas is None or len(paginas) != len(lote):
+                    paginas = [None] * len(lote)
+                rapidas = sum(1 for texto in paginas if texto is not None)
+                paginas = [
+                    texto if texto is not None else (lote[i].extract_text() or "")
+                    for i, texto in enumerate(paginas)
+                ]
+                metadados = dict(pdf.metadata or {})
+        except Exception as e:
+            return _erro_abertura_pdf(e)
+    else:
+        rapidas = len(paginas)
+
+    return {
+        "paginas": paginas,
+        "metadados": metadados,
+        "num_paginas": len(paginas),
+        "segundos": time.perf_counter() - comeco,
+        "paginas_rapidas": rapidas,
+        "paginas_pdfplumber": len(paginas) - rapidas,
+    }
+
+
+def juntar_lotes(lotes: List[dict]) -> dict:
+    """Remonta, na ordem das páginas, os resultados de `extrair_paginas` feitos por intervalo."""
+    for lote in lotes:
+        if "erro" in lote:
+            return lote
+    paginas = [p for lote in lotes for p in lote["paginas"]]
+    metadados = lotes[0]["metadados"] if lotes else {}
+    return {
+        "paginas": paginas,
+        "metadados": metadados,
+        "num_paginas": len(paginas),
+        "segundos": sum(lote.get("segundos", 0.0) for lote in lotes),
+        "paginas_rapidas": sum(lote.get("paginas_rapidas", 0) for lote in lotes),
+        "paginas_pdfplumber": sum(lote.get("paginas_pdfplumber", 0) for lote in lotes),
+    }
+
+
+def texto_completo(extracao: dict) -> str:
+    """Junta as páginas extraídas no mesmo formato usado pelos parsers ("\n" antes de cada página)."""
+    return "".join("\n" + p for p in extracao.get("paginas", []))
+
+
+# ==========================================================
+# 🟡 DETALHE BANCO DO BRASIL (versão final consolidada)
+# ==========================================================
+# Depois de normalizar o texto, uma única passada de tokens (marcadores 'Pix - Recebido'
+# e linhas de CNPJ com valor) monta os lançamentos; o resto olha só janelas curtas em
+# volta de cada token, então o custo cresce linearmente com o tamanho do extrato.
+# sequência de espaços, cabeçalhos 'Extrato de Conta Corrente ... Valor' e marcadores
+# '----- Página N -----' → um espaço só
+_BB_SEPARADORES = re.compile(
+    r"(?:\s|(?is:Extrato\s+de\s+Conta\s+Corrente.*?Valor)|-----\s+Página\s+\d+\s+-----)+"
+)
+_BB_SINAL_NEGATIVO = re.compile(r"\(\-\)")
+_BB_PIX_ENVIADO = re.compile(r"(?i)Pix\s*-\s*Enviado")
+_BB_TOKENS = re.compile(
+    r"(?P<pix>Pix\s*-\s*Recebido)(?:\s+(?P<valor>[\d\.,]+)\s*\(\+\))?"
+    r"|(?P<dia>\d{2}/\d{2})\s+(?P<hora>\d{2}:\d{2})\s+[0-9]{6,}\s+"
+    r"(?P<cnpj>\d{2}\.?\d{3}\.?\d{3}/?\d{4}-?\d{2}|\d{11,14})\s+(?P<valor_cnpj>[\d\.,]+)\s*\(\+\)",
+    re.IGNORECASE,
+)
+_BB_RUIDO = re.compile(
+    r"Extrato de Conta Corrente|Cliente\s+[A-ZÀ-ÿ\s]+|Ag[êe]ncia:\s*\d+-\d+\s*Conta:\s*\d+-\d+|Lançamentos|Dia\s+Lote\s+Documento\s+Histórico\s+Valor",
+    re.IGNORECASE,
+)
+_BB_INICIO_RUIDO = re.compile(r"(?=" + _BB_RUIDO.pattern + r")", re.IGNORECASE)
+_BB_SEGUE_NOME = re.compile(r"\s*[A-ZÀ-ÿ]", re.IGNORECASE)
+_BB_PAGADOR = re.compile(r"(\d{2}/\d{2})\s+(\d{2}:\d{2})\s+[0-9]{6,}\s+([A-Za-zÀ-ÿ\s]{3,}?)\s+\d{1,3}")
+_BB_PAGADOR_SEGUINTE = re.compile(r"(\d{2}/\d{2})\s+(\d{2}:\d{2})\s+[0-9]{6,}\s+([A-ZÀ-ÿ\s]{3,})\s+\d+", re.IGNORECASE)
+_BB_LANCAMENTO = re.compile(
+    r"Pix\s*-\s*Recebido.*?"
+    r"(?:(\d{2}/\d{2}/\d{4})|(\d{2}/\d{2}))?\s*"
+    r"(\d{2}:\d{2})\s+"
+    r"(?:[0-9]{5,}\s+)?"
+    r"([A-ZÀ-ÿ0-9\s\.]{3,}?)\s+"
+    r"([\d\.]+,\d{2})\s*\(\+\)",
+    re.IGNORECASE,
+)
+_BB_DATA = re.compile(r"(\d{2}/\d{2})(?:/\d{4})?")
+_BB_ESPACOS_REPETIDOS = re.compile(r"\s{2,}")
+_BB_CORTE_NOME = re.compile(r"(?i)\b(Agência|Conta|Saldo|Pix)\b.*")
+_BB_SO_NUMEROS = re.compile(r"[0-9.\s]{7,}")
+
+
+def _normalizar_texto_bb(texto: str) -> str:
+    """
+    Junta espaços, cabeçalhos e marcadores de página em um espaço só (uma passada) e
+    depois apaga '(-)' e 'Pix - Enviado' sem juntar os espaços em volta — o mesmo texto
+    que as substituições em sequência de antes produziam.
+    """
+    texto = _BB_SEPARADORES.sub(" ", texto)
+    return _BB_PIX_ENVIADO.sub("", _BB_SINAL_NEGATIVO.sub("", texto))
 
-        prox = re.search(
-            r"(\d{2}/\d{2})\s+(\d{2}:\d{2})\s+[0-9]{6,}\s+([A-Za-zÀ-ÿ\s]{3,}?)\s+\d{1,3}",
-            trecho_proximo
-        )
 
-        if prox:
-            data_curta, hora, nome_raw = prox.groups()
-            nome = re.sub(r"\s{2,}", " ", nome_raw.strip()).title()
-            bloco_completo = f"Pix - Recebido {data_curta}/2025 {hora} {nome} {valor_txt} (+)"
-            corrigidos.append((m.start(), bloco_completo))
-            print(f"🧩 [RECONSTRUÍDO] {data_curta}/2025 {hora} | {nome} | R${valor_txt}")
+def _texto_antes(blocos: List[str], k: int, tamanho: int) -> str:
+    """Os `tamanho` caracteres que antecedem blocos[k] na concatenação dos blocos."""
+    partes = []
+    while k > 0 and tamanho > 0:
+        k -= 1
+        trecho = blocos[k][-tamanho:] if len(blocos[k]) > tamanho else blocos[k]
+        partes.append(trecho)
+        tamanho -= len(trecho)
+    return "".join(reversed(partes))
 
-    if corrigidos:
-        partes = []
-        ultimo_fim = 0
-        for inicio, bloco_corrigido in corrigidos:
-            partes.append(texto_expandido[ultimo_fim:inicio])
-            partes.append(bloco_corrigido)
-            ultimo_fim = inicio
-        texto_limpo = "".join(partes) + texto_expandido[ultimo_fim:]
 
-    blocos = re.split(r"(?=Pix\s*-\s*Recebido)", texto_limpo, flags=re.IGNORECASE)
+def detalhe_bb(extracao: dict):
+    """
+    Parser robusto e filtrado para extratos do Banco do Brasil.
+    ✅ Captura todos os PIX RECEBIDOS (com '(+)')
+    ✅ Corrige PIX quebrados entre páginas
+    ✅ Reconstrói PIX com CNPJ sem nome
+    🚫 Ignora ruídos como '5 Pix - Recebido' ou cabeçalhos incompletos.
+    Recebe o resultado de `extrair_paginas` (o PDF já foi lido uma única vez).
+    """
+    texto = _normalizar_texto_bb(texto_completo(extracao))
 
+    # ============================
+    # TOKENS: marcadores de PIX recebido e linhas de CNPJ com valor
+    # ============================
+    # Um PIX "solto" ('Pix - Recebido 12,34 (+)' sem o nome logo depois) é reconstruído
+    # com a próxima linha 'dd/mm hh:mm documento NOME' dos 800 caracteres seguintes.
+    inicios_ruido = [m.start() for m in _BB_INICIO_RUIDO.finditer(texto)]
+    marcadores = []  # (início, valor do '(+)' ou None, lançamento reconstruído ou None)
+    cnpjs = []
+    for m in _BB_TOKENS.finditer(texto):
+        if m.group("pix") is None:
+            cnpjs.append(m.group("dia", "hora", "cnpj", "valor_cnpj"))
+            continue
+
+        valor_txt = m.group("valor")
+        reconstruido = None
+        if valor_txt is not None and not _BB_SEGUE_NOME.match(texto, m.end()):
+            fim_janela = m.end() + 800
+            trecho = texto[m.end():fim_janela]
+            if bisect_left(inicios_ruido, m.end()) != bisect_left(inicios_ruido, fim_janela):
+                trecho = _BB_RUIDO.sub(" ", trecho)
+            prox = _BB_PAGADOR.search(trecho)
+            if prox:
+                data_curta, hora, nome_raw = prox.groups()
+                nome = _BB_ESPACOS_REPETIDOS.sub(" ", nome_raw.strip()).title()
+                reconstruido = f"Pix - Recebido {data_curta}/2025 {hora} {nome} {valor_txt} (+)"
+                logger.debug("BB [reconstruído] %s/2025 %s | %s | R$%s", data_curta, hora, nome, valor_txt)
+        marcadores.append((m.start(), valor_txt, reconstruido))
+
+    # ============================
+    # BLOCOS: um por marcador (reconstruídos logo antes do original)
+    # ============================
+    blocos = [texto[:marcadores[0][0]] if marcadores else texto]
+    valores = [None]          # valor do '(+)' do marcador original do bloco
+    reconstruidos = [False]
+    for j, (inicio, valor_txt, reconstruido) in enumerate(marcadores):
+        fim = marcadores[j + 1][0] if j + 1 < len(marcadores) else len(texto)
+        if reconstruido:
+            blocos.append(reconstruido)
+            valores.append(None)
+            reconstruidos.append(True)
+        blocos.append(texto[inicio:fim])
+        valores.append(valor_txt)
+        reconstruidos.append(False)
+
+    # PIX com valor cujo nome ficou no bloco seguinte (quebra de página). Um bloco
+    # reconstruído nunca tem 'dd/mm hh:mm documento'; o último bloco só serve de
+    # contexto para o penúltimo e não é lido.
     corrigido = []
-    padrao_pix_valor = re.compile(r"Pix\s*-\s*Recebido\s+([\d\.,]+)\s*\(\+\)", re.IGNORECASE)
-    padrao_nome_hora = re.compile(r"(\d{2}/\d{2})\s+(\d{2}:\d{2})\s+[0-9]{6,}\s+([A-ZÀ-ÿ\s]{3,})\s+\d+", re.IGNORECASE)
-    for i, bloco in enumerate(blocos[:-1]):
-        m_val = padrao_pix_valor.search(bloco)
-        if not m_val:
-            corrigido.append(bloco)
+    for i in range(len(blocos) - 1):
+        corrigido.append(blocos[i])
+        if valores[i] is None or reconstruidos[i + 1]:
             continue
-        valor_txt = m_val.group(1)
-        trecho_entre = blocos[i + 1][:150]
-        m_nome = padrao_nome_hora.search(trecho_entre)
+        m_nome = _BB_PAGADOR_SEGUINTE.search(blocos[i + 1][:150])
         if m_nome:
             data_curta, hora, nome_raw = m_nome.groups()
-            nome = re.sub(r"\s{2,}", " ", nome_raw.strip()).title()
-            bloco_corrigido = f"Pix - Recebido {data_curta}/2025 {hora} {nome} {valor_txt} (+)"
-            corrigido.append(bloco_corrigido)
-        else:
-            corrigido.append(bloco)
-    blocos = corrigido
+            nome = _BB_ESPACOS_REPETIDOS.sub(" ", nome_raw.strip()).title()
+            corrigido[-1] = f"Pix - Recebido {data_curta}/2025 {hora} {nome} {valores[i]} (+)"
 
     dados = []
-    print(f"🔍 Total de blocos detectados: {len(blocos)}\n")
-
-    padrao_pix = re.compile(
-        r"Pix\s*-\s*Recebido.*?"
-        r"(?:(\d{2}/\d{2}/\d{4})|(\d{2}/\d{2}))?\s*"
-        r"(\d{2}:\d{2})\s+"
-        r"(?:[0-9]{5,}\s+)?"
-        r"([A-ZÀ-ÿ0-9\s\.]{3,}?)\s+"
-        r"([\d\.]+,\d{2})\s*\(\+\)",
-        re.IGNORECASE,
-    )
+    logger.debug("BB: %d blocos detectados", len(corrigido))
 
     data_atual = None
 
-    for bloco in blocos:
-        m = padrao_pix.search(bloco)
+    for k, bloco in enumerate(corrigido):
+        # o lançamento precisa de um horário antes de algum '(+)'
+        fim_valor = bloco.rfind("(+)")
+        if fim_valor == -1 or not _HORA.search(bloco, 0, fim_valor):
+            continue
+        m = _BB_LANCAMENTO.search(bloco)
         if not m:
             continue
 
@@ -219,25 +982,22 @@ async def detalhe_bb(file_bytes: bytes):
         elif data_partial:
             data_atual = f"{data_partial}/2025"
         else:
-            m2 = re.search(r"(\d{2}/\d{2})(?:/\d{4})?", bloco)
+            m2 = _BB_DATA.search(bloco)
             if m2:
                 data_atual = f"{m2.group(1)}/2025"
 
-        if not data_atual:
-            idx = texto_limpo.find(bloco)
-            if idx != -1:
-                antes = texto_limpo[max(0, idx - 100):idx]
-                m3 = re.search(r"(\d{2}/\d{2})(?:/\d{4})?", antes)
-                if m3:
-                    data_atual = f"{m3.group(1)}/2025"
+        if not data_atual and bloco is blocos[k]:
+            m3 = _BB_DATA.search(_texto_antes(blocos, k, 100))
+            if m3:
+                data_atual = f"{m3.group(1)}/2025"
 
         if not data_atual:
             continue
 
         data = data_atual
 
-        nome = re.sub(r"\s{2,}", " ", nome_raw.strip()).title()
-        nome = re.sub(r"(?i)\b(Agência|Conta|Saldo|Pix)\b.*", "", nome).strip()
+        nome = _BB_ESPACOS_REPETIDOS.sub(" ", nome_raw.strip()).title()
+        nome = _BB_CORTE_NOME.sub("", nome).strip()
         if not nome:
             continue
         try:
@@ -248,7 +1008,7 @@ async def detalhe_bb(file_bytes: bytes):
             continue
 
         nome_limpo = nome.strip()
-        if re.fullmatch(r"[0-9.\s]{7,}", nome_limpo):
+        if _BB_SO_NUMEROS.fullmatch(nome_limpo):
             cnpj_num = re.sub(r"\D", "", nome_limpo)
             nome_limpo = f"Cliente CNPJ {cnpj_num}"
         nome = nome_limpo
@@ -261,12 +1021,7 @@ async def detalhe_bb(file_bytes: bytes):
             "banco": "BB"
         })
 
-    padrao_cnpj = re.compile(
-        r"(\d{2}/\d{2})\s+(\d{2}:\d{2})\s+[0-9]{6,}\s+(\d{2}\.?\d{3}\.?\d{3}/?\d{4}-?\d{2}|\d{11,14})\s+([\d\.,]+)\s*\(\+\)",
-        re.IGNORECASE,
-    )
-    for m in padrao_cnpj.finditer(texto_limpo):
-        data_curta, hora, cnpj_raw, valor_txt = m.groups()
+    for data_curta, hora, cnpj_raw, valor_txt in cnpjs:
         nome = f"Cliente CNPJ {re.sub(r'[^0-9]', '', cnpj_raw)}"
         try:
             valor = float(valor_txt.replace(".", "").replace(",", "."))
@@ -283,11 +1038,8 @@ async def detalhe_bb(file_bytes: bytes):
             vistos.add(chave)
     dados = sorted(unicos, key=lambda d: d["hora"])
 
-    print(f"\n========== [LOG - PIX RECEBIDOS BANCO DO BRASIL - FINAL] ==========")
-    print(f"Total detectado: {len(dados)}\n")
-    for i, d in enumerate(dados, start=1):
-        print(f"[{i:03}] {d['data']} {d['hora']} | {d['nome']} | R${d['valor']:.2f}")
-    print("=" * 100 + "\n")
+    logger.debug("BB: %d PIX recebidos", len(dados))
+    log_transacoes("BB", dados)
 
     if not dados:
         return {"erro": "Nenhum lançamento PIX identificado no PDF do Banco do Brasil."}
@@ -297,23 +1049,12 @@ async def detalhe_bb(file_bytes: bytes):
 # ==========================================================
 # 🟢 DETALHE BANCO C6 (SEM DESBLOQUEIO)
 # ==========================================================
-async def detalhe_c6(file_bytes: bytes, senha: str = None):
+def detalhe_c6(extracao: dict):
     """
     Extrai transações PIX de PDFs do C6 Bank.
-    ❌ Sem desbloqueio: se o PDF estiver protegido, retorna erro pedindo PDF desbloqueado.
+    ❌ Sem desbloqueio: se o PDF estiver protegido, `extrair_paginas` já retorna erro pedindo PDF desbloqueado.
     """
-    texto_total = ""
-    try:
-        with pdfplumber.open(io.BytesIO(file_bytes), password=senha or None) as pdf:
-            for page in pdf.pages:
-                texto_total += "\n" + (page.extract_text() or "")
-    except Exception as e:
-        erro_str = str(e).lower()
-        if any(word in erro_str for word in ["password", "encrypt", "decrypt", "permiss"]):
-            return {"erro": "O PDF C6 está protegido. Envie o PDF já desbloqueado."}
-        return {"erro": f"Erro ao abrir PDF C6: {e}"}
-
-    return {"dados": extrair_pix_c6(texto_total)}
+    return {"dados": extrair_pix_c6(texto_completo(extracao))}
 
 
 # ==========================================================
@@ -397,78 +1138,404 @@ def extrair_pix_c6(texto_total: str):
 
     dados = sorted(dados, key=sort_key)
 
-    print(f"\n========== [LOG - PIX RECEBIDOS C6 BANK - FINAL] ==========")
-    print(f"Total detectado: {len(dados)}\n")
-    for i, d in enumerate(dados, start=1):
-        print(f"[{i:03}] {d.get('data','')} {d.get('hora','')} | {d.get('nome')} | R${d.get('valor'):.2f}")
-    print("=" * 100 + "\n")
+    logger.debug("C6: %d PIX recebidos", len(dados))
+    log_transacoes("C6", dados)
 
     return dados
 
 
 # ==========================================================
-# 🔍 PROCESSAR PDF → Detecta e chama o parser correto
+# 🧩 REGISTRO DE PARSERS DE BANCO
 # ==========================================================
-async def processar_pdf(file_bytes: bytes, senha: str = None):
-    texto_total = ""
+# Para suportar um banco novo: escreva `detalhe_<banco>(extracao) -> {"dados": [...]}`
+# (ou {"erro": ...}), que recebe as páginas já extraídas em extracao["paginas"], e
+# registre-o abaixo com as assinaturas que o identificam na primeira página.
+# A ordem de registro é a prioridade: se o texto tiver assinaturas de dois bancos, vale
+# o registrado antes. Assinaturas `genericas` (textos que outros bancos também usam, como
+# "Extrato de conta") só valem quando nenhuma assinatura específica aparece no texto.
+# As assinaturas de cada tipo viram uma única regex, então a detecção lê o texto no
+# máximo duas vezes, qualquer que seja o número de bancos.
+PARSERS_BANCO: Dict[str, Dict[str, Any]] = {}
+_regex_assinaturas = None
+_regex_genericas = None
+
+
+def registrar_parser(banco: str, rotulo: str, parser, assinaturas: tuple, versao: str, genericas: tuple = ()):
+    """
+    `banco`: id curto (vira resp["banco"] e o nome da etapa 'parser_<banco>' nas métricas);
+    `rotulo`: valor de d["banco"] em cada transação; `assinaturas`: textos procurados sem
+    diferenciar maiúsculas e com qualquer espaçamento entre as palavras; `versao`: entra
+    na chave do cache dos PDFs — mude ao alterar o parser; `genericas`: assinaturas fracas,
+    usadas só se nenhum banco tiver assinatura específica no texto.
+    """
+    global _regex_assinaturas, _regex_genericas
+    PARSERS_BANCO[banco] = {
+        "banco": banco,
+        "rotulo": rotulo,
+        "parser": parser,
+        "assinaturas": tuple(assinaturas),
+        "genericas": tuple(genericas),
+        "versao": versao,
+        "prioridade": len(PARSERS_BANCO),
+    }
+    _regex_assinaturas = _compilar_assinaturas("assinaturas")
+    _regex_genericas = _compilar_assinaturas("genericas")
+
+
+def _compilar_assinaturas(tipo: str):
+    """Uma regex com um grupo nomeado por banco para as assinaturas `tipo`; None se não houver nenhuma."""
+    grupos = [
+        f"(?P<{p['banco']}>" + "|".join(r"\s+".join(map(re.escape, a.split())) for a in p[tipo]) + ")"
+        for p in PARSERS_BANCO.values()
+        if p[tipo]
+    ]
+    return re.compile("|".join(grupos), re.IGNORECASE) if grupos else None
+
+
+def versao_parsers_pdf() -> str:
+    """VERSAO_PARSER_PDF + a versão de cada parser registrado (ex.: '4-c61-bb1')."""
+    return "-".join([VERSAO_PARSER_PDF] + [f"{b}{p['versao']}" for b, p in PARSERS_BANCO.items()])
+
+
+def identificar_banco(texto: str, genericas: bool = True) -> str | None:
+    """
+    Id do banco com a assinatura específica de maior prioridade presente no texto; sem
+    nenhuma, o da assinatura genérica de maior prioridade (se `genericas`), ou None.
+    Uma passada por regex; para cedo se achar o banco de prioridade 0.
+    """
+    for regex in (_regex_assinaturas, _regex_genericas if genericas else None):
+        melhor = None
+        for m in regex.finditer(texto) if regex else ():
+            prioridade = PARSERS_BANCO[m.lastgroup]["prioridade"]
+            if melhor is None or prioridade < PARSERS_BANCO[melhor]["prioridade"]:
+                melhor = m.lastgroup
+                if prioridade == 0:
+                    break
+        if melhor:
+            return melhor
+    return None
+
+
+registrar_parser("c6", "C6", detalhe_c6, assinaturas=("C6",), versao="1")
+registrar_parser("bb", "BB", detalhe_bb, assinaturas=("BANCO DO BRASIL", "BB S.A"), versao="1", genericas=("EXTRATO DE CONTA",))
+
+
+# ==========================================================
+# 🔎 DETECÇÃO DO BANCO (metadados + primeira página)
+# ==========================================================
+# CONFERIR_DETECCAO_PAGINAS=N → procura as assinaturas nas N primeiras páginas (padrão: 1).
+# Se nelas só aparecer uma assinatura genérica, as páginas seguintes são lidas até surgir
+# uma específica (ex.: extrato do C6 cuja primeira página só diz "Extrato de conta corrente");
+# não surgindo, vale o banco da genérica.
+CONFERIR_DETECCAO_PAGINAS = max(1, int(os.getenv("CONFERIR_DETECCAO_PAGINAS", "1")))
+
+
+def detectar_banco(fonte, senha: str = None) -> dict:
+    """
+    Descobre o banco sem extrair o documento inteiro: olha os metadados e o texto das
+    primeiras CONFERIR_DETECCAO_PAGINAS páginas (PyPDF2; pdfplumber só se o texto rápido
+    não bastar) e para na primeira assinatura específica encontrada; com só uma genérica,
+    continua pelas páginas seguintes (ver `_procurar_banco`).
+    Retorna {"banco": "c6"|"bb", "num_paginas": n, "segundos": s} ou {"erro": ...};
+    um PDF de banco desconhecido é recusado aqui, antes da extração completa.
+    """
+    comeco = time.perf_counter()
+
+    def resultado(banco: str, num_paginas: int) -> dict:
+        return {"banco": banco, "num_paginas": num_paginas, "segundos": time.perf_counter() - comeco}
+
+    # metadados que já apontam o banco de maior prioridade dispensam a leitura das páginas
+    primeiro = next(iter(PARSERS_BANCO))
+    if CONFERIR_EXTRACAO_RAPIDA:
+        try:
+            with abrir_fonte(fonte) as arquivo:
+                leitor = PdfReader(arquivo)
+                if not leitor.is_encrypted or leitor.decrypt(senha or ""):
+                    metadados = " ".join(str(v) for v in (leitor.metadata or {}).values())
+                    if identificar_banco(metadados, genericas=False) == primeiro:
+                        return resultado(primeiro, len(leitor.pages))
+                    banco = _procurar_banco(metadados, leitor.pages)
+                    if banco:
+                        return resultado(banco, len(leitor.pages))
+        except Exception:
+            pass  # o pdfplumber abaixo dá a mensagem de erro certa
+
     try:
-        with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
-            for page in pdf.pages:
-                texto_total += "\n" + (page.extract_text() or "")
+        with abrir_fonte(fonte) as arquivo, pdfplumber.open(arquivo, password=senha or None) as pdf:
+            banco = _procurar_banco(" ".join(str(v) for v in (pdf.metadata or {}).values()), pdf.pages)
+            if banco:
+                return resultado(banco, len(pdf.pages))
+            num_paginas = len(pdf.pages)
     except Exception as e:
-        return {"erro": f"Erro ao processar PDF: {e}"}
+        return _erro_abertura_pdf(e)
 
-    texto_total = re.sub(r"\s+", " ", texto_total)
-    upper = texto_total.upper()
+    logger.info("Banco não reconhecido nas %d primeira(s) página(s) de %d", CONFERIR_DETECCAO_PAGINAS, num_paginas)
+    return {"erro": "Banco não reconhecido no PDF."}
 
-    if "C6" in upper or "C6BANK" in upper:
-        banco = "c6"
-        resp = await detalhe_c6(file_bytes, senha)
-        if "erro" in resp:
-            return resp
-        dados = resp.get("dados", [])
-        for d in dados:
-            d["banco"] = "C6"
 
-    elif "BANCO DO BRASIL" in upper or "EXTRATO DE CONTA" in upper or "BB S.A" in upper:
-        banco = "bb"
-        resp = await detalhe_bb(file_bytes)
-        if "erro" in resp:
-            return resp
-        dados = resp.get("dados", [])
-        for d in dados:
-            d["banco"] = "BB"
+def _procurar_banco(metadados: str, paginas) -> str | None:
+    """
+    Banco pelos metadados + texto das páginas (objetos do PyPDF2 ou do pdfplumber).
+    Nas primeiras CONFERIR_DETECCAO_PAGINAS, a primeira assinatura específica decide; se
+    até ali só houver genérica, segue página a página atrás de uma específica e, sem
+    nenhuma, devolve o banco da genérica.
+    """
+    textos = [metadados]
+    generico = None
+    for i, pagina in enumerate(paginas):
+        if i >= CONFERIR_DETECCAO_PAGINAS and generico is None:
+            break
+        textos.append(pagina.extract_text() or "")
+        # depois das primeiras páginas só a página nova é lida, sem reler o texto acumulado
+        texto = " ".join(textos) if i < CONFERIR_DETECCAO_PAGINAS else textos[-1]
+        banco = identificar_banco(texto, genericas=False)
+        if banco:
+            return banco
+        if generico is None and i < CONFERIR_DETECCAO_PAGINAS:
+            generico = identificar_banco(texto)
+    if generico:
+        logger.info("Banco identificado só por assinatura genérica: %s", generico)
+    return generico
 
+
+# ==========================================================
+# 🔍 PROCESSAR PDF → Detecta e chama o parser correto
+# ==========================================================
+def processar_pdf(fonte, senha: str = None, arquivo_debug: str = None, deteccao: dict = None):
+    """
+    Detecta o banco pela primeira página e só então extrai o documento inteiro.
+    `fonte` = bytes do PDF ou caminho do arquivo.
+    """
+    if deteccao is None:
+        deteccao = detectar_banco(fonte, senha)
+        if "erro" in deteccao:
+            return deteccao
+    extracao = extrair_paginas(fonte, senha)
+    if "erro" in extracao:
+        return extracao
+    return processar_extracao(extracao, arquivo_debug, deteccao)
+
+
+def processar_extracao(extracao: dict, arquivo_debug: str = None, deteccao: dict = None):
+    """
+    Chama o parser registrado do banco indicado em `deteccao` (ver `detectar_banco`);
+    sem ela, identifica o banco pelo texto já extraído.
+    Com `arquivo_debug`, grava ali o texto bruto extraído (antigo pdf_debug.txt).
+    """
+    if arquivo_debug:
+        gravar_debug(arquivo_debug, texto_completo(extracao))
+    tempos = {"extracao_pdf": extracao.get("segundos", 0.0)}
+    if deteccao is not None:
+        banco = deteccao["banco"]
+        tempos["deteccao_banco"] = deteccao.get("segundos", 0.0)
     else:
-        banco = "desconhecido"
+        with medir(tempos, "deteccao_banco"):
+            banco = identificar_banco(texto_completo(extracao))
+
+    parser = PARSERS_BANCO.get(banco)
+    if parser is None:
         return {"erro": "Banco não reconhecido no PDF."}
 
+    with medir(tempos, f"parser_{banco}"):
+        resp = parser["parser"](extracao)
+    if "erro" in resp:
+        return resp
+    dados = resp.get("dados", [])
+    for d in dados:
+        d["banco"] = parser["rotulo"]
+
     if not dados:
         return {"erro": f"Nenhum lançamento PIX identificado no PDF do banco {banco.upper()}."}
 
-    return {"banco": banco, "dados": dados}
-
-
-async def processar_excel(file_bytes: bytes):
-    def normalizar_hora_excel(h: str) -> str:
-        """Aceita 7h58, 758, 07:58, 07.58, 7, 07:58:00 → retorna HH:MM"""
-        if not h:
-            return ""
-        h = str(h).strip().lower().replace(" ", "")
-        h = h.replace(".", ":").replace("h", ":")
-        if re.fullmatch(r"^\d{1,2}$", h):
-            return f"{int(h):02d}:00"
-        if re.fullmatch(r"^\d{3,4}$", h):
-            return f"{int(h[:-2]):02d}:{int(h[-2:]):02d}"
-        if re.fullmatch(r"^\d{1,2}:\d{1,2}$", h):
-            partes = h.split(":")
-            return f"{int(partes[0]):02d}:{int(partes[1]):02d}"
-        if re.fullmatch(r"^\d{2}:\d{2}:\d{2}$", h):
-            return h[:5]
+    paginas = extracao.get("num_paginas", 0)
+    return {
+        "banco": banco,
+        "dados": compactar_transacoes(dados, CAMPOS_PDF),
+        "paginas": paginas,
+        "_metricas": {
+            "tempos": tempos,
+            "contadores": {
+                "paginas": paginas,
+                "paginas_rapidas": extracao.get("paginas_rapidas", 0),
+                "paginas_pdfplumber": extracao.get("paginas_pdfplumber", 0),
+                "pix_pdf": len(dados),
+            },
+        },
+    }
+
+
+def normalizar_hora_excel(h: str) -> str:
+    """Aceita 7h58, 758, 07:58, 07.58, 7, 07:58:00 → retorna HH:MM"""
+    if not h:
         return ""
+    h = str(h).strip().lower().replace(" ", "")
+    h = h.replace(".", ":").replace("h", ":")
+    if re.fullmatch(r"^\d{1,2}$", h):
+        return f"{int(h):02d}:00"
+    if re.fullmatch(r"^\d{3,4}$", h):
+        return f"{int(h[:-2]):02d}:{int(h[-2:]):02d}"
+    if re.fullmatch(r"^\d{1,2}:\d{1,2}$", h):
+        partes = h.split(":")
+        return f"{int(partes[0]):02d}:{int(partes[1]):02d}"
+    if re.fullmatch(r"^\d{2}:\d{2}:\d{2}$", h):
+        return h[:5]
+    return ""
+
+
+def normalizar_hora_excel_serie(serie: pd.Series) -> pd.Series:
+    """Versão vetorizada de `normalizar_hora_excel` para uma coluna inteira (células vazias → "")."""
+    h = serie.astype(str).str.strip().str.lower().str.replace(" ", "", regex=False)
+    h = h.str.replace(".", ":", regex=False).str.replace("h", ":", regex=False)
+    h = h.where(serie.notna(), "")
+
+    def dois_digitos(partes: pd.Series) -> pd.Series:
+        return partes.astype(int).astype(str).str.zfill(2)
+
+    saida = pd.Series("", index=serie.index, dtype=object)
+
+    m = h.str.fullmatch(r"\d{1,2}")
+    if m.any():
+        saida[m] = dois_digitos(h[m]) + ":00"
+
+    m = h.str.fullmatch(r"\d{3,4}")
+    if m.any():
+        saida[m] = dois_digitos(h[m].str[:-2]) + ":" + dois_digitos(h[m].str[-2:])
+
+    m = h.str.fullmatch(r"\d{1,2}:\d{1,2}")
+    if m.any():
+        partes = h[m].str.split(":", n=1, expand=True)
+        saida[m] = dois_digitos(partes[0]) + ":" + dois_digitos(partes[1])
+
+    m = h.str.fullmatch(r"\d{2}:\d{2}:\d{2}")
+    if m.any():
+        saida[m] = h[m].str[:5]
+
+    return saida
+
+
+def parse_valor_serie(serie: pd.Series) -> pd.Series:
+    """
+    `parse_valor_robusto` aplicado a uma coluna: cada valor distinto é convertido uma única vez
+    (planilhas de agentes repetem muito os mesmos valores). Células vazias → 0.0.
+    """
+    preenchida = serie.where(serie.notna(), None)
+    convertidos = {}
+    for v in pd.unique(preenchida):
+        if v is None:
+            continue
+        convertidos[v] = parse_valor_robusto(v)
+    return preenchida.map(lambda v: 0.0 if v is None else convertidos[v])
+
+
+def _agente_da_linha(linha: list) -> str:
+    """Lê 'AGENTE: NOME ... SETOR' de uma linha de cabeçalho de bloco (valores das células)."""
+    texto = " ".join(str(x) for x in linha if pd.notna(x)).strip()
+    m_ag = re.search(r"AGENTE[:/]\s*([A-Za-zÀ-ÿ0-9\s]+)", texto, re.IGNORECASE)
+    nome_agente = ""
+    if m_ag:
+        nome_agente = re.sub(r"\d+", "", m_ag.group(1)).strip().upper()
+
+    setor = ""
+    try:
+        ultima_coluna = str(linha[-1]).strip()
+        if ultima_coluna and not re.search(r"\d{2}/\d{2}/\d{4}", ultima_coluna):
+            setor = ultima_coluna.upper()
+    except:
+        pass
+
+    if nome_agente and setor:
+        return f"{nome_agente} - {setor}"
+    return nome_agente
+
+
+# ==========================================================
+# 🌊 Leitura em streaming (planilhas muito grandes)
+# ==========================================================
+# Planilhas acima deste tamanho são lidas linha a linha (openpyxl read-only),
+# sem montar o DataFrame da aba inteira.
+CONFERIR_EXCEL_STREAMING_MB = float(os.getenv("CONFERIR_EXCEL_STREAMING_MB", "8"))
+
+# textos que o pandas (read_excel) trata como célula vazia
+_VAZIOS_PANDAS = {
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+}
+
+
+def _celula_como_pandas(v):
+    """Converte o valor cru do openpyxl no mesmo valor que o read_excel colocaria no DataFrame."""
+    if v is None or (isinstance(v, str) and v in _VAZIOS_PANDAS):
+        return float("nan")
+    if isinstance(v, float) and v.is_integer():
+        return int(v)
+    return v
+
+
+def iterar_excel(fonte) -> Iterator[Dict[str, Any]]:
+    """
+    Gera os registros {agente, nome, hora, valor} de uma planilha de agentes lendo uma
+    linha por vez (openpyxl em modo read-only). `fonte` pode ser bytes, caminho ou arquivo.
+    A memória usada fica limitada a uma linha, não à aba inteira.
+    Diferenças conhecidas em relação ao DataFrame: o 'setor' do cabeçalho usa a largura
+    declarada da aba e não há inferência de tipo por coluna (ex.: 1 numa coluna de VERDADEIRO).
+    """
+    if isinstance(fonte, (bytes, bytearray)):
+        fonte = io.BytesIO(fonte)
+    wb = openpyxl.load_workbook(fonte, read_only=True, data_only=True, keep_links=False)
+    try:
+        agente_atual = None
+        for ws in wb.worksheets:
+            largura = ws.max_column or 0
+            for valores in ws.iter_rows(values_only=True):
+                linha = [_celula_como_pandas(v) for v in valores]
+                if len(linha) < largura:
+                    linha.extend([float("nan")] * (largura - len(linha)))
+
+                if any(isinstance(x, str) and "AGENTE" in x.upper() for x in linha):
+                    agente_atual = _agente_da_linha(linha)
+                    continue
+                if not agente_atual:
+                    continue
+
+                nome = str(linha[0]).strip() if len(linha) > 0 and pd.notna(linha[0]) else ""
+                if not nome or re.search(r"TOTAL|NOME", nome, re.IGNORECASE):
+                    continue
+                hora = normalizar_hora_excel(str(linha[1])) if len(linha) > 1 and pd.notna(linha[1]) else ""
+                raw_val = linha[4] if len(linha) > 4 and pd.notna(linha[4]) else ""
+
+                yield {
+                    "agente": agente_atual,
+                    "nome": nome.title(),
+                    "hora": hora,
+                    "valor": parse_valor_robusto(raw_val),
+                }
+    finally:
+        wb.close()
+
+
+def processar_excel(fonte, streaming: bool = None):
+    """
+    Lê as planilhas dos agentes coluna a coluna (sem iterrows):
+    as linhas 'AGENTE:' são achadas por máscara, o agente é propagado (ffill) para as
+    linhas do bloco e nome/hora/valor (colunas 0/1/4) são tratados como Series.
+    Com `streaming=True` (padrão para arquivos acima de CONFERIR_EXCEL_STREAMING_MB)
+    usa `iterar_excel`, que lê uma linha por vez.
+    `fonte` = bytes da planilha ou caminho do arquivo (lido direto do disco).
+    """
+    if streaming is None:
+        tamanho = len(fonte) if isinstance(fonte, (bytes, bytearray)) else os.path.getsize(fonte)
+        streaming = tamanho > CONFERIR_EXCEL_STREAMING_MB * 1024 * 1024
+    if streaming:
+        try:
+            todas_linhas = list(iterar_excel(fonte))
+        except Exception as e:
+            return {"erro": "Erro ao abrir Excel: " + str(e)}
+        if not todas_linhas:
+            return {"erro": "Nenhum dado válido encontrado na planilha."}
+        return {"tabela": compactar_transacoes(todas_linhas, CAMPOS_EXCEL)}
 
     try:
-        excel = pd.ExcelFile(io.BytesIO(file_bytes))
+        excel = pd.ExcelFile(io.BytesIO(fonte) if isinstance(fonte, (bytes, bytearray)) else fonte)
     except Exception as e:
         return {"erro": "Erro ao abrir Excel: " + str(e)}
 
@@ -477,53 +1544,50 @@ async def processar_excel(file_bytes: bytes):
 
     for aba in excel.sheet_names:
         df = pd.read_excel(excel, aba, header=None, dtype=object)
-        for _, linha in df.iterrows():
-            texto = " ".join(str(x) for x in linha if pd.notna(x)).strip()
-            if "AGENTE" in texto.upper():
-                m_ag = re.search(r"AGENTE[:/]\s*([A-Za-zÀ-ÿ0-9\s]+)", texto, re.IGNORECASE)
-                nome_agente = ""
-                if m_ag:
-                    nome_agente = re.sub(r"\d+", "", m_ag.group(1)).strip().upper()
-
-                setor = ""
-                try:
-                    ultima_coluna = str(linha.iloc[-1]).strip()
-                    if ultima_coluna and not re.search(r"\d{2}/\d{2}/\d{4}", ultima_coluna):
-                        setor = ultima_coluna.upper()
-                except:
-                    pass
-
-                if nome_agente and setor:
-                    agente_atual = f"{nome_agente} - {setor}"
-                else:
-                    agente_atual = nome_agente
-
-                continue
-            if not agente_atual:
-                continue
+        if df.empty:
+            continue
 
-            nome, hora, raw_val = "", "", ""
-            if 0 in linha.index and pd.notna(linha.iloc[0]):
-                nome = str(linha.iloc[0]).strip()
-            if 1 in linha.index and pd.notna(linha.iloc[1]):
-                hora = normalizar_hora_excel(str(linha.iloc[1]))
-            if 4 in linha.index and pd.notna(linha.iloc[4]):
-                raw_val = linha.iloc[4]
+        # linhas de cabeçalho de bloco: alguma célula de texto contém "AGENTE"
+        eh_agente = pd.Series(False, index=df.index)
+        for col in df.columns:
+            try:
+                contem = df[col].str.upper().str.contains("AGENTE", regex=False)
+            except AttributeError:
+                continue  # coluna sem nenhum texto (só números/datas)
+            eh_agente |= contem.eq(True)
+
+        # agente de cada linha = último cabeçalho visto (inclusive de abas anteriores)
+        agentes = pd.Series(None, index=df.index, dtype=object)
+        for i in df.index[eh_agente]:
+            agentes[i] = _agente_da_linha(df.loc[i].tolist())
+        agentes = pd.concat([pd.Series([agente_atual], dtype=object), agentes], ignore_index=True).ffill().iloc[1:]
+        agentes.index = df.index
+        if eh_agente.any():
+            agente_atual = agentes[df.index[eh_agente][-1]]
+
+        def coluna(n: int) -> pd.Series:
+            return df[n] if n in df.columns else pd.Series(None, index=df.index, dtype=object)
+
+        nomes = coluna(0).astype(str).str.strip().where(coluna(0).notna(), "")
+
+        validas = ~eh_agente & agentes.notna() & (agentes != "") & (nomes != "")
+        validas &= ~nomes.str.contains(r"TOTAL|NOME", case=False, regex=True)
+        if not validas.any():
+            continue
 
-            if not nome or re.search(r"TOTAL|NOME", nome, re.IGNORECASE):
-                continue
+        horas = normalizar_hora_excel_serie(coluna(1)[validas])
+        valores = parse_valor_serie(coluna(4)[validas])
 
-            valor = parse_valor_robusto(raw_val)
-            todas_linhas.append({
-                "agente": agente_atual,
-                "nome": nome.title(),
-                "hora": hora,
-                "valor": valor
-            })
+        todas_linhas.extend(
+            {"agente": agente, "nome": nome, "hora": hora, "valor": valor}
+            for agente, nome, hora, valor in zip(
+                agentes[validas], nomes[validas].str.title(), horas, valores
+            )
+        )
 
     if not todas_linhas:
         return {"erro": "Nenhum dado válido encontrado na planilha."}
-    return {"tabela": todas_linhas}
+    return {"tabela": compactar_transacoes(todas_linhas, CAMPOS_EXCEL)}
 
 
 @app.post("/conferir_caixa")
@@ -531,256 +1595,1447 @@ async def conferir_caixa(
     pdfs: List[UploadFile] = File(...),
     excels: List[UploadFile] = File(...),
     data: str = Form(None),   # recebido apenas por compatibilidade, sem filtrar
-    senha: str = Form(None)
+    senha: str = Form(None),
+    debug: bool = Form(False),
+    timings: bool = Form(False)
+):
+    arquivos = await salvar_uploads(pdfs, excels)
+    if "erro" in arquivos:
+        return JSONResponse(arquivos, status_code=413)
+    try:
+        return await executar_conferencia(
+            arquivos["pdfs"], arquivos["excels"], senha, debug_id=novo_debug_id(debug), timings=timings
+        )
+    finally:
+        await remover_uploads(arquivos["pasta"])
+
+
+async def executar_conferencia(
+    pdfs: List[bytes | str],
+    excels: List[bytes | str],
+    senha: str = None,
+    progresso=None,
+    debug_id: str = None,
+    timings: bool = False,
 ):
-    todos_pdf = []
+    """
+    Processa PDFs e planilhas (bytes ou caminhos) e concilia. `progresso(etapa, **dados)`, se informado,
+    é chamado a cada arquivo lido e ao fim da conciliação (usado pelos jobs).
+    Com `debug_id`, o texto de cada PDF e a resposta final vão para CONFERIR_DEBUG_DIR/<debug_id>/.
+    Os tempos de cada etapa vão para /metrics e, com `timings=True`, também para resp["timings"].
+    """
+    metricas = nova_metricas()
+    try:
+        with medir(metricas["tempos"], "total"):
+            resposta = await _executar_conferencia(pdfs, excels, senha, progresso, debug_id, metricas)
+    finally:
+        metricas["contadores"]["conferencias"] += 1
+        registrar_metricas(metricas)
+    if timings:
+        resposta["timings"] = resumo_metricas(metricas)
+    return resposta
+
+
+async def _executar_conferencia(pdfs, excels, senha, progresso, debug_id, metricas):
+    def avisar(etapa: str, **dados):
+        if progresso:
+            progresso(etapa, **dados)
+
+    async def pdf_com_aviso(i: int, fonte):
+        arquivo_debug = caminho_debug(debug_id, f"pdf_{i + 1}.txt") if debug_id else None
+        resp = await processar_pdf_com_cache(fonte, senha, arquivo_debug, metricas)
+        ok = "erro" not in resp
+        avisar("pdf", paginas=resp.get("paginas", 0) if ok else 0, pix=resp["dados"]["n"] if ok else 0)
+        return resp
+
+    async def excel_com_aviso(fonte):
+        resp = await processar_excel_com_cache(fonte, metricas)
+        linhas = resp["tabela"]["n"] if "tabela" in resp else 0
+        metricas["contadores"]["linhas_excel"] += linhas
+        avisar("excel", linhas=linhas)
+        return resp
+
+    lotes_pdf = []
     bancos_detectados = set()
 
     # ============================
-    # PROCESSAR PDFs
+    # PROCESSAR PDFs e EXCELS (em paralelo, fora do event loop, com cache)
     # ============================
-    for pdf in pdfs:
-        try:
-            pdf_bytes = await pdf.read()
-            pdf_resp = await processar_pdf(pdf_bytes, senha)
+    with medir(metricas["tempos"], "arquivos"):
+        respostas = await asyncio.gather(
+            *[pdf_com_aviso(i, fonte) for i, fonte in enumerate(pdfs)],
+            *[excel_com_aviso(fonte) for fonte in excels],
+            return_exceptions=True,
+        )
+    respostas_pdf = respostas[:len(pdfs)]
+    respostas_excel = respostas[len(pdfs):]
 
-            if "erro" in pdf_resp:
-                continue
+    for pdf_resp in respostas_pdf:
+        if isinstance(pdf_resp, BaseException):
+            logger.error("Falha ao processar PDF", exc_info=pdf_resp)
+            continue
+        if "erro" in pdf_resp:
+            continue
 
-            bancos_detectados.add(pdf_resp.get("banco", "").upper())
-            todos_pdf.extend(pdf_resp.get("dados", []))
-        except:
-            pass
+        bancos_detectados.add(pdf_resp.get("banco", "").upper())
+        lotes_pdf.append(pdf_resp["dados"])
 
-    if not todos_pdf:
+    dados_pdf = juntar_transacoes(lotes_pdf, CAMPOS_PDF)
+    if not dados_pdf["n"]:
         return {"erro": "Nenhum PDF válido ou sem PIX encontrado."}
 
-    dados_pdf = todos_pdf
-
-    # ============================
-    # PROCESSAR EXCELS
-    # ============================
-    dados_excel = []
-    for excel in excels:
-        excel_bytes = await excel.read()
-        excel_resp = await processar_excel(excel_bytes)
+    lotes_excel = []
+    for excel_resp in respostas_excel:
+        if isinstance(excel_resp, BaseException):
+            logger.error("Falha ao processar planilha", exc_info=excel_resp)
+            continue
         if "tabela" in excel_resp:
-            dados_excel.extend(excel_resp["tabela"])
+            lotes_excel.append(excel_resp["tabela"])
 
-    if not dados_excel:
+    dados_excel = juntar_transacoes(lotes_excel, CAMPOS_EXCEL)
+    if not dados_excel["n"]:
         return {"erro": "Nenhum dado válido encontrado nas planilhas enviadas."}
 
     # ============================
-    # FUNÇÕES AUXILIARES
+    # CONCILIAÇÃO (também no pool)
     # ============================
-    def normalizar(s: str):
-        s = unicodedata.normalize("NFKD", s or "")
-        s = "".join(c for c in s if not unicodedata.combining(c))
-        return s.lower().strip()
+    apelidos = {}
+    if CONFERIR_HISTORICO_DB:
+        with medir(metricas["tempos"], "apelidos"):
+            apelidos = await asyncio.to_thread(carregar_apelidos, valores_coluna(dados_excel, "nome"))
+
+    avisar("conciliacao_inicio", pix=dados_pdf["n"], linhas=dados_excel["n"])
+    with medir(metricas["tempos"], "conciliacao"):
+        indices = await executar_em_pool(conciliar, dados_pdf, dados_excel, None, None, apelidos)
+    acumular_metricas(metricas, indices)
+    pix_anteriores = {}
+    if CONFERIR_HISTORICO_DB:
+        with medir(metricas["tempos"], "historico"):
+            pix_anteriores, pix_novos = await asyncio.to_thread(
+                atualizar_historico, dados_pdf, dados_excel, lotes_excel, indices
+            )
+        metricas["contadores"]["historico_pix_novos"] += pix_novos
+    with medir(metricas["tempos"], "montar_resposta"):
+        resultado = await asyncio.to_thread(expandir_conciliacao, indices, dados_pdf, dados_excel)
+    for linha, item in zip(indices["faltando_no_pdf"]["excel"].tolist(), resultado["faltando_no_pdf"]):
+        if linha in pix_anteriores:
+            item["pix_outro_dia"] = pix_anteriores[linha]
+    avisar(
+        "conciliacao_fim",
+        conferidos=len(resultado["conferidos"]),
+        faltando_no_pdf=len(resultado["faltando_no_pdf"]),
+        faltando_no_excel=len(resultado["faltando_no_excel"]),
+    )
+
+    resposta = {
+        "banco": ", ".join(bancos_detectados),
+        **resultado
+    }
+    if debug_id:
+        resposta["debug_id"] = debug_id
+        await asyncio.to_thread(
+            gravar_debug, caminho_debug(debug_id, "resposta.json"), json.dumps(resposta, ensure_ascii=False, indent=2)
+        )
+    return resposta
+
+
+# ==========================================================
+# 📨 JOBS DE CONFERÊNCIA (envio assíncrono + progresso por SSE)
+# ==========================================================
+# POST /jobs/conferir_caixa         → {"job_id": ...} (mesmos campos do /conferir_caixa)
+# GET  /jobs/{id}                   → estado e progresso
+# GET  /jobs/{id}/eventos           → o mesmo, em Server-Sent Events, a cada mudança
+# GET  /jobs/{id}/resultado         → resposta final (igual à do /conferir_caixa)
+CONFERIR_JOBS_SIMULTANEOS = int(os.getenv("CONFERIR_JOBS_SIMULTANEOS", "2"))
+CONFERIR_JOBS_FILA_MAX = int(os.getenv("CONFERIR_JOBS_FILA_MAX", "20"))
+CONFERIR_JOBS_TTL = int(os.getenv("CONFERIR_JOBS_TTL", "3600"))  # segundos que um job concluído fica guardado
+
+_jobs: Dict[str, Dict[str, Any]] = {}
+_fila_jobs: asyncio.Queue | None = None
+_workers_jobs: List[asyncio.Task] = []
+
+
+def _job_publico(job: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "job_id": job["id"],
+        "estado": job["estado"],
+        "progresso": job["progresso"],
+        "erro": job.get("erro"),
+    }
+
+
+def _job_atualizar(job: Dict[str, Any], **campos):
+    job.update(campos)
+    job["atualizado_em"] = time.time()
+    # acorda quem está esperando em /eventos e deixa um Event novo para a próxima mudança
+    job["mudou"].set()
+    job["mudou"] = asyncio.Event()
+
+
+def _job_progresso(job: Dict[str, Any]):
+    def progresso(etapa: str, **dados):
+        p = job["progresso"]
+        if etapa == "pdf":
+            p["pdfs"]["feitos"] += 1
+            p["pdfs"]["paginas"] += dados["paginas"]
+            p["pdfs"]["pix"] += dados["pix"]
+        elif etapa == "excel":
+            p["excels"]["feitos"] += 1
+            p["excels"]["linhas"] += dados["linhas"]
+        elif etapa == "conciliacao_inicio":
+            p["conciliacao"]["estado"] = "processando"
+        elif etapa == "conciliacao_fim":
+            p["conciliacao"].update(estado="concluida", **dados)
+        _job_atualizar(job)
+    return progresso
+
+
+def _limpar_jobs_antigos():
+    limite = time.time() - CONFERIR_JOBS_TTL
+    for job_id in [j for j, job in _jobs.items() if job["estado"] in ("concluido", "erro") and job["atualizado_em"] < limite]:
+        _jobs.pop(job_id, None)
+
+
+async def _worker_jobs():
+    while True:
+        job = await _fila_jobs.get()
+        try:
+            _job_atualizar(job, estado="processando")
+            resultado = await executar_conferencia(
+                job["arquivos"]["pdfs"], job["arquivos"]["excels"], job["senha"], _job_progresso(job),
+                debug_id=job["id"] if job["debug"] else None, timings=job["timings"],
+            )
+            if "erro" in resultado:
+                _job_atualizar(job, estado="erro", erro=resultado["erro"], resultado=resultado)
+            else:
+                _job_atualizar(job, estado="concluido", resultado=resultado)
+        except Exception as e:
+            logger.exception("Job %s falhou", job["id"])
+            _job_atualizar(job, estado="erro", erro=f"Falha ao processar: {e}", resultado={"erro": f"Falha ao processar: {e}"})
+        finally:
+            await remover_uploads(job.pop("arquivos")["pasta"])
+            _fila_jobs.task_done()
+
+
+def iniciar_workers_jobs():
+    global _fila_jobs
+    _fila_jobs = asyncio.Queue(maxsize=CONFERIR_JOBS_FILA_MAX)
+    _workers_jobs.extend(asyncio.create_task(_worker_jobs()) for _ in range(CONFERIR_JOBS_SIMULTANEOS))
+
+
+def encerrar_workers_jobs():
+    for tarefa in _workers_jobs:
+        tarefa.cancel()
+    _workers_jobs.clear()
+    # uploads de jobs que ficaram na fila
+    for job in _jobs.values():
+        if "arquivos" in job:
+            shutil.rmtree(job.pop("arquivos")["pasta"], True)
+
+
+@app.post("/jobs/conferir_caixa")
+async def criar_job_conferencia(
+    pdfs: List[UploadFile] = File(...),
+    excels: List[UploadFile] = File(...),
+    data: str = Form(None),
+    senha: str = Form(None),
+    debug: bool = Form(False),
+    timings: bool = Form(False)
+):
+    _limpar_jobs_antigos()
+    ocupado = JSONResponse({"erro": "Servidor ocupado, tente novamente em instantes."}, status_code=503)
+    if _fila_jobs is None or _fila_jobs.full():
+        return ocupado
+
+    arquivos = await salvar_uploads(pdfs, excels)
+    if "erro" in arquivos:
+        return JSONResponse(arquivos, status_code=413)
+
+    job = {
+        "id": uuid.uuid4().hex,
+        "estado": "na_fila",
+        "senha": senha,
+        "debug": novo_debug_id(debug) is not None,
+        "timings": timings,
+        "arquivos": arquivos,
+        "progresso": {
+            "pdfs": {"feitos": 0, "total": len(pdfs), "paginas": 0, "pix": 0},
+            "excels": {"feitos": 0, "total": len(excels), "linhas": 0},
+            "conciliacao": {"estado": "aguardando"},
+        },
+        "mudou": asyncio.Event(),
+        "atualizado_em": time.time(),
+    }
+    try:
+        _fila_jobs.put_nowait(job)
+    except asyncio.QueueFull:  # a fila encheu enquanto os arquivos eram gravados
+        await remover_uploads(arquivos["pasta"])
+        return ocupado
+    _jobs[job["id"]] = job
+    return {"job_id": job["id"], "estado": job["estado"]}
+
+
+@app.get("/jobs/{job_id}")
+async def estado_job(job_id: str):
+    job = _jobs.get(job_id)
+    if not job:
+        return JSONResponse({"erro": "Job não encontrado."}, status_code=404)
+    return _job_publico(job)
+
+
+@app.get("/jobs/{job_id}/eventos")
+async def eventos_job(job_id: str):
+    if job_id not in _jobs:
+        return JSONResponse({"erro": "Job não encontrado."}, status_code=404)
+
+    async def gerar():
+        while True:
+            job = _jobs.get(job_id)
+            if not job:
+                return
+            mudou = job["mudou"]
+            yield f"data: {json.dumps(_job_publico(job), ensure_ascii=False)}\n\n"
+            if job["estado"] in ("concluido", "erro"):
+                return
+            try:
+                await asyncio.wait_for(mudou.wait(), timeout=15)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"  # mantém a conexão viva atrás de proxies
+
+    return StreamingResponse(gerar(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.get("/jobs/{job_id}/resultado")
+async def resultado_job(job_id: str):
+    job = _jobs.get(job_id)
+    if not job:
+        return JSONResponse({"erro": "Job não encontrado."}, status_code=404)
+    if job["estado"] not in ("concluido", "erro"):
+        return JSONResponse(_job_publico(job), status_code=202)
+    return job["resultado"]
+
+
+# ==========================================================
+# 🧾 SESSÕES DE CONFERÊNCIA (arquivos chegando aos poucos)
+# ==========================================================
+# POST   /sessoes                             → {"sessao_id": ..., ...resultado vazio}
+# POST   /sessoes/{id}/arquivos               → adiciona PDFs e/ou planilhas (campos pdfs, excels, senha)
+# DELETE /sessoes/{id}/arquivos/{arquivo_id}  → tira um arquivo da sessão
+# GET    /sessoes/{id}                        → resultado atual
+# DELETE /sessoes/{id}                        → encerra a sessão
+# Cada arquivo é lido uma vez e fica guardado na sessão (lote compacto). O resultado é
+# sempre o mesmo do /conferir_caixa com os arquivos na ordem em que entraram na sessão:
+# a conciliação percorre as linhas em ordem e cada uma só depende das anteriores, então
+# planilhas novas (que entram no fim) cruzam só as linhas delas, com os PIX já conferidos
+# fora da busca. Entrar PDF ou sair qualquer arquivo muda o que as linhas antigas veem e
+# refaz a sessão inteira.
+CONFERIR_SESSOES_MAX = int(os.getenv("CONFERIR_SESSOES_MAX", "50"))
+CONFERIR_SESSOES_TTL = int(os.getenv("CONFERIR_SESSOES_TTL", str(12 * 3600)))  # segundos sem uso
+
+_sessoes: Dict[str, Dict[str, Any]] = {}
+
+
+def _limpar_sessoes_antigas():
+    limite = time.time() - CONFERIR_SESSOES_TTL
+    for sessao_id in [s for s, sessao in _sessoes.items() if sessao["atualizado_em"] < limite]:
+        _sessoes.pop(sessao_id, None)
+
+
+def _obter_sessao(sessao_id: str) -> Dict[str, Any] | None:
+    sessao = _sessoes.get(sessao_id)
+    if sessao:
+        sessao["atualizado_em"] = time.time()
+    return sessao
+
 
-    def similaridade(a, b):
-        return SequenceMatcher(None, normalizar(a), normalizar(b)).ratio()
+def _juntar_arquivos_sessao(arquivos: List[Dict[str, Any]], campos: tuple):
+    """Lote único dos arquivos + a chave (id do arquivo, linha) de cada posição dele."""
+    lote = juntar_transacoes([a["lote"] for a in arquivos], campos)
+    chaves = [(a["id"], linha) for a in arquivos for linha in range(a["lote"]["n"])]
+    return lote, chaves
 
-    def normalizar_hora(h: str) -> str:
-        if not h:
-            return ""
-        h = h.strip().lower().replace("h", ":").replace(".", ":")
 
-        if re.fullmatch(r"\d{1,2}$", h):
-            return f"{int(h):02d}:00"
+async def _reconciliar_sessao(sessao: Dict[str, Any], so_planilhas_novas: bool, metricas: dict):
+    """
+    Atualiza sessao["resposta"] depois de arquivos entrarem ou saírem.
+    Com `so_planilhas_novas` (só entraram planilhas), mantém o resultado das linhas que já
+    estavam na sessão e cruza (no pool) só as novas, com os PIX conferidos fora da busca;
+    senão, cruza de novo todas as linhas.
+    """
+    pdfs = [a for a in sessao["arquivos"] if a["tipo"] == "pdf"]
+    excels = [a for a in sessao["arquivos"] if a["tipo"] == "excel"]
+    dados_pdf, chaves_pdf = _juntar_arquivos_sessao(pdfs, CAMPOS_PDF)
+    dados_excel, chaves_excel = _juntar_arquivos_sessao(excels, CAMPOS_EXCEL)
+    posicao_pdf = {chave: i for i, chave in enumerate(chaves_pdf)}
+    agentes = valores_coluna(dados_excel, "agente")
+
+    conferidos, faltando, usados = {}, {}, {}
+    if so_planilhas_novas:
+        conferidos, faltando = dict(sessao["conferidos"]), dict(sessao["faltando"])
+        for i, chave in enumerate(chaves_excel):
+            if chave in conferidos:
+                usados[posicao_pdf[conferidos[chave][0]]] = agentes[i]
+
+    linhas = [i for i, chave in enumerate(chaves_excel) if chave not in conferidos and chave not in faltando]
+    if linhas:
+        apelidos = {}
+        if CONFERIR_HISTORICO_DB:
+            nomes = valores_coluna(dados_excel, "nome")
+            apelidos = await asyncio.to_thread(carregar_apelidos, [nomes[i] for i in linhas])
+        with medir(metricas["tempos"], "conciliacao"):
+            resultado = await executar_em_pool(conciliar, dados_pdf, dados_excel, usados, linhas, apelidos)
+        acumular_metricas(metricas, resultado)
+        c, f = resultado["conferidos"], resultado["faltando_no_pdf"]
+        for e, p, sim in zip(c["excel"].tolist(), c["pdf"].tolist(), c["similaridade"].tolist()):
+            conferidos[chaves_excel[e]] = (chaves_pdf[p], sim)
+        for e, banco, motivo in zip(f["excel"].tolist(), f["banco"], f["motivo"]):
+            faltando[chaves_excel[e]] = (banco, motivo)
+    metricas["contadores"]["linhas_recruzadas"] += len(linhas)
+    sessao["conferidos"], sessao["faltando"] = conferidos, faltando
+
+    # resultado completo, na ordem das linhas, no mesmo formato do /conferir_caixa
+    indices = {
+        "conferidos": {"excel": [], "pdf": [], "similaridade": []},
+        "faltando_no_pdf": {"excel": [], "banco": [], "motivo": []},
+    }
+    for i, chave in enumerate(chaves_excel):
+        if chave in conferidos:
+            chave_pdf, sim = conferidos[chave]
+            indices["conferidos"]["excel"].append(i)
+            indices["conferidos"]["pdf"].append(posicao_pdf[chave_pdf])
+            indices["conferidos"]["similaridade"].append(sim)
+        else:
+            banco, motivo = faltando[chave]
+            indices["faltando_no_pdf"]["excel"].append(i)
+            indices["faltando_no_pdf"]["banco"].append(banco)
+            indices["faltando_no_pdf"]["motivo"].append(motivo)
+    livres = np.ones(len(chaves_pdf), dtype=bool)
+    livres[indices["conferidos"]["pdf"]] = False
+    for chave in ("excel", "pdf"):
+        indices["conferidos"][chave] = np.array(indices["conferidos"][chave], dtype=np.int32)
+    indices["conferidos"]["similaridade"] = np.array(indices["conferidos"]["similaridade"], dtype=np.float64)
+    indices["faltando_no_pdf"]["excel"] = np.array(indices["faltando_no_pdf"]["excel"], dtype=np.int32)
+    indices["faltando_no_excel"] = {"pdf": np.flatnonzero(livres).astype(np.int32)}
+
+    with medir(metricas["tempos"], "montar_resposta"):
+        resultado = await asyncio.to_thread(expandir_conciliacao, indices, dados_pdf, dados_excel)
+    sessao["resposta"] = {
+        "sessao_id": sessao["id"],
+        "arquivos": [
+            {"id": a["id"], "tipo": a["tipo"], "nome": a["nome"], "banco": a["banco"], "registros": a["lote"]["n"]}
+            for a in sessao["arquivos"]
+        ],
+        "banco": ", ".join(dict.fromkeys(a["banco"].upper() for a in pdfs)),
+        **resultado,
+    }
+
+
+@app.post("/sessoes")
+async def criar_sessao():
+    _limpar_sessoes_antigas()
+    if len(_sessoes) >= CONFERIR_SESSOES_MAX:
+        mais_antiga = min(_sessoes, key=lambda s: _sessoes[s]["atualizado_em"])
+        _sessoes.pop(mais_antiga)
+    sessao = {
+        "id": uuid.uuid4().hex,
+        "arquivos": [],
+        "conferidos": {},  # (arquivo, linha) da planilha → ((arquivo, linha) do PIX, similaridade)
+        "faltando": {},    # (arquivo, linha) da planilha → (banco, motivo)
+        "lock": asyncio.Lock(),
+        "atualizado_em": time.time(),
+    }
+    await _reconciliar_sessao(sessao, True, nova_metricas())
+    _sessoes[sessao["id"]] = sessao
+    return sessao["resposta"]
 
-        if re.fullmatch(r"\d{3,4}$", h):
-            return f"{int(h[:-2]):02d}:{int(h[-2:]):02d}"
 
-        if re.fullmatch(r"\d{1,2}:\d{1,2}$", h):
-            p = h.split(":")
-            return f"{int(p[0]):02d}:{int(p[1]):02d}"
+@app.get("/sessoes/{sessao_id}")
+async def estado_sessao(sessao_id: str):
+    sessao = _obter_sessao(sessao_id)
+    if not sessao:
+        return JSONResponse({"erro": "Sessão não encontrada."}, status_code=404)
+    return sessao["resposta"]
 
-        if re.fullmatch(r"\d{2}:\d{2}:\d{2}$", h):
-            return h[:5]
 
+@app.delete("/sessoes/{sessao_id}")
+async def encerrar_sessao(sessao_id: str):
+    if _sessoes.pop(sessao_id, None) is None:
+        return JSONResponse({"erro": "Sessão não encontrada."}, status_code=404)
+    return {"sessao_id": sessao_id, "encerrada": True}
+
+
+@app.post("/sessoes/{sessao_id}/arquivos")
+async def adicionar_arquivos_sessao(
+    sessao_id: str,
+    pdfs: List[UploadFile] = File(None),
+    excels: List[UploadFile] = File(None),
+    senha: str = Form(None),
+):
+    """Lê só os arquivos novos; os que derem erro ficam de fora e aparecem em `erros_arquivos`."""
+    sessao = _obter_sessao(sessao_id)
+    if not sessao:
+        return JSONResponse({"erro": "Sessão não encontrada."}, status_code=404)
+    pdfs, excels = pdfs or [], excels or []
+
+    arquivos = await salvar_uploads(pdfs, excels)
+    if "erro" in arquivos:
+        return JSONResponse(arquivos, status_code=413)
+
+    metricas = nova_metricas()
+    try:
+        with medir(metricas["tempos"], "arquivos"):
+            respostas = await asyncio.gather(
+                *[processar_pdf_com_cache(caminho, senha, None, metricas) for caminho in arquivos["pdfs"]],
+                *[processar_excel_com_cache(caminho, metricas) for caminho in arquivos["excels"]],
+                return_exceptions=True,
+            )
+    finally:
+        await remover_uploads(arquivos["pasta"])
+
+    erros = []
+    novos = []
+    for upload, tipo, resp in zip([*pdfs, *excels], ["pdf"] * len(pdfs) + ["excel"] * len(excels), respostas):
+        if isinstance(resp, BaseException):
+            logger.error("Falha ao processar %s da sessão %s", upload.filename, sessao_id, exc_info=resp)
+            resp = {"erro": f"Falha ao processar: {resp}"}
+        if "erro" in resp:
+            erros.append({"nome": upload.filename, "erro": resp["erro"]})
+            continue
+        novos.append({
+            "id": uuid.uuid4().hex[:12],
+            "tipo": tipo,
+            "nome": upload.filename or "",
+            "banco": resp.get("banco", ""),
+            "lote": resp["dados"] if tipo == "pdf" else resp["tabela"],
+        })
+
+    try:
+        async with sessao["lock"]:
+            sessao["arquivos"].extend(novos)
+            await _reconciliar_sessao(sessao, all(a["tipo"] == "excel" for a in novos), metricas)
+            resposta = dict(sessao["resposta"])
+    finally:
+        registrar_metricas(metricas)
+    if erros:
+        resposta["erros_arquivos"] = erros
+    return resposta
+
+
+@app.delete("/sessoes/{sessao_id}/arquivos/{arquivo_id}")
+async def remover_arquivo_sessao(sessao_id: str, arquivo_id: str):
+    sessao = _obter_sessao(sessao_id)
+    if not sessao:
+        return JSONResponse({"erro": "Sessão não encontrada."}, status_code=404)
+    metricas = nova_metricas()
+    try:
+        async with sessao["lock"]:
+            removido = next((a for a in sessao["arquivos"] if a["id"] == arquivo_id), None)
+            if removido is None:
+                return JSONResponse({"erro": "Arquivo não encontrado na sessão."}, status_code=404)
+            sessao["arquivos"].remove(removido)
+            await _reconciliar_sessao(sessao, False, metricas)
+            return sessao["resposta"]
+    finally:
+        registrar_metricas(metricas)
+
+
+# ==========================================================
+# 🗃️ HISTÓRICO DE TRANSAÇÕES (SQLite)
+# ==========================================================
+# Desligado por padrão: com CONFERIR_HISTORICO_DB, cada conferência grava num SQLite local
+# os PIX lidos e as linhas das planilhas (com o PIX conferido, se houver). Reenviar um PIX
+# (outro extrato do mesmo período) não o duplica: a chave é banco + data + hora + valor +
+# nome + ocorrência (n-ésimo PIX igual no extrato). Reenviar uma planilha também não: a
+# chave da linha é o conteúdo da planilha + a posição nela. O dia da linha é o do PIX
+# conferido com ela; sem par, o dia mais comum entre os PIX conferidos com a planilha
+# (ou, sem nenhum, o do PIX mais recente do extrato). Uma nova conferência da mesma
+# planilha atualiza o PIX das linhas que acharam par e não apaga os pares das outras.
+# GET /historico/pix     → PIX gravados (filtros: inicio, fim, valor, hora, nome, livres)
+# GET /historico/resumo  → o mês até hoje (ou ?mes=AAAA-MM): totais por dia e por banco
+# Na conferência, cada linha que ficou sem PIX também é procurada entre os PIX ainda livres
+# dos CONFERIR_HISTORICO_DIAS dias antes do extrato (campo "pix_outro_dia" da linha).
+# Apelidos: um par (nome na planilha, nome no PIX) conferido com nomes diferentes e
+# similaridade ≥ CONFERIR_APELIDOS_SIMILARIDADE conta uma vez por linha da planilha, e só
+# quando o PIX gravado da linha muda (reenviar a mesma conferência não conta de novo).
+# A partir de CONFERIR_APELIDOS_MIN_VEZES linhas (ou na hora, se confirmado à mão no
+# frontend: POST/DELETE /apelidos) a conciliação casa o par sem comparar nomes, se não
+# houver PIX livre de mesmo valor com o nome idêntico ao da planilha.
+# CONFERIR_HISTORICO_DB       → arquivo do banco, ex.: historico_conferencia.sqlite3
+#                               (padrão: vazio = sem histórico nem apelidos)
+# CONFERIR_HISTORICO_DIAS     → dias anteriores consultados (padrão: 3; 0 = não consulta)
+# CONFERIR_APELIDOS_MIN_VEZES → linhas conferidas até um par virar apelido (padrão: 2)
+# CONFERIR_APELIDOS_SIMILARIDADE → similaridade mínima de um par para contar (padrão: 0.90)
+CONFERIR_HISTORICO_DB = os.getenv("CONFERIR_HISTORICO_DB", "")
+CONFERIR_HISTORICO_DIAS = int(os.getenv("CONFERIR_HISTORICO_DIAS", "3"))
+CONFERIR_APELIDOS_MIN_VEZES = int(os.getenv("CONFERIR_APELIDOS_MIN_VEZES", "2"))
+CONFERIR_APELIDOS_SIMILARIDADE = float(os.getenv("CONFERIR_APELIDOS_SIMILARIDADE", "0.90"))
+
+_ESQUEMA_HISTORICO = """
+CREATE TABLE IF NOT EXISTS pix (
+    id INTEGER PRIMARY KEY,
+    banco TEXT NOT NULL,
+    data INTEGER NOT NULL,          -- AAAAMMDD (0 = sem data)
+    hora INTEGER NOT NULL,          -- HHMM (-1 = sem hora)
+    centavos INTEGER NOT NULL,
+    nome TEXT NOT NULL,
+    ocorrencia INTEGER NOT NULL,
+    nome_norm TEXT NOT NULL,
+    UNIQUE (banco, data, hora, centavos, nome, ocorrencia)
+);
+CREATE INDEX IF NOT EXISTS pix_data_valor_hora ON pix (data, centavos, hora);
+CREATE INDEX IF NOT EXISTS pix_nome ON pix (nome_norm);
+
+CREATE TABLE IF NOT EXISTS caixa (
+    id INTEGER PRIMARY KEY,
+    planilha TEXT NOT NULL,         -- assinatura do conteúdo da planilha (ver _assinatura_planilha)
+    linha INTEGER NOT NULL,         -- posição na planilha
+    dia INTEGER NOT NULL,           -- AAAAMMDD
+    agente TEXT NOT NULL,
+    nome TEXT NOT NULL,
+    hora INTEGER NOT NULL,
+    centavos INTEGER NOT NULL,
+    nome_norm TEXT NOT NULL,
+    pix_id INTEGER REFERENCES pix (id),  -- PIX conferido (NULL = faltou no PDF)
+    UNIQUE (planilha, linha)
+);
+CREATE INDEX IF NOT EXISTS caixa_dia_valor_hora ON caixa (dia, centavos, hora);
+CREATE INDEX IF NOT EXISTS caixa_nome ON caixa (nome_norm);
+CREATE INDEX IF NOT EXISTS caixa_pix ON caixa (pix_id);
+
+CREATE TABLE IF NOT EXISTS apelidos (
+    nome_excel TEXT NOT NULL,           -- nomes normalizados
+    nome_pdf TEXT NOT NULL,
+    vezes INTEGER NOT NULL DEFAULT 0,   -- linhas da planilha em que o par foi conferido
+    manual INTEGER NOT NULL DEFAULT 0,  -- confirmado à mão no frontend
+    PRIMARY KEY (nome_excel, nome_pdf)
+) WITHOUT ROWID;
+
+PRAGMA user_version = 3;
+"""
+# versão 2: linhas da planilha identificadas pela planilha + posição (antes, pelo dia do extrato)
+# versão 3: apelidos contados por linha e só com similaridade alta
+_VERSAO_HISTORICO = 3
+_PIX_LIVRE = "NOT EXISTS (SELECT 1 FROM caixa WHERE caixa.pix_id = pix.id)"
+
+_historico_pronto = False
+_historico_lock = threading.Lock()
+
+
+@contextmanager
+def conectar_historico():
+    """Conexão com o histórico (cria as tabelas na primeira vez); commit ao sair sem erro."""
+    global _historico_pronto
+    conexao = sqlite3.connect(CONFERIR_HISTORICO_DB, timeout=30)
+    try:
+        if not _historico_pronto:
+            with _historico_lock:
+                conexao.execute("PRAGMA journal_mode=WAL")
+                versao = conexao.execute("PRAGMA user_version").fetchone()[0]
+                if versao < 2:
+                    # linhas gravadas antes não sabem de que planilha vieram
+                    conexao.execute("DROP TABLE IF EXISTS caixa")
+                if versao < 3 and conexao.execute("SELECT 1 FROM sqlite_master WHERE name = 'apelidos'").fetchone():
+                    # contagens antigas incluíam pares de nomes pouco parecidos
+                    conexao.execute("DELETE FROM apelidos WHERE manual = 0")
+                    conexao.commit()
+                conexao.executescript(_ESQUEMA_HISTORICO)
+                _historico_pronto = True
+        with conexao:
+            yield conexao
+    finally:
+        conexao.close()
+
+
+def _data_aaaammdd(s: str) -> int:
+    d = try_parse_date(s)
+    return d.year * 10000 + d.month * 100 + d.day if d else 0
+
+
+def _data_de_aaaammdd(v: int) -> date:
+    return date(v // 10000, v // 100 % 100, v % 100)
+
+
+def _hora_hhmm(h: str) -> int:
+    h = normalizar_hora(h)
+    return int(h[:2]) * 100 + int(h[3:]) if h else -1
+
+
+def _centavos(valor) -> int:
+    return int(round((valor or 0.0) * 100))
+
+
+def _com_ocorrencia(chaves: List[tuple]) -> List[tuple]:
+    """Acrescenta a cada chave quantas iguais vieram antes dela na lista (0, 1, ...)."""
+    vistas = Counter()
+    saida = []
+    for chave in chaves:
+        saida.append((*chave, vistas[chave]))
+        vistas[chave] += 1
+    return saida
+
+
+def pix_de_outros_dias(conexao, dados_pdf, dados_excel, linhas: List[int]) -> Dict[int, Dict[str, Any]]:
+    """
+    Para cada linha da planilha (posições em `linhas`), procura um PIX gravado ainda livre,
+    de mesmo valor, nos CONFERIR_HISTORICO_DIAS dias antes do primeiro dia do extrato; vale
+    o de nome mais parecido, com similaridade ≥ 0,70. Um PIX é sugerido para uma linha só.
+    """
+    datas = [d for d in map(_data_aaaammdd, set(valores_coluna(dados_pdf, "data"))) if d]
+    if not datas or not linhas:
+        return {}
+    primeiro = _data_de_aaaammdd(min(datas))
+    inicio = primeiro - timedelta(days=CONFERIR_HISTORICO_DIAS)
+    fim = primeiro - timedelta(days=1)
+    faixa = (inicio.year * 10000 + inicio.month * 100 + inicio.day, fim.year * 10000 + fim.month * 100 + fim.day)
+
+    nomes, valores = valores_coluna(dados_excel, "nome"), valores_coluna(dados_excel, "valor")
+    sugeridos = set()
+    achados = {}
+    for i in linhas:
+        candidatos = conexao.execute(
+            f"SELECT id, data, hora, nome, nome_norm, centavos, banco FROM pix "
+            f"WHERE data BETWEEN ? AND ? AND centavos = ? AND {_PIX_LIVRE} ORDER BY data, hora, id",
+            (*faixa, _centavos(valores[i])),
+        ).fetchall()
+        nome_norm = normalizar_nome(nomes[i])
+        melhor = None
+        for pix_id, data, hora, nome, nome_pix, centavos, banco in candidatos:
+            if pix_id in sugeridos:
+                continue
+            sim = similaridade_nomes(nome_norm, nome_pix)
+            if sim >= 0.70 and (melhor is None or sim > melhor[0]):
+                melhor = (sim, pix_id, {
+                    "data": _formatar_data(data),
+                    "hora": _formatar_hora(hora),
+                    "nome": nome,
+                    "valor": centavos / 100,
+                    "banco": banco,
+                    "similaridade": round(sim, 2),
+                })
+        if melhor:
+            sugeridos.add(melhor[1])
+            achados[i] = melhor[2]
+    return achados
+
+
+def _assinatura_planilha(lote: Dict[str, Any]) -> str:
+    """Hash do conteúdo de um lote de planilha: a mesma planilha reenviada tem a mesma assinatura."""
+    colunas = [valores_coluna(lote, campo) for campo in CAMPOS_EXCEL]
+    return hashlib.sha256(json.dumps(colunas, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()[:32]
+
+
+def gravar_historico(conexao, dados_pdf, lotes_excel: List[Dict[str, Any]], resultado: Dict[str, Any]) -> int:
+    """
+    Grava os PIX e as linhas de uma conferência (`resultado` de `conciliar`, com as linhas
+    na ordem de `lotes_excel`, um lote por planilha) e conta os apelidos das linhas cujo
+    PIX mudou. Retorna o nº de PIX novos.
+    """
+    pix = _com_ocorrencia([
+        (banco or "", _data_aaaammdd(data), _hora_hhmm(hora), _centavos(valor), nome or "")
+        for data, hora, nome, valor, banco in zip(*(valores_coluna(dados_pdf, campo) for campo in CAMPOS_PDF))
+    ])
+    conferidos = resultado["conferidos"]
+    par = dict(zip(conferidos["excel"].tolist(), conferidos["pdf"].tolist()))
+    similaridade = dict(zip(conferidos["excel"].tolist(), conferidos["similaridade"].tolist()))
+    dia_extrato = max((p[1] for p in pix), default=0)
+
+    caixa = []
+    for lote in lotes_excel:
+        inicio = len(caixa)
+        dias = Counter(pix[par[e]][1] for e in range(inicio, inicio + lote["n"]) if e in par and pix[par[e]][1])
+        dia_planilha = dias.most_common(1)[0][0] if dias else dia_extrato
+        assinatura = _assinatura_planilha(lote)
+        for linha, (agente, nome, hora, valor) in enumerate(zip(*(valores_coluna(lote, campo) for campo in CAMPOS_EXCEL))):
+            e = inicio + linha
+            dia = pix[par[e]][1] if e in par and pix[par[e]][1] else dia_planilha
+            caixa.append((assinatura, linha, dia, agente or "", nome or "", _hora_hhmm(hora), _centavos(valor)))
+    normalizados = {nome: normalizar_nome(nome) for nome in {p[4] for p in pix} | {c[4] for c in caixa}}
+
+    # os PIX passam por uma tabela temporária: um INSERT e um SELECT (pela chave única)
+    # para todos, em vez de um SELECT por PIX atrás do id
+    conexao.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS pix_lote (pos INTEGER PRIMARY KEY, banco, data, hora, centavos, nome, ocorrencia, nome_norm)"
+    )
+    conexao.execute("DELETE FROM pix_lote")
+    conexao.executemany(
+        "INSERT INTO pix_lote VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [(pos, *p, normalizados[p[4]]) for pos, p in enumerate(pix)],
+    )
+    antes = conexao.total_changes
+    conexao.execute(
+        "INSERT OR IGNORE INTO pix (banco, data, hora, centavos, nome, ocorrencia, nome_norm) "
+        "SELECT banco, data, hora, centavos, nome, ocorrencia, nome_norm FROM pix_lote ORDER BY pos"
+    )
+    novos = conexao.total_changes - antes
+    ids = [
+        pix_id for _, pix_id in conexao.execute(
+            "SELECT l.pos, p.id FROM pix_lote l JOIN pix p ON p.banco = l.banco AND p.data = l.data "
+            "AND p.hora = l.hora AND p.centavos = l.centavos AND p.nome = l.nome AND p.ocorrencia = l.ocorrencia "
+            "ORDER BY l.pos"
+        )
+    ]
+    conexao.execute("DELETE FROM pix_lote")
+
+    pix_gravado = {}
+    for assinatura in {c[0] for c in caixa}:
+        for linha, pix_id in conexao.execute("SELECT linha, pix_id FROM caixa WHERE planilha = ?", (assinatura,)):
+            pix_gravado[(assinatura, linha)] = pix_id
+    conexao.executemany(
+        "INSERT INTO caixa (planilha, linha, dia, agente, nome, hora, centavos, nome_norm, pix_id) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (planilha, linha) DO UPDATE SET "
+        "dia = CASE WHEN excluded.pix_id IS NULL THEN caixa.dia ELSE excluded.dia END, "
+        "pix_id = COALESCE(excluded.pix_id, caixa.pix_id)",
+        [(*c, normalizados[c[4]], ids[par[e]] if e in par else None) for e, c in enumerate(caixa)],
+    )
+    pares = Counter(
+        (normalizados[caixa[e][4]], normalizados[pix[p][4]])
+        for e, p in par.items()
+        if similaridade[e] >= CONFERIR_APELIDOS_SIMILARIDADE and pix_gravado.get(caixa[e][:2]) != ids[p]
+    )
+    conexao.executemany(
+        "INSERT INTO apelidos (nome_excel, nome_pdf, vezes) VALUES (?, ?, ?) "
+        "ON CONFLICT (nome_excel, nome_pdf) DO UPDATE SET vezes = vezes + excluded.vezes",
+        [(a, b, vezes) for (a, b), vezes in pares.items() if a and b and a != b],
+    )
+    return novos
+
+
+def carregar_apelidos(nomes: List[str]) -> Dict[str, List[str]]:
+    """
+    Apelidos dos nomes da planilha informados, no formato que `conciliar` recebe:
+    {nome normalizado: [nomes normalizados dos PIX]}. Falhas só vão para o log.
+    """
+    chaves = sorted({normalizar_nome(nome) for nome in set(nomes) if nome} - {""})
+    apelidos: Dict[str, List[str]] = {}
+    try:
+        with conectar_historico() as conexao:
+            for ini in range(0, len(chaves), 500):
+                parte = chaves[ini:ini + 500]
+                for nome_excel, nome_pdf in conexao.execute(
+                    f"SELECT nome_excel, nome_pdf FROM apelidos WHERE nome_excel IN ({', '.join('?' * len(parte))}) "
+                    "AND (manual = 1 OR vezes >= ?)",
+                    (*parte, CONFERIR_APELIDOS_MIN_VEZES),
+                ):
+                    apelidos.setdefault(nome_excel, []).append(nome_pdf)
+    except sqlite3.Error:
+        logger.exception("Falha ao carregar os apelidos")
+        return {}
+    return apelidos
+
+
+def gravar_apelido_manual(nome_excel: str, nome_pdf: str, confirmado: bool) -> Dict[str, Any]:
+    """
+    Confirmação manual de um par (vale já na próxima conferência) ou, com confirmado=False,
+    desfaz só a confirmação: a contagem automática do par continua (o par só é apagado se
+    nunca foi conferido sozinho).
+    """
+    par = (normalizar_nome(nome_excel), normalizar_nome(nome_pdf))
+    if not all(par):
+        return {"erro": "Informe nome_excel e nome_pdf."}
+    with conectar_historico() as conexao:
+        if confirmado:
+            conexao.execute(
+                "INSERT INTO apelidos (nome_excel, nome_pdf, manual) VALUES (?, ?, 1) "
+                "ON CONFLICT (nome_excel, nome_pdf) DO UPDATE SET manual = 1",
+                par,
+            )
+        else:
+            conexao.execute("UPDATE apelidos SET manual = 0 WHERE nome_excel = ? AND nome_pdf = ?", par)
+            conexao.execute("DELETE FROM apelidos WHERE nome_excel = ? AND nome_pdf = ? AND vezes = 0", par)
+    return {"nome_excel": par[0], "nome_pdf": par[1], "confirmado": confirmado}
+
+
+def atualizar_historico(dados_pdf, dados_excel, lotes_excel: List[Dict[str, Any]], resultado: Dict[str, Any]):
+    """
+    Consulta os PIX de dias anteriores para as linhas que ficaram sem par e depois grava a
+    conferência (`dados_excel` = `lotes_excel` juntos). Retorna ({linha: PIX de outro dia},
+    nº de PIX novos); falhas só vão para o log.
+    """
+    try:
+        with conectar_historico() as conexao:
+            anteriores = {}
+            if CONFERIR_HISTORICO_DIAS > 0:
+                linhas = resultado["faltando_no_pdf"]["excel"].tolist()
+                anteriores = pix_de_outros_dias(conexao, dados_pdf, dados_excel, linhas)
+            return anteriores, gravar_historico(conexao, dados_pdf, lotes_excel, resultado)
+    except sqlite3.Error:
+        logger.exception("Falha ao atualizar o histórico de transações")
+        return {}, 0
+
+
+def buscar_pix_historico(
+    inicio: str = None, fim: str = None, valor: float = None, hora: str = None, nome: str = None,
+    livres: bool = False, limite: int = 500,
+) -> Dict[str, Any]:
+    """
+    PIX gravados, em ordem de data e hora. `hora` aceita 10 minutos de diferença; `nome`
+    casa pelo começo do nome normalizado; `livres` deixa só os que nenhuma linha conferiu.
+    """
+    filtros, params = [], []
+    for campo, texto, operador in (("inicio", inicio, ">="), ("fim", fim, "<=")):
+        if texto:
+            d = _data_aaaammdd(texto)
+            if not d:
+                return {"erro": f"Data inválida em '{campo}': {texto}"}
+            filtros.append(f"data {operador} ?")
+            params.append(d)
+    if valor is not None:
+        filtros.append("centavos = ?")
+        params.append(_centavos(valor))
+    if hora:
+        h = _hora_hhmm(hora)
+        if h < 0:
+            return {"erro": f"Hora inválida: {hora}"}
+        minutos = h // 100 * 60 + h % 100
+        de, ate = max(minutos - 10, 0), min(minutos + 10, 23 * 60 + 59)
+        filtros.append("hora BETWEEN ? AND ?")
+        params += [de // 60 * 100 + de % 60, ate // 60 * 100 + ate % 60]
+    if nome:
+        nome_norm = normalizar_nome(nome)
+        filtros.append("nome_norm >= ? AND nome_norm < ?")
+        params += [nome_norm, nome_norm + "\U0010ffff"]
+    if livres:
+        filtros.append(_PIX_LIVRE)
+
+    with conectar_historico() as conexao:
+        linhas = conexao.execute(
+            "SELECT data, hora, nome, centavos, banco, "
+            "(SELECT agente FROM caixa WHERE caixa.pix_id = pix.id LIMIT 1) FROM pix"
+            + (" WHERE " + " AND ".join(filtros) if filtros else "")
+            + " ORDER BY data, hora, id LIMIT ?",
+            (*params, limite),
+        ).fetchall()
+    return {
+        "pix": [
+            {
+                "data": _formatar_data(data),
+                "hora": _formatar_hora(h),
+                "nome": nome_pix,
+                "valor": centavos / 100,
+                "banco": banco,
+                "conferido_por": agente,
+            }
+            for data, h, nome_pix, centavos, banco, agente in linhas
+        ],
+    }
+
+
+def resumo_historico(mes: str = None) -> Dict[str, Any]:
+    """Totais de PIX por dia e por banco no mês (AAAA-MM; padrão: o atual, até hoje)."""
+    hoje = date.today()
+    if mes:
+        m = re.fullmatch(r"(\d{4})-(\d{2})", mes.strip())
+        if not m or not 1 <= int(m.group(2)) <= 12:
+            return {"erro": f"Mês inválido (use AAAA-MM): {mes}"}
+        ano, numero = int(m.group(1)), int(m.group(2))
+    else:
+        ano, numero = hoje.year, hoje.month
+    inicio = ano * 10000 + numero * 100 + 1
+    fim = min(inicio + 30, hoje.year * 10000 + hoje.month * 100 + hoje.day)
+
+    with conectar_historico() as conexao:
+        dias = conexao.execute(
+            f"SELECT data, COUNT(*), SUM(centavos), SUM(NOT {_PIX_LIVRE}) FROM pix "
+            "WHERE data BETWEEN ? AND ? GROUP BY data ORDER BY data",
+            (inicio, fim),
+        ).fetchall()
+        bancos = conexao.execute(
+            "SELECT banco, COUNT(*), SUM(centavos) FROM pix WHERE data BETWEEN ? AND ? GROUP BY banco ORDER BY banco",
+            (inicio, fim),
+        ).fetchall()
+        linhas, sem_pix = conexao.execute(
+            "SELECT COUNT(*), COALESCE(SUM(pix_id IS NULL), 0) FROM caixa WHERE dia BETWEEN ? AND ?", (inicio, fim)
+        ).fetchone()
+    return {
+        "mes": f"{ano:04d}-{numero:02d}",
+        "pix": sum(d[1] for d in dias),
+        "valor": sum(d[2] for d in dias) / 100,
+        "linhas_caixa": linhas,
+        "linhas_sem_pix": sem_pix,
+        "dias": [
+            {"data": _formatar_data(data), "pix": n, "valor": centavos / 100, "conferidos": conferidos}
+            for data, n, centavos, conferidos in dias
+        ],
+        "bancos": [{"banco": banco, "pix": n, "valor": centavos / 100} for banco, n, centavos in bancos],
+    }
+
+
+@app.get("/historico/pix")
+async def historico_pix(
+    inicio: str = None,
+    fim: str = None,
+    valor: float = None,
+    hora: str = None,
+    nome: str = None,
+    livres: bool = False,
+    limite: int = 500,
+):
+    if not CONFERIR_HISTORICO_DB:
+        return JSONResponse({"erro": "Histórico desativado (CONFERIR_HISTORICO_DB vazio)."}, status_code=404)
+    resp = await asyncio.to_thread(buscar_pix_historico, inicio, fim, valor, hora, nome, livres, limite)
+    return JSONResponse(resp, status_code=400) if "erro" in resp else resp
+
+
+@app.post("/apelidos")
+async def confirmar_apelido(nome_excel: str = Form(None), nome_pdf: str = Form(None)):
+    if not CONFERIR_HISTORICO_DB:
+        return JSONResponse({"erro": "Histórico desativado (CONFERIR_HISTORICO_DB vazio)."}, status_code=404)
+    resp = await asyncio.to_thread(gravar_apelido_manual, nome_excel, nome_pdf, True)
+    return JSONResponse(resp, status_code=400) if "erro" in resp else resp
+
+
+@app.delete("/apelidos")
+async def esquecer_apelido(nome_excel: str = Form(None), nome_pdf: str = Form(None)):
+    if not CONFERIR_HISTORICO_DB:
+        return JSONResponse({"erro": "Histórico desativado (CONFERIR_HISTORICO_DB vazio)."}, status_code=404)
+    resp = await asyncio.to_thread(gravar_apelido_manual, nome_excel, nome_pdf, False)
+    return JSONResponse(resp, status_code=400) if "erro" in resp else resp
+
+
+@app.get("/historico/resumo")
+async def historico_resumo(mes: str = None):
+    if not CONFERIR_HISTORICO_DB:
+        return JSONResponse({"erro": "Histórico desativado (CONFERIR_HISTORICO_DB vazio)."}, status_code=404)
+    resp = await asyncio.to_thread(resumo_historico, mes)
+    return JSONResponse(resp, status_code=400) if "erro" in resp else resp
+
+
+# ==========================================================
+# 🔗 CONCILIAÇÃO Excel ↔ PDF
+# ==========================================================
+# Na busca aproximada, quantos PIX (os que mais dividem tokens/trigramas com o nome)
+# são pontuados antes de descartar o resto pelo limite superior da pontuação.
+CONFERIR_FUZZY_TOP_K = int(os.getenv("CONFERIR_FUZZY_TOP_K", "50"))
+
+# Os mesmos clientes e agentes aparecem em pedido após pedido: a normalização de cada nome
+# e a similaridade de cada par de nomes ficam em caches LRU que duram enquanto o processo
+# viver. Os limites valem para o programa todo e são divididos entre os processos que têm
+# os caches (cada entrada ocupa da ordem de 300 bytes): no servidor, o principal e os
+# CONFERIR_WORKERS do pool; quem roda o próprio pool (conferir_lote.py) refaz a divisão
+# com `configurar_caches_nomes`. Acertos e falhas vão para /metrics
+# (conferir_nomes_cache_*, conferir_similaridade_cache_*).
+# CONFERIR_CACHE_NOMES        → nomes normalizados guardados (padrão: 50000)
+# CONFERIR_CACHE_SIMILARIDADE → pares de nomes com a similaridade guardada (padrão: 200000)
+CONFERIR_CACHE_NOMES = int(os.getenv("CONFERIR_CACHE_NOMES", "50000"))
+CONFERIR_CACHE_SIMILARIDADE = int(os.getenv("CONFERIR_CACHE_SIMILARIDADE", "200000"))
+
+
+def _normalizar_nome(s: str) -> str:
+    """Minúsculas, sem acentos e sem espaços nas pontas (nomes do Excel e dos PIX)."""
+    s = unicodedata.normalize("NFKD", s or "")
+    s = "".join(c for c in s if not unicodedata.combining(c))
+    return s.lower().strip()
+
+
+def _similaridade_nomes(a: str, b: str) -> float:
+    """Similaridade (SequenceMatcher.ratio) entre dois nomes já normalizados."""
+    if a == b:
+        return 1.0
+    return SequenceMatcher(None, a, b).ratio()
+
+
+def configurar_caches_nomes(processos: int):
+    """
+    Cria neste processo os caches de `normalizar_nome` e `similaridade_nomes` com os limites
+    divididos por `processos` (quantos processos do programa têm os caches). Chamada na
+    importação com CONFERIR_WORKERS + 1; um pool próprio a chama no processo principal e
+    como `initializer` dos processos dele.
+    """
+    global normalizar_nome, similaridade_nomes
+    processos = max(1, processos)
+    normalizar_nome = lru_cache(maxsize=max(1, CONFERIR_CACHE_NOMES // processos))(_normalizar_nome)
+    similaridade_nomes = lru_cache(maxsize=max(1, CONFERIR_CACHE_SIMILARIDADE // processos))(_similaridade_nomes)
+
+
+configurar_caches_nomes(max(CONFERIR_WORKERS, 0) + 1)
+
+
+def contagem_caches_nomes() -> Counter:
+    """Acertos e falhas acumulados dos caches de nomes neste processo."""
+    nomes, pares = normalizar_nome.cache_info(), similaridade_nomes.cache_info()
+    return Counter(
+        nomes_cache_acertos=nomes.hits,
+        nomes_cache_falhas=nomes.misses,
+        similaridade_cache_acertos=pares.hits,
+        similaridade_cache_falhas=pares.misses,
+    )
+
+
+def normalizar_hora(h: str) -> str:
+    if not h:
         return ""
+    h = h.strip().lower().replace("h", ":").replace(".", ":")
+
+    if re.fullmatch(r"\d{1,2}$", h):
+        return f"{int(h):02d}:00"
 
-    usados_pdf = set()
-    usado_por = {}
-    conferidos = []
-    faltando_no_pdf = []
-    faltando_no_excel = []
+    if re.fullmatch(r"\d{3,4}$", h):
+        return f"{int(h[:-2]):02d}:{int(h[-2:]):02d}"
 
+    if re.fullmatch(r"\d{1,2}:\d{1,2}$", h):
+        p = h.split(":")
+        return f"{int(p[0]):02d}:{int(p[1]):02d}"
+
+    if re.fullmatch(r"\d{2}:\d{2}:\d{2}$", h):
+        return h[:5]
+
+    return ""
+
+
+def conciliar(
+    dados_pdf,
+    dados_excel,
+    usados: Dict[int, str] = None,
+    linhas: List[int] = None,
+    apelidos: Dict[str, List[str]] = None,
+) -> Dict[str, Any]:
+    """
+    Cruza as linhas das planilhas com os PIX dos PDFs.
+    Recebe lotes de `compactar_transacoes` (listas de dicts também servem: são compactadas
+    aqui) e retorna só índices nesses lotes:
+    {"conferidos": {"excel", "pdf", "similaridade"}, "faltando_no_pdf": {"excel", "banco", "motivo"},
+    "faltando_no_excel": {"pdf"}} e `_metricas` (tempo de cada passada e nº de comparações
+    de nome). `expandir_conciliacao` monta as listas de dicts da resposta.
+    Função pura (sem I/O) para poder rodar no pool de processos.
+    Diferença de valor, diferença de horário, bônus de horário e o limite superior da
+    similaridade são calculados com NumPy para todos os candidatos de uma linha de uma vez.
+    Para conciliações incrementais (sessões): `usados` = {posição do PIX: agente} já
+    conferidos antes, que ficam fora da busca; `linhas` = posições das linhas da planilha
+    a cruzar (padrão: todas, em ordem).
+    `apelidos` = {nome normalizado da planilha: nomes normalizados de PIX já conferidos com
+    ele} (ver `carregar_apelidos`): um PIX livre de mesmo valor, no horário e com um desses
+    nomes é conferido direto, sem comparar nomes — salvo se houver PIX livre de mesmo valor
+    com exatamente o nome da planilha, que segue pela busca normal.
+    """
     # ============================
-    # MATCH Excel → PDF
+    # FUNÇÕES AUXILIARES
     # ============================
-    for item in dados_excel:
-        nome_excel = item["nome"]
-        valor_excel = round(item.get("valor") or 0.0, 2)
-        hora_excel = normalizar_hora(item.get("hora", ""))
-        agente_excel = item.get("agente", "")
+    if isinstance(dados_pdf, list):
+        dados_pdf = compactar_transacoes(dados_pdf, CAMPOS_PDF)
+    if isinstance(dados_excel, list):
+        dados_excel = compactar_transacoes(dados_excel, CAMPOS_EXCEL)
+
+    feats_nome: Dict[str, Dict[str, Any]] = {}
+    horas_norm: Dict[Any, str] = {}
+
+    def preparar(nome: str, hora: str, valor) -> Dict[str, Any]:
+        """
+        Calcula uma única vez tudo o que a pontuação usa de um registro:
+        nome normalizado, tokens, trigramas, contagem de letras, hora HH:MM,
+        minutos desde 00:00 (None se inválida), valor arredondado e valor em centavos.
+        O que depende só do nome (ou só da hora) é calculado uma vez por texto distinto.
+        """
+        fn = feats_nome.get(nome)
+        if fn is None:
+            nome_norm = normalizar_nome(nome)
+            fn = feats_nome[nome] = {
+                "nome_norm": nome_norm,
+                "tokens": frozenset(nome_norm.split()),
+                "trigramas": frozenset(nome_norm[i:i + 3] for i in range(len(nome_norm) - 2)),
+                "letras": Counter(nome_norm),
+            }
+        hora_norm = horas_norm.get(hora)
+        if hora_norm is None:
+            hora_norm = horas_norm[hora] = normalizar_hora(hora)
+        minutos = None
+        if hora_norm:
+            hh, mm = int(hora_norm[:2]), int(hora_norm[3:])
+            if hh <= 23 and mm <= 59:
+                minutos = hh * 60 + mm
+        valor = round(valor or 0.0, 2)
+        return {
+            **fn,
+            "hora": hora_norm,
+            "minutos": minutos,
+            "valor": valor,
+            "centavos": int(round(valor * 100)),
+        }
 
-        escolhido = None
-        candidatos = []
-        melhor_ja_usado = None
+    def similaridade(fa: Dict[str, Any], fb: Dict[str, Any]) -> float:
+        return similaridade_nomes(fa["nome_norm"], fb["nome_norm"])
 
-        for idx, p in enumerate(dados_pdf):
-            nome_pdf = p["nome"]
-            valor_pdf = round(p.get("valor") or 0.0, 2)
-            hora_pdf = normalizar_hora(p.get("hora", ""))
+    def pontuar_nome(fe: Dict[str, Any], fp: Dict[str, Any]) -> float:
+        contadores["comparacoes_nome"] += 1
+        sim = similaridade(fe, fp)
 
-            if abs(valor_excel - valor_pdf) < 0.01:
-                sim = similaridade(nome_excel, nome_pdf)
+        ne = fe["nome_norm"]
+        n_pdf = fp["nome_norm"]
 
-                ne = normalizar(nome_excel)
-                np = normalizar(nome_pdf)
+        if ne in n_pdf:
+            sim = max(sim, 0.90)
+        elif n_pdf in ne:
+            sim = max(sim, 0.90)
+        else:
+            if fe["tokens"] & fp["tokens"]:
+                sim = max(sim, min(0.75, sim + 0.20))
+        return sim
 
-                if ne in np:
-                    sim = max(sim, 0.90)
-                elif np in ne:
-                    sim = max(sim, 0.90)
-                else:
-                    if set(ne.split()).intersection(set(np.split())):
-                        sim = max(sim, min(0.75, sim + 0.20))
-
-                hora_ok = True
-                hora_delta = 999999
-
-                if hora_excel and hora_pdf:
-                    try:
-                        t1 = datetime.strptime(hora_excel, "%H:%M")
-                        t2 = datetime.strptime(hora_pdf, "%H:%M")
-                        hora_delta = abs((t1 - t2).total_seconds())
-                        hora_ok = hora_delta <= 600
-                    except:
-                        pass
-
-                if idx in usados_pdf:
-                    score_dup = (sim * 100) + (20 if hora_ok else 0) - (hora_delta / 1000)
-                    if (melhor_ja_usado is None) or (score_dup > melhor_ja_usado["score"]):
-                        melhor_ja_usado = {
-                            "idx": idx,
-                            "score": score_dup,
-                            "sim": sim,
-                            "hora_ok": hora_ok,
-                            "hora_delta": hora_delta,
-                            "valor_pdf": valor_pdf,
-                            "nome_pdf": nome_pdf,
-                            "hora_pdf": hora_pdf,
-                            "data_pdf": p.get("data"),
-                            "usado_por": usado_por.get(idx),
-                        }
-                    continue
+    tempos = {"conciliacao_exata": 0.0, "conciliacao_aproximada": 0.0}
+    contadores = Counter(comparacoes_nome=0)
+    caches_antes = contagem_caches_nomes()
 
-                candidatos.append({
-                    "idx": idx,
-                    "sim": sim,
-                    "hora_ok": hora_ok,
-                    "hora_delta": hora_delta,
-                    "valor_pdf": valor_pdf,
-                    "nome_pdf": nome_pdf,
-                    "hora_pdf": hora_pdf,
-                    "data_pdf": p.get("data"),
-                })
+    nomes_pdf = valores_coluna(dados_pdf, "nome")
+    bancos_pdf = valores_coluna(dados_pdf, "banco")
+    feats_pdf = [
+        preparar(nome, hora, valor)
+        for nome, hora, valor in zip(nomes_pdf, valores_coluna(dados_pdf, "hora"), valores_coluna(dados_pdf, "valor"))
+    ]
 
-        if candidatos:
-            candidatos.sort(key=lambda x: (
-                not x["hora_ok"],
-                -x["sim"],
-                x["hora_delta"]
-            ))
-            escolhido = candidatos[0]
+    # ============================
+    # MATRIZES NUMPY DOS PIX
+    # ============================
+    # valor, minutos (-1 = sem hora válida), tamanho do nome e contagem de cada letra
+    # do nome normalizado (uma coluna por letra que aparece em algum PIX).
+    total_pdf = dados_pdf["n"]
+    arr_valor = np.array([fp["valor"] for fp in feats_pdf], dtype=np.float64)
+    arr_minutos = np.array([-1 if fp["minutos"] is None else fp["minutos"] for fp in feats_pdf], dtype=np.int64)
+    arr_tamanho = np.array([len(fp["nome_norm"]) for fp in feats_pdf], dtype=np.int64)
+    alfabeto = {c: i for i, c in enumerate(sorted({c for fp in feats_pdf for c in fp["letras"]}))}
+    arr_letras = np.zeros((total_pdf, len(alfabeto)), dtype=np.int32)
+    for idx, fp in enumerate(feats_pdf):
+        for c, qtd in fp["letras"].items():
+            arr_letras[idx, alfabeto[c]] = qtd
+    livres = np.ones(total_pdf, dtype=bool)
+
+    def deltas_hora(fe: Dict[str, Any], idxs: np.ndarray):
+        """(delta em segundos, hora_ok) de cada candidato; sem hora dos dois lados → (999999, True)."""
+        if fe["minutos"] is None:
+            return np.full(len(idxs), 999999, dtype=np.int64), np.ones(len(idxs), dtype=bool)
+        minutos = arr_minutos[idxs]
+        validos = minutos >= 0
+        delta = np.where(validos, np.abs(minutos - fe["minutos"]) * 60, 999999)
+        return delta, np.where(validos, delta <= 600, True)
+
+    def bonus_hora(fe: Dict[str, Any], idxs: np.ndarray) -> np.ndarray:
+        if fe["minutos"] is None:
+            return np.zeros(len(idxs), dtype=np.int64)
+        minutos = arr_minutos[idxs]
+        delta = np.abs(minutos - fe["minutos"]) * 60
+        bonus = np.select([delta <= 10, delta <= 60, delta <= 300, delta <= 600], [50, 35, 20, 10], 0)
+        return np.where(minutos >= 0, bonus, 0)
+
+    def similaridades_lote(fe: Dict[str, Any], idxs) -> List[float]:
+        return [pontuar_nome(fe, feats_pdf[idx]) for idx in idxs]
+
+    def limites_nome(fe: Dict[str, Any], idxs: np.ndarray, compartilham: np.ndarray) -> np.ndarray:
+        """
+        Limite superior de `pontuar_nome` para vários candidatos: usa o quick_ratio
+        (letras em comum), que nunca é menor que o ratio() do SequenceMatcher.
+        `compartilham` marca quem divide algum token/trigrama com o nome do Excel;
+        nomes com menos de 3 letras podem estar contidos no outro sem dividir trigramas.
+        """
+        colunas = [alfabeto[c] for c in fe["letras"] if c in alfabeto]
+        qtds = np.array([fe["letras"][c] for c in fe["letras"] if c in alfabeto], dtype=np.int32)
+        comuns = np.minimum(arr_letras[np.ix_(idxs, colunas)], qtds).sum(axis=1) if colunas else np.zeros(len(idxs))
+        total = len(fe["nome_norm"]) + arr_tamanho[idxs]
+        limite = np.where(total > 0, 2.0 * comuns / np.maximum(total, 1), 1.0)
+
+        pode_conter = compartilham | (arr_tamanho[idxs] < 3) | (len(fe["nome_norm"]) < 3)
+        com_token = np.maximum(limite, np.minimum(0.75, limite + 0.20))
+        return np.maximum(limite, np.maximum(
+            np.where(pode_conter, 0.90, 0.0),
+            np.where(compartilham | pode_conter, com_token, 0.0),
+        ))
 
-        if escolhido and (
-            escolhido["sim"] >= 0.70 or
-            (escolhido["sim"] >= 0.55 and abs(valor_excel - escolhido["valor_pdf"]) < 0.01)
-        ):
-            idx_escolhido = escolhido["idx"]
-            usados_pdf.add(idx_escolhido)
-            usado_por[idx_escolhido] = {
-                "agente": agente_excel,
-                "nome_excel": nome_excel,
-                "valor": valor_excel,
-                "hora": hora_excel,
-            }
+    # ============================
+    # ÍNDICE DOS PIX POR VALOR
+    # ============================
+    # centavos → posições em dados_pdf (em ordem crescente, para manter o desempate
+    # por ordem do PDF). A faixa de valores vem de bisect na lista ordenada de chaves;
+    # 1 centavo de folga cobre o arredondamento de float das comparações abaixo.
+    indice_valor: Dict[int, List[int]] = {}
+    for idx, fp in enumerate(feats_pdf):
+        indice_valor.setdefault(fp["centavos"], []).append(idx)
+    chaves_valor = sorted(indice_valor)
+
+    def indices_por_valor(valor: float, tolerancia_centavos: int) -> List[int]:
+        c = int(round(valor * 100))
+        ini = bisect_left(chaves_valor, c - tolerancia_centavos - 1)
+        fim = bisect_right(chaves_valor, c + tolerancia_centavos + 1)
+        if fim - ini == 1:
+            return indice_valor[chaves_valor[ini]]
+        return sorted(i for k in chaves_valor[ini:fim] for i in indice_valor[k])
 
-            conferidos.append({
-                "agente": agente_excel,
-                "nome_excel": nome_excel,
-                "nome_pdf": escolhido["nome_pdf"],
-                "valor_excel": valor_excel,
-                "valor_pdf": escolhido["valor_pdf"],
-                "hora_excel": hora_excel,
-                "hora_pdf": escolhido["hora_pdf"],
-                "data_pdf": escolhido["data_pdf"],
-                "similaridade": round(escolhido["sim"], 2),
-                "analise": "ok",
-                "banco": dados_pdf[idx_escolhido].get("banco"),
-            })
-            continue
+    # ============================
+    # ÍNDICE INVERTIDO DOS NOMES (busca aproximada)
+    # ============================
+    # token/trigrama do nome normalizado → posições em dados_pdf. Só serve para decidir
+    # quem é pontuado primeiro; o resultado final não depende dele (ver melhor_aproximado).
+    indice_nome: Dict[str, List[int]] = {}
+    for idx, fp in enumerate(feats_pdf):
+        for chave in fp["tokens"] | fp["trigramas"]:
+            indice_nome.setdefault(chave, []).append(idx)
+    indice_nome_arr = {chave: np.array(idxs, dtype=np.int64) for chave, idxs in indice_nome.items()}
+
+    def melhor_aproximado(fe: Dict[str, Any], lista_busca: np.ndarray):
+        """
+        Retorna a posição com maior `sim*100 - dif_valor + hora_bonus` em `lista_busca`
+        (a primeira, em caso de empate), igual ao laço completo de antes.
+        Primeiro pontua os `CONFERIR_FUZZY_TOP_K` PIX que mais dividem tokens/trigramas
+        com o nome do Excel; os demais são visitados do maior para o menor limite superior
+        da pontuação e a busca para quando esse limite fica abaixo da melhor encontrada.
+        """
+        listas = [indice_nome_arr[chave] for chave in fe["tokens"] | fe["trigramas"] if chave in indice_nome_arr]
+        if listas:
+            contagem = np.bincount(np.concatenate(listas), minlength=total_pdf)[lista_busca]
+        else:
+            contagem = np.zeros(len(lista_busca), dtype=np.int64)
+
+        # mesma expressão da pontuação real, para o arredondamento de float ser o mesmo
+        dif_valor = np.abs(fe["valor"] - arr_valor[lista_busca])
+        bonus = bonus_hora(fe, lista_busca)
+        limites = limites_nome(fe, lista_busca, contagem > 0) * 100 - dif_valor + bonus
+        dif_valor, bonus = dif_valor.tolist(), bonus.tolist()
 
         melhor_pontuacao = -999999
         possivel = None
+        avaliados = set()
 
-        candidatos_valor = []
-        for idx, p in enumerate(dados_pdf):
-            if idx in usados_pdf:
-                continue
-            if abs(valor_excel - round(p.get("valor", 0), 2)) <= 0.50:
-                candidatos_valor.append((idx, p))
+        def avaliar(k: int):
+            nonlocal melhor_pontuacao, possivel
+            idx = int(lista_busca[k])
+            pontuacao = (pontuar_nome(fe, feats_pdf[idx]) * 100) - dif_valor[k] + bonus[k]
+            if pontuacao > melhor_pontuacao or (pontuacao == melhor_pontuacao and possivel is not None and idx < possivel):
+                melhor_pontuacao = pontuacao
+                possivel = idx
+            avaliados.add(k)
+
+        if len(lista_busca) > CONFERIR_FUZZY_TOP_K:
+            for k in np.argsort(-contagem, kind="stable")[:CONFERIR_FUZZY_TOP_K].tolist():
+                if contagem[k] == 0:
+                    break
+                avaliar(k)
+
+        for k in np.argsort(-limites, kind="stable").tolist():
+            if possivel is not None and limites[k] < melhor_pontuacao:
+                break
+            if k not in avaliados:
+                avaliar(k)
+
+        return possivel
+
+    usados_pdf = set(usados or ())
+    usado_por = {idx: {"agente": agente} for idx, agente in (usados or {}).items()}
+    livres[list(usados_pdf)] = False
+    conferidos = {"excel": [], "pdf": [], "similaridade": []}
+    faltando_no_pdf = {"excel": [], "banco": [], "motivo": []}
+
+    def conferir(i: int, idx: int, sim: float, agente: str):
+        usados_pdf.add(idx)
+        livres[idx] = False
+        usado_por[idx] = {"agente": agente}
+        conferidos["excel"].append(i)
+        conferidos["pdf"].append(idx)
+        conferidos["similaridade"].append(round(sim, 2))
+
+    def faltou(i: int, banco: str, motivo: str):
+        faltando_no_pdf["excel"].append(i)
+        faltando_no_pdf["banco"].append(banco)
+        faltando_no_pdf["motivo"].append(motivo)
 
-        lista_busca = candidatos_valor if candidatos_valor else [(idx, p) for idx, p in enumerate(dados_pdf) if idx not in usados_pdf]
+    # ============================
+    # MATCH Excel → PDF
+    # ============================
+    nomes_excel = valores_coluna(dados_excel, "nome")
+    horas_excel = valores_coluna(dados_excel, "hora")
+    valores_excel = valores_coluna(dados_excel, "valor")
+    agentes_excel = valores_coluna(dados_excel, "agente")
+    for i in (range(dados_excel["n"]) if linhas is None else linhas):
+        comeco = time.perf_counter()
+        nome_excel, agente_excel = nomes_excel[i], agentes_excel[i]
+        fe = preparar(nome_excel, horas_excel[i], valores_excel[i])
+        valor_excel = fe["valor"]
+        hora_excel = fe["hora"]
 
-        for idx, p in lista_busca:
-            nome_pdf = p["nome"]
-            valor_pdf = round(p.get("valor") or 0.0, 2)
-            hora_pdf = normalizar_hora(p.get("hora", ""))
+        escolhido = None
+        candidatos = []
+        melhor_ja_usado = None
 
-            sim = similaridade(nome_excel, nome_pdf)
+        mesmo_valor = [idx for idx in indices_por_valor(valor_excel, 0) if abs(valor_excel - feats_pdf[idx]["valor"]) < 0.01]
+        if mesmo_valor:
+            arr_idx = np.array(mesmo_valor, dtype=np.int64)
+            arr_delta, arr_ok = deltas_hora(fe, arr_idx)
+
+            # nome já conferido antes com um destes PIX: o livre de horário mais próximo
+            # (um PIX livre com o próprio nome da planilha tem preferência)
+            conhecidos = apelidos.get(fe["nome_norm"]) if apelidos else None
+            if conhecidos and not any(
+                livres[idx] and feats_pdf[idx]["nome_norm"] == fe["nome_norm"] for idx in mesmo_valor
+            ):
+                pelo_apelido = livres[arr_idx] & arr_ok & np.array(
+                    [feats_pdf[idx]["nome_norm"] in conhecidos for idx in mesmo_valor], dtype=bool
+                )
+                if pelo_apelido.any():
+                    posicoes = np.flatnonzero(pelo_apelido)
+                    conferir(i, mesmo_valor[int(posicoes[np.argmin(arr_delta[posicoes])])], 1.0, agente_excel)
+                    contadores["conferidos_por_apelido"] += 1
+                    tempos["conciliacao_exata"] += time.perf_counter() - comeco
+                    continue
 
-            ne = normalizar(nome_excel)
-            np = normalizar(nome_pdf)
+            arr_sim = np.array(similaridades_lote(fe, mesmo_valor), dtype=np.float64)
 
-            if ne in np:
-                sim = max(sim, 0.90)
-            elif np in ne:
-                sim = max(sim, 0.90)
-            else:
-                if set(ne.split()).intersection(set(np.split())):
-                    sim = max(sim, min(0.75, sim + 0.20))
+            for k, idx in enumerate(mesmo_valor):
+                if idx not in usados_pdf:
+                    continue
+                sim, hora_ok, hora_delta = float(arr_sim[k]), bool(arr_ok[k]), int(arr_delta[k])
+                score_dup = (sim * 100) + (20 if hora_ok else 0) - (hora_delta / 1000)
+                if (melhor_ja_usado is None) or (score_dup > melhor_ja_usado["score"]):
+                    melhor_ja_usado = {
+                        "idx": idx,
+                        "score": score_dup,
+                        "sim": sim,
+                        "hora_ok": hora_ok,
+                        "hora_delta": hora_delta,
+                        "valor_pdf": feats_pdf[idx]["valor"],
+                        "nome_pdf": nomes_pdf[idx],
+                        "hora_pdf": feats_pdf[idx]["hora"],
+                        "usado_por": usado_por.get(idx),
+                    }
+
+            # ordena por (hora fora da janela, -similaridade, delta de horário), estável
+            abertos = livres[arr_idx]
+            if abertos.any():
+                ordem = np.lexsort((arr_delta[abertos], -arr_sim[abertos], ~arr_ok[abertos]))
+                k = int(np.flatnonzero(abertos)[ordem[0]])
+                idx = mesmo_valor[k]
+                escolhido = {
+                    "idx": idx,
+                    "sim": float(arr_sim[k]),
+                    "hora_ok": bool(arr_ok[k]),
+                    "hora_delta": int(arr_delta[k]),
+                    "valor_pdf": feats_pdf[idx]["valor"],
+                }
 
-            dif_valor = abs(valor_excel - valor_pdf)
+        if escolhido and (
+            escolhido["sim"] >= 0.70 or
+            (escolhido["sim"] >= 0.55 and abs(valor_excel - escolhido["valor_pdf"]) < 0.01)
+        ):
+            conferir(i, escolhido["idx"], escolhido["sim"], agente_excel)
+            tempos["conciliacao_exata"] += time.perf_counter() - comeco
+            continue
 
-            hora_bonus = 0
-            if hora_excel and hora_pdf:
-                try:
-                    t1 = datetime.strptime(hora_excel, "%H:%M")
-                    t2 = datetime.strptime(hora_pdf, "%H:%M")
-                    delta = abs((t1 - t2).total_seconds())
-
-                    if delta <= 10:
-                        hora_bonus = 50
-                    elif delta <= 60:
-                        hora_bonus = 35
-                    elif delta <= 300:
-                        hora_bonus = 20
-                    elif delta <= 600:
-                        hora_bonus = 10
-                except:
-                    pass
+        meio = time.perf_counter()
+        tempos["conciliacao_exata"] += meio - comeco
 
-            pontuacao = (sim * 100) - dif_valor + hora_bonus
+        faixa = np.array(indices_por_valor(valor_excel, 50), dtype=np.int64)
+        faixa = faixa[livres[faixa]] if len(faixa) else faixa
+        candidatos_valor = faixa[np.abs(valor_excel - arr_valor[faixa]) <= 0.50] if len(faixa) else faixa
 
-            if pontuacao > melhor_pontuacao:
-                melhor_pontuacao = pontuacao
-                possivel = (idx, p)
+        lista_busca = candidatos_valor if len(candidatos_valor) else np.flatnonzero(livres)
 
-        if possivel:
-            idx_p, p = possivel
-            valor_pdf = round(p.get("valor") or 0.0, 2)
+        possivel = melhor_aproximado(fe, lista_busca) if len(lista_busca) else None
+
+        if possivel is not None:
+            fp = feats_pdf[possivel]
+            valor_pdf = fp["valor"]
             val_dif = abs(valor_excel - valor_pdf)
             val_msg = (
                 "igual" if val_dif < 0.01 else
                 "próximo" if val_dif <= 0.50 else
                 "diferente"
             )
-            hora_pdf = normalizar_hora(p.get("hora", ""))
+            hora_pdf = fp["hora"]
 
             hora_msg = ""
             if hora_excel and hora_pdf:
@@ -790,15 +3045,14 @@ async def conferir_caixa(
                     hora_msg = f", horários diferentes (Excel {hora_excel} ≠ PDF {hora_pdf})"
 
             motivo = (
-                f"Nome semelhante encontrado: '{p.get('nome','')}' "
-                f"(Sim={similaridade(nome_excel, p.get('nome','')):.2f}), "
+                f"Nome semelhante encontrado: '{nomes_pdf[possivel]}' "
+                f"(Sim={similaridade(fe, fp):.2f}), "
                 f"valor {val_msg} (R${valor_pdf:.2f})"
                 f"{hora_msg}."
             )
 
-            item["banco"] = p.get("banco", "")
-            item["motivo"] = motivo
-            faltando_no_pdf.append(item)
+            faltou(i, bancos_pdf[possivel], motivo)
+            tempos["conciliacao_aproximada"] += time.perf_counter() - meio
             continue
 
         if melhor_ja_usado and melhor_ja_usado.get("usado_por"):
@@ -808,30 +3062,86 @@ async def conferir_caixa(
                 f"— {melhor_ja_usado.get('nome_pdf','')} "
                 f"R${melhor_ja_usado.get('valor_pdf',0):.2f} • {melhor_ja_usado.get('hora_pdf','')}"
             )
-            item["motivo"] = motivo
-            item["banco"] = dados_pdf[melhor_ja_usado["idx"]].get("banco", "")
+            faltou(i, bancos_pdf[melhor_ja_usado["idx"]], motivo)
         else:
-            item["motivo"] = "Nenhum parecido encontrado no PDF (ou já consumido por outro agente)."
-            item["banco"] = ""
+            faltou(i, "", "Nenhum parecido encontrado no PDF (ou já consumido por outro agente).")
+        tempos["conciliacao_aproximada"] += time.perf_counter() - meio
 
-        faltando_no_pdf.append(item)
+    contadores.update(contagem_caches_nomes() - caches_antes)
+    return {
+        "conferidos": {
+            "excel": np.array(conferidos["excel"], dtype=np.int32),
+            "pdf": np.array(conferidos["pdf"], dtype=np.int32),
+            "similaridade": np.array(conferidos["similaridade"], dtype=np.float64),
+        },
+        "faltando_no_pdf": {
+            "excel": np.array(faltando_no_pdf["excel"], dtype=np.int32),
+            "banco": faltando_no_pdf["banco"],
+            "motivo": faltando_no_pdf["motivo"],
+        },
+        # PDF → Excel: PIX que nenhuma linha usou
+        "faltando_no_excel": {"pdf": np.flatnonzero(livres).astype(np.int32)},
+        "_metricas": {"tempos": tempos, "contadores": contadores},
+    }
 
-    # ============================
-    # PDF → Excel (não usados)
-    # ============================
-    for i, p in enumerate(dados_pdf):
-        if i not in usados_pdf:
-            faltando_no_excel.append({
-                "nome": p["nome"],
-                "hora": normalizar_hora(p.get("hora", "")),
-                "valor": round(p.get("valor", 0), 2),
-                "data": p.get("data"),
-                "banco": p.get("banco", "")
-            })
+
+def expandir_conciliacao(resultado: Dict[str, Any], dados_pdf, dados_excel) -> Dict[str, Any]:
+    """
+    Resultado de `conciliar` (índices nos lotes) → listas de dicts no formato da resposta:
+    conferidos, faltando_no_pdf (a linha da planilha + banco e motivo) e faltando_no_excel.
+    Valores e horas saem arredondados/normalizados como na conciliação.
+    """
+    if isinstance(dados_pdf, list):
+        dados_pdf = compactar_transacoes(dados_pdf, CAMPOS_PDF)
+    if isinstance(dados_excel, list):
+        dados_excel = compactar_transacoes(dados_excel, CAMPOS_EXCEL)
+    pdf = {campo: valores_coluna(dados_pdf, campo) for campo in CAMPOS_PDF}
+    excel = {campo: valores_coluna(dados_excel, campo) for campo in CAMPOS_EXCEL}
+
+    horas = {}
+
+    def hora(h):
+        if h not in horas:
+            horas[h] = normalizar_hora(h)
+        return horas[h]
+
+    c = resultado["conferidos"]
+    conferidos = [
+        {
+            "agente": excel["agente"][e],
+            "nome_excel": excel["nome"][e],
+            "nome_pdf": pdf["nome"][p],
+            "valor_excel": round(excel["valor"][e] or 0.0, 2),
+            "valor_pdf": round(pdf["valor"][p] or 0.0, 2),
+            "hora_excel": hora(excel["hora"][e]),
+            "hora_pdf": hora(pdf["hora"][p]),
+            "data_pdf": pdf["data"][p],
+            "similaridade": sim,
+            "analise": "ok",
+            "banco": pdf["banco"][p],
+        }
+        for e, p, sim in zip(c["excel"].tolist(), c["pdf"].tolist(), c["similaridade"].tolist())
+    ]
+
+    f = resultado["faltando_no_pdf"]
+    faltando_no_pdf = [
+        {**{campo: excel[campo][e] for campo in CAMPOS_EXCEL}, "banco": banco, "motivo": motivo}
+        for e, banco, motivo in zip(f["excel"].tolist(), f["banco"], f["motivo"])
+    ]
+
+    faltando_no_excel = [
+        {
+            "nome": pdf["nome"][p],
+            "hora": hora(pdf["hora"][p]),
+            "valor": round(pdf["valor"][p] or 0.0, 2),
+            "data": pdf["data"][p],
+            "banco": pdf["banco"][p],
+        }
+        for p in resultado["faltando_no_excel"]["pdf"].tolist()
+    ]
 
     return {
-        "banco": ", ".join(bancos_detectados),
         "conferidos": conferidos,
         "faltando_no_pdf": faltando_no_pdf,
-        "faltando_no_excel": faltando_no_excel
+        "faltando_no_excel": faltando_no_excel,
     }
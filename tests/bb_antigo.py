@@ -0,0 +1,198 @@
+"""
+Cópia congelada do `detalhe_bb` de antes da reescrita em passada única de tokens (só
+troca o nome da função). Serve de referência para test_detalhe_bb.py: o parser novo tem
+de devolver exatamente o mesmo que este. Não corrija nada aqui.
+"""
+import logging
+import re
+
+logger = logging.getLogger("conferencia")
+
+
+def texto_completo(extracao: dict) -> str:
+    return "".join("\n" + p for p in extracao.get("paginas", []))
+
+
+def log_transacoes(origem, dados):
+    pass
+
+
+def detalhe_bb_antigo(extracao: dict):
+    """
+    Parser robusto e filtrado para extratos do Banco do Brasil.
+    ✅ Captura todos os PIX RECEBIDOS (com '(+)')
+    ✅ Corrige PIX quebrados entre páginas
+    ✅ Reconstrói PIX com CNPJ sem nome
+    🚫 Ignora ruídos como '5 Pix - Recebido' ou cabeçalhos incompletos.
+    Recebe o resultado de `extrair_paginas` (o PDF já foi lido uma única vez).
+    """
+    texto_total = texto_completo(extracao)
+    texto_total = re.sub(r"\s+", " ", texto_total)
+    texto_limpo = texto_total
+
+    texto_limpo = re.sub(r"Extrato de Conta Corrente.*?Valor", " ", texto_limpo, flags=re.IGNORECASE)
+    texto_limpo = re.sub(r"----- Página \d+ -----", " ", texto_limpo)
+    texto_limpo = re.sub(r"\s+", " ", texto_limpo)
+
+    texto_limpo = re.sub(r"\(\-\)", "", texto_limpo)
+    texto_limpo = re.sub(r"(?i)Pix\s*-\s*Enviado", "", texto_limpo)
+
+    corrigidos = []
+    texto_expandido = texto_limpo
+
+    pix_soltos = list(re.finditer(
+        r"Pix\s*-\s*Recebido\s+([\d\.,]+)\s*\(\+\)(?!\s*[A-ZÀ-ÿ])",
+        texto_expandido,
+        flags=re.IGNORECASE
+    ))
+    for m in pix_soltos:
+        valor_txt = m.group(1)
+        pos_fim = m.end()
+        trecho_proximo = texto_expandido[pos_fim:pos_fim + 800]
+        trecho_proximo = re.sub(
+            r"Extrato de Conta Corrente|Cliente\s+[A-ZÀ-ÿ\s]+|Ag[êe]ncia:\s*\d+-\d+\s*Conta:\s*\d+-\d+|Lançamentos|Dia\s+Lote\s+Documento\s+Histórico\s+Valor",
+            " ",
+            trecho_proximo,
+            flags=re.IGNORECASE
+        )
+
+        prox = re.search(
+            r"(\d{2}/\d{2})\s+(\d{2}:\d{2})\s+[0-9]{6,}\s+([A-Za-zÀ-ÿ\s]{3,}?)\s+\d{1,3}",
+            trecho_proximo
+        )
+
+        if prox:
+            data_curta, hora, nome_raw = prox.groups()
+            nome = re.sub(r"\s{2,}", " ", nome_raw.strip()).title()
+            bloco_completo = f"Pix - Recebido {data_curta}/2025 {hora} {nome} {valor_txt} (+)"
+            corrigidos.append((m.start(), bloco_completo))
+            logger.debug("BB [reconstruído] %s/2025 %s | %s | R$%s", data_curta, hora, nome, valor_txt)
+
+    if corrigidos:
+        partes = []
+        ultimo_fim = 0
+        for inicio, bloco_corrigido in corrigidos:
+            partes.append(texto_expandido[ultimo_fim:inicio])
+            partes.append(bloco_corrigido)
+            ultimo_fim = inicio
+        texto_limpo = "".join(partes) + texto_expandido[ultimo_fim:]
+
+    blocos = re.split(r"(?=Pix\s*-\s*Recebido)", texto_limpo, flags=re.IGNORECASE)
+
+    corrigido = []
+    padrao_pix_valor = re.compile(r"Pix\s*-\s*Recebido\s+([\d\.,]+)\s*\(\+\)", re.IGNORECASE)
+    padrao_nome_hora = re.compile(r"(\d{2}/\d{2})\s+(\d{2}:\d{2})\s+[0-9]{6,}\s+([A-ZÀ-ÿ\s]{3,})\s+\d+", re.IGNORECASE)
+    for i, bloco in enumerate(blocos[:-1]):
+        m_val = padrao_pix_valor.search(bloco)
+        if not m_val:
+            corrigido.append(bloco)
+            continue
+        valor_txt = m_val.group(1)
+        trecho_entre = blocos[i + 1][:150]
+        m_nome = padrao_nome_hora.search(trecho_entre)
+        if m_nome:
+            data_curta, hora, nome_raw = m_nome.groups()
+            nome = re.sub(r"\s{2,}", " ", nome_raw.strip()).title()
+            bloco_corrigido = f"Pix - Recebido {data_curta}/2025 {hora} {nome} {valor_txt} (+)"
+            corrigido.append(bloco_corrigido)
+        else:
+            corrigido.append(bloco)
+    blocos = corrigido
+
+    dados = []
+    logger.debug("BB: %d blocos detectados", len(blocos))
+
+    padrao_pix = re.compile(
+        r"Pix\s*-\s*Recebido.*?"
+        r"(?:(\d{2}/\d{2}/\d{4})|(\d{2}/\d{2}))?\s*"
+        r"(\d{2}:\d{2})\s+"
+        r"(?:[0-9]{5,}\s+)?"
+        r"([A-ZÀ-ÿ0-9\s\.]{3,}?)\s+"
+        r"([\d\.]+,\d{2})\s*\(\+\)",
+        re.IGNORECASE,
+    )
+
+    data_atual = None
+
+    for bloco in blocos:
+        m = padrao_pix.search(bloco)
+        if not m:
+            continue
+
+        data_full, data_partial, hora, nome_raw, valor_txt = m.groups()
+
+        if data_full:
+            data_atual = data_full
+        elif data_partial:
+            data_atual = f"{data_partial}/2025"
+        else:
+            m2 = re.search(r"(\d{2}/\d{2})(?:/\d{4})?", bloco)
+            if m2:
+                data_atual = f"{m2.group(1)}/2025"
+
+        if not data_atual:
+            idx = texto_limpo.find(bloco)
+            if idx != -1:
+                antes = texto_limpo[max(0, idx - 100):idx]
+                m3 = re.search(r"(\d{2}/\d{2})(?:/\d{4})?", antes)
+                if m3:
+                    data_atual = f"{m3.group(1)}/2025"
+
+        if not data_atual:
+            continue
+
+        data = data_atual
+
+        nome = re.sub(r"\s{2,}", " ", nome_raw.strip()).title()
+        nome = re.sub(r"(?i)\b(Agência|Conta|Saldo|Pix)\b.*", "", nome).strip()
+        if not nome:
+            continue
+        try:
+            valor = float(valor_txt.replace(".", "").replace(",", "."))
+        except:
+            continue
+        if valor <= 0:
+            continue
+
+        nome_limpo = nome.strip()
+        if re.fullmatch(r"[0-9.\s]{7,}", nome_limpo):
+            cnpj_num = re.sub(r"\D", "", nome_limpo)
+            nome_limpo = f"Cliente CNPJ {cnpj_num}"
+        nome = nome_limpo
+
+        dados.append({
+            "data": data,
+            "hora": hora,
+            "nome": nome,
+            "valor": valor,
+            "banco": "BB"
+        })
+
+    padrao_cnpj = re.compile(
+        r"(\d{2}/\d{2})\s+(\d{2}:\d{2})\s+[0-9]{6,}\s+(\d{2}\.?\d{3}\.?\d{3}/?\d{4}-?\d{2}|\d{11,14})\s+([\d\.,]+)\s*\(\+\)",
+        re.IGNORECASE,
+    )
+    for m in padrao_cnpj.finditer(texto_limpo):
+        data_curta, hora, cnpj_raw, valor_txt = m.groups()
+        nome = f"Cliente CNPJ {re.sub(r'[^0-9]', '', cnpj_raw)}"
+        try:
+            valor = float(valor_txt.replace(".", "").replace(",", "."))
+        except:
+            continue
+        dados.append({"data": f"{data_curta}/2025", "hora": hora, "nome": nome, "valor": valor, "banco": "BB"})
+
+    unicos = []
+    vistos = set()
+    for d in dados:
+        chave = (d["hora"], round(d["valor"], 2), d["nome"])
+        if chave not in vistos:
+            unicos.append(d)
+            vistos.add(chave)
+    dados = sorted(unicos, key=lambda d: d["hora"])
+
+    logger.debug("BB: %d PIX recebidos", len(dados))
+    log_transacoes("BB", dados)
+
+    if not dados:
+        return {"erro": "Nenhum lançamento PIX identificado no PDF do Banco do Brasil."}
+    return {"banco": "bb", "dados": dados}
@@ -0,0 +1,16 @@
+"""
+Configuração comum dos testes: põe a raiz do repositório no sys.path e desliga o cache
+em disco e o histórico antes de importar o servidor, para os testes não dependerem do
+estado da máquina nem deixarem arquivos para trás.
+"""
+import os
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.join(RAIZ, "benchmarks"))
+
+os.environ["CONFERIR_CACHE_DIR"] = ""
+os.environ["CONFERIR_CACHE_MEMORIA_MB"] = "0"
+os.environ["CONFERIR_HISTORICO_DB"] = ""
+os.environ["CONFERIR_WORKERS"] = "0"
@@ -0,0 +1,80 @@
+"""Apelidos aprendidos no histórico: o que conta para aprender e quando valem na conciliação."""
+import sqlite3
+
+import pytest
+
+import servidor
+
+
+def pix(nome: str, hora: str, valor: float) -> dict:
+    return {"data": "15/10/2025", "hora": hora, "nome": nome, "valor": valor, "banco": "BB"}
+
+
+def linha(nome: str, hora: str, valor: float) -> dict:
+    return {"agente": "AGENTE 01", "nome": nome, "hora": hora, "valor": valor}
+
+
+def nomes_conferidos(dados_pdf, dados_excel, apelidos):
+    resultado = servidor.conciliar(dados_pdf, dados_excel, apelidos=apelidos)
+    return [dados_pdf[p]["nome"] for p in resultado["conferidos"]["pdf"].tolist()]
+
+
+def test_apelido_nao_passa_na_frente_do_nome_exato():
+    apelidos = {"ze silva": ["jose silva"]}
+    planilha = [linha("Ze Silva", "10:00", 50.0)]
+    com_exato = [pix("Jose Silva", "10:00", 50.0), pix("Ze Silva", "10:05", 50.0)]
+    assert nomes_conferidos(com_exato, planilha, apelidos) == ["Ze Silva"]
+    assert nomes_conferidos(com_exato[:1], planilha, apelidos) == ["Jose Silva"]
+
+
+@pytest.fixture
+def conexao():
+    conexao = sqlite3.connect(":memory:")
+    conexao.executescript(servidor._ESQUEMA_HISTORICO)
+    yield conexao
+    conexao.close()
+
+
+def gravar(conexao, dados_pdf, planilha):
+    lote_pdf = servidor.compactar_transacoes(dados_pdf, servidor.CAMPOS_PDF)
+    lote_excel = servidor.compactar_transacoes(planilha, servidor.CAMPOS_EXCEL)
+    resultado = servidor.conciliar(lote_pdf, lote_excel)
+    servidor.gravar_historico(conexao, lote_pdf, [lote_excel], resultado)
+    return resultado
+
+
+def vezes(conexao) -> dict:
+    return {(a, b): n for a, b, n in conexao.execute("SELECT nome_excel, nome_pdf, vezes FROM apelidos")}
+
+
+def test_apelido_conta_por_linha_e_so_com_similaridade_alta(conexao):
+    dados_pdf = [pix("Maria Aparecida Souza", "09:00", 40.0), pix("Joao Pedro Alves", "09:30", 61.0)]
+    planilha = [linha("Maria Aparecida", "09:00", 40.0), linha("Joao Alves Pedro", "09:30", 61.0)]
+    resultado = gravar(conexao, dados_pdf, planilha)
+    similaridades = resultado["conferidos"]["similaridade"].tolist()
+    assert similaridades[0] >= servidor.CONFERIR_APELIDOS_SIMILARIDADE > similaridades[1]
+    assert vezes(conexao) == {("maria aparecida", "maria aparecida souza"): 1}
+
+    # a mesma conferência de novo não muda o PIX de nenhuma linha
+    gravar(conexao, dados_pdf, planilha)
+    assert vezes(conexao) == {("maria aparecida", "maria aparecida souza"): 1}
+
+    # outra planilha com o mesmo par conta mais uma linha
+    gravar(conexao, dados_pdf, planilha[:1] + [linha("Outro Cliente", "12:00", 5.0)])
+    assert vezes(conexao) == {("maria aparecida", "maria aparecida souza"): 2}
+
+
+def test_desfazer_confirmacao_manual_mantem_contagem(tmp_path, monkeypatch):
+    monkeypatch.setattr(servidor, "CONFERIR_HISTORICO_DB", str(tmp_path / "historico.sqlite3"))
+    monkeypatch.setattr(servidor, "_historico_pronto", False)
+    with servidor.conectar_historico() as conexao:
+        conexao.execute("INSERT INTO apelidos (nome_excel, nome_pdf, vezes) VALUES ('ze lima', 'jose lima', 1)")
+
+    for nome_pdf in ("Jose Lima", "Jose Carlos"):
+        servidor.gravar_apelido_manual("Zé Lima", nome_pdf, True)
+        servidor.gravar_apelido_manual("Zé Lima", nome_pdf, False)
+
+    with servidor.conectar_historico() as conexao:
+        assert conexao.execute("SELECT nome_excel, nome_pdf, vezes, manual FROM apelidos").fetchall() == [
+            ("ze lima", "jose lima", 1, 0)
+        ]
@@ -0,0 +1,110 @@
+"""
+Regressão da reescrita do `detalhe_bb`: textos de extrato BB gerados ao acaso (linhas
+quebradas entre páginas, CNPJ sem nome, PIX enviados, cabeçalhos repetidos, lixo como
+'5 Pix - Recebido') têm de sair idênticos ao parser antigo congelado em bb_antigo.py.
+"""
+import random
+
+import pytest
+
+import servidor
+from bb_antigo import detalhe_bb_antigo
+
+SEMENTES = 3000
+
+NOMES = ["MARIA DA SILVA", "JOSE DOS SANTOS", "ANA PAULA", "João Conceição", "LOJA ABC LTDA", "Z", "AB",
+         "PEDRO 2 FILHO", "MARIA-JOSE", "JOSE. SILVA", "SALDO ANTERIOR", "Conta Azul Ltda", "ANA PIX",
+         "FULANO CLIENTE TAL", "ÉLIS ÂNGELO", "M&M COMERCIO", "JOAO SAO PAULO"]
+CNPJS = ["12.345.678/0001-90", "12345678000190", "123.456.789-00", "12345678901", "12.345.678/0001-9"]
+VALORES = ["25,72", "1.234,56", "100,00", "25,7", "100", "0,00", "12.345.678,90", "3,50", "1,234,56"]
+
+
+def linhas_transacoes(r: random.Random, n: int) -> list:
+    """Sorteia `n` lançamentos nos vários formatos (bons e quebrados) que aparecem nos extratos."""
+    linhas = []
+    for _ in range(n):
+        dia = f"{r.randint(1, 28):02d}/10"
+        hora = f"{r.randint(0, 23):02d}:{r.randint(0, 59):02d}"
+        doc = str(r.randint(10 ** 5, 10 ** 9))
+        valor = r.choice(VALORES)
+        k = r.random()
+        if k < 0.45:
+            linhas.append(f"{dia}/2025 0000 14397 Pix - Recebido {valor} (+)")
+            linhas.append(f"{dia} {hora} {doc} {r.choice(NOMES)}")
+        elif k < 0.55:
+            linhas.append(f"{dia}/2025 0000 14397 Pix - Recebido {valor} (+)")
+            linhas.append(f"{dia} {hora} {doc} {r.choice(CNPJS)}")
+        elif k < 0.62:
+            linhas.append(f"{dia}/2025 0000 99999 Pix - Enviado {valor} (-)")
+            linhas.append(f"{dia} {hora} {doc} {r.choice(NOMES)}")
+        elif k < 0.67:
+            linhas.append(f"{dia} {hora} {doc} {r.choice(CNPJS)} {valor} (+)")
+        elif k < 0.72:
+            linhas.append(f"Pix - Recebido {valor} (+) {r.choice(NOMES)} {hora}")
+        elif k < 0.76:
+            linhas.append(f"{dia}/2025 0000 14397 Pix - Recebido {valor} (+)")
+        elif k < 0.80:
+            linhas.append(f"Pix - Recebido {dia} {hora} {doc} {r.choice(NOMES)} {valor} (+)")
+        elif k < 0.83:
+            linhas.append("5 Pix - Recebido")
+        elif k < 0.86:
+            linhas.append(f"{dia}/2025 0000 1234 TED Recebida {valor} (+)")
+            linhas.append(f"{dia} {hora} {doc} {r.choice(NOMES)}")
+        elif k < 0.89:
+            linhas.append(f"Saldo {valor}")
+        elif k < 0.91:
+            linhas.append(f"Pix - Recebido {hora} {r.choice(NOMES)} {valor} (+)")
+        elif k < 0.93:
+            linhas.append(f"pix-recebido {valor}(+) {dia} {hora} {doc} {r.choice(NOMES)}")
+        elif k < 0.95:
+            linhas.append(f"{dia} {hora} {doc} {r.choice(NOMES)} {valor} (+)")
+        elif k < 0.97:
+            linhas.append(f"Lançamentos Cliente {r.choice(NOMES)} Agência: 1234-5 Conta: 12345-6")
+        else:
+            linhas.append(f"{dia}/2025 0000 14397 Pix - Recebido {valor} (+) (-)")
+            linhas.append(f"{dia} {hora} {doc}   {r.choice(NOMES)}\t")
+    return linhas
+
+
+def cabecalho(r: random.Random, pagina: int) -> list:
+    """Cabeçalho de página do extrato, às vezes incompleto, com marcador de página ou ausente."""
+    linhas = ["BANCO DO BRASIL", "Extrato de Conta Corrente", "Cliente EMPRESA TESTE LTDA",
+              "Agência: 1234-5 Conta: 12345-6", "Lançamentos", "Dia Lote Documento Histórico Valor"]
+    k = r.random()
+    if k < 0.1:
+        linhas = linhas[:4]
+    elif k < 0.2:
+        linhas = ["----- Página %d -----" % pagina] + linhas
+    elif k < 0.25:
+        linhas = []
+    return linhas
+
+
+def paginas_sorteadas(semente: int) -> list:
+    """Monta as páginas de um extrato BB no formato de `extrair_paginas`."""
+    r = random.Random(semente)
+    paginas, atual = [], cabecalho(r, 1)
+    for linha in linhas_transacoes(r, r.randint(0, 40)):
+        atual.append(linha)
+        if r.random() < 0.12:
+            paginas.append(atual)
+            atual = cabecalho(r, len(paginas) + 1)
+    paginas.append(atual)
+    return [r.choice(["\n", "\n", " \n", "\n\n", "  "]).join(pagina) for pagina in paginas]
+
+
+@pytest.mark.parametrize("inicio", range(0, SEMENTES, 500))
+def test_detalhe_bb_igual_ao_parser_antigo(inicio):
+    for semente in range(inicio, inicio + 500):
+        extracao = {"paginas": paginas_sorteadas(semente)}
+        assert servidor.detalhe_bb(extracao) == detalhe_bb_antigo(extracao), f"semente {semente}"
+
+
+def test_detalhe_bb_extrato_sintetico():
+    """Extrato do gerador dos benchmarks passando pela extração real do PDF."""
+    from gerar_dados import gerar_transacoes, pdf_bb
+
+    extracao = servidor.extrair_paginas(pdf_bb(gerar_transacoes(300, seed=7)))
+    novo = servidor.detalhe_bb(extracao)
+    assert novo == detalhe_bb_antigo(extracao)
+    assert len(novo["dados"]) > 0
@@ -0,0 +1,29 @@
+"""
+Detecção do banco: "Extrato de conta corrente" é assinatura genérica e não pode decidir
+sozinha quando o nome do banco aparece só nas páginas seguintes.
+"""
+import servidor
+from gerar_dados import gerar_transacoes, pdf_bb, pdf_c6, pdf_de_paginas
+
+
+def test_c6_sem_marca_na_primeira_pagina():
+    pdf = pdf_de_paginas([
+        ["Extrato de conta corrente", "Data Descrição Valor", "15/10 Pix recebido de Ana Souza R$ 25,00 às 10:00"],
+        ["C6 BANK", "Extrato de conta corrente", "15/10 Pix recebido de Joao Lima R$ 30,00 às 11:00"],
+    ])
+    assert servidor.detectar_banco(pdf)["banco"] == "c6"
+    assert servidor.identificar_banco("\n".join(servidor.extrair_paginas(pdf)["paginas"])) == "c6"
+
+
+def test_assinatura_generica_sozinha_ainda_vale():
+    pdf = pdf_de_paginas([["Extrato de Conta Corrente", "Lançamentos"], ["Saldo 10,00"]])
+    assert servidor.detectar_banco(pdf)["banco"] == "bb"
+
+
+def test_assinaturas_especificas():
+    transacoes = gerar_transacoes(20, seed=3)
+    assert servidor.detectar_banco(pdf_bb(transacoes))["banco"] == "bb"
+    assert servidor.detectar_banco(pdf_c6(transacoes))["banco"] == "c6"
+    assert servidor.identificar_banco("Banco do Brasil - Extrato de conta corrente") == "bb"
+    assert servidor.identificar_banco("Extrato de conta corrente") == "bb"
+    assert servidor.identificar_banco("Extrato de conta corrente", genericas=False) is None
@@ -0,0 +1,49 @@
+"""Histórico em SQLite: reenviar a mesma planilha não duplica as linhas do caixa."""
+import asyncio
+import io
+import sqlite3
+
+import pytest
+from starlette.datastructures import UploadFile
+
+import servidor
+from gerar_dados import gerar_transacoes, pdf_bb, planilha_agentes
+
+
+@pytest.fixture
+def historico(tmp_path, monkeypatch):
+    caminho = str(tmp_path / "historico.sqlite3")
+    monkeypatch.setattr(servidor, "CONFERIR_HISTORICO_DB", caminho)
+    monkeypatch.setattr(servidor, "_historico_pronto", False)
+    return caminho
+
+
+def conferir(pdf: bytes, planilha: bytes) -> dict:
+    return asyncio.run(servidor.conferir_caixa(
+        pdfs=[UploadFile(io.BytesIO(pdf), filename="extrato.pdf")],
+        excels=[UploadFile(io.BytesIO(planilha), filename="caixa.xlsx")],
+        data=None, senha=None, debug=False, timings=False,
+    ))
+
+
+def test_reenviar_planilha_com_extrato_de_outro_dia(historico):
+    transacoes = [t for t in gerar_transacoes(30, seed=8) if not t["cnpj"]]
+    planilha = planilha_agentes(transacoes, proporcao_casadas=1.0)
+    extrato = pdf_bb(transacoes)
+    # PIX de outro dia, com valores que não batem com nenhuma linha da planilha
+    outro_dia = pdf_bb([dict(t, valor=t["valor"] + 1000) for t in gerar_transacoes(10, seed=9, dia="16/10/2025")])
+
+    primeira = conferir(extrato, planilha)
+    conferir(outro_dia, planilha)
+
+    with sqlite3.connect(historico) as conexao:
+        linhas = conexao.execute("SELECT COUNT(*), COUNT(DISTINCT dia), COUNT(pix_id) FROM caixa").fetchone()
+        pix = conexao.execute("SELECT COUNT(*) FROM pix").fetchone()[0]
+        pares = conexao.execute(
+            "SELECT caixa.nome, pix.nome, pix.data FROM caixa JOIN pix ON pix.id = caixa.pix_id ORDER BY caixa.linha"
+        ).fetchall()
+    total_planilha = len(primeira["conferidos"]) + len(primeira["faltando_no_pdf"])
+    assert linhas == (total_planilha, 1, len(primeira["conferidos"]))
+    assert pix == len(transacoes) + 10
+    assert all(data == 20251015 for _, _, data in pares)
+    assert sorted(c["nome_pdf"] for c in primeira["conferidos"]) == sorted(nome_pdf for _, nome_pdf, _ in pares)
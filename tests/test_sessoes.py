@@ -0,0 +1,84 @@
+"""
+Sessões: qualquer ordem de envio dos arquivos tem de dar o mesmo resultado do
+/conferir_caixa com todos os arquivos de uma vez (na ordem em que entraram na sessão).
+"""
+import asyncio
+import io
+import itertools
+
+import pytest
+from starlette.datastructures import UploadFile
+
+import servidor
+from gerar_dados import gerar_transacoes, pdf_bb, pdf_c6, planilha_agentes
+
+LISTAS = ("conferidos", "faltando_no_pdf", "faltando_no_excel")
+
+
+def arquivos_de_teste():
+    """Dois extratos e duas planilhas com nomes parecidos entre os bancos."""
+    transacoes = gerar_transacoes(120, seed=5)
+    outras = gerar_transacoes(60, seed=11)
+    return {
+        "bb.pdf": ("pdf", pdf_bb(transacoes[:60])),
+        "c6.pdf": ("pdf", pdf_c6(transacoes[60:] + outras[:20])),
+        "caixa1.xlsx": ("excel", planilha_agentes(transacoes[::2] + outras[:10], proporcao_casadas=0.7, seed=3)),
+        "caixa2.xlsx": ("excel", planilha_agentes(transacoes[1::2] + outras[10:20], proporcao_casadas=0.7, seed=4)),
+    }
+
+
+def upload(nome: str, conteudo: bytes) -> UploadFile:
+    return UploadFile(io.BytesIO(conteudo), filename=nome)
+
+
+def listas(resposta: dict) -> dict:
+    return {chave: resposta[chave] for chave in LISTAS}
+
+
+async def conferencia_completa(arquivos: dict, ordem: list) -> dict:
+    pdfs = [upload(nome, arquivos[nome][1]) for nome in ordem if arquivos[nome][0] == "pdf"]
+    excels = [upload(nome, arquivos[nome][1]) for nome in ordem if arquivos[nome][0] == "excel"]
+    return await servidor.conferir_caixa(pdfs=pdfs, excels=excels, data=None, senha=None, debug=False, timings=False)
+
+
+async def enviar(sessao_id: str, arquivos: dict, nomes: list) -> dict:
+    pdfs = [upload(nome, arquivos[nome][1]) for nome in nomes if arquivos[nome][0] == "pdf"]
+    excels = [upload(nome, arquivos[nome][1]) for nome in nomes if arquivos[nome][0] == "excel"]
+    return await servidor.adicionar_arquivos_sessao(sessao_id, pdfs=pdfs, excels=excels, senha=None)
+
+
+@pytest.fixture(scope="module")
+def arquivos():
+    return arquivos_de_teste()
+
+
+@pytest.mark.parametrize("ordem", list(itertools.permutations(["bb.pdf", "c6.pdf", "caixa1.xlsx", "caixa2.xlsx"])))
+def test_qualquer_ordem_igual_a_conferencia_completa(arquivos, ordem):
+    async def cenario():
+        sessao_id = (await servidor.criar_sessao())["sessao_id"]
+        try:
+            for nome in ordem:
+                resposta = await enviar(sessao_id, arquivos, [nome])
+            assert listas(resposta) == listas(await conferencia_completa(arquivos, list(ordem)))
+        finally:
+            await servidor.encerrar_sessao(sessao_id)
+
+    asyncio.run(cenario())
+
+
+def test_remover_arquivo_igual_a_conferencia_sem_ele(arquivos):
+    async def cenario():
+        ordem = ["caixa1.xlsx", "bb.pdf", "caixa2.xlsx", "c6.pdf"]
+        sessao_id = (await servidor.criar_sessao())["sessao_id"]
+        try:
+            resposta = await enviar(sessao_id, arquivos, ordem[:2])
+            resposta = await enviar(sessao_id, arquivos, ordem[2:])
+            for removido in ("caixa1.xlsx", "c6.pdf"):
+                arquivo_id = next(a["id"] for a in resposta["arquivos"] if a["nome"] == removido)
+                resposta = await servidor.remover_arquivo_sessao(sessao_id, arquivo_id)
+                ordem.remove(removido)
+                assert listas(resposta) == listas(await conferencia_completa(arquivos, ordem))
+        finally:
+            await servidor.encerrar_sessao(sessao_id)
+
+    asyncio.run(cenario())